@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_ARRAYS = ['feature_mean', 'feature_scale', 'centroids', 'vectors', 'row_ids', 'list_offsets']
+# Bumped whenever the stored layout or search space changes, so old saved indexes are rebuilt
+INDEX_FORMAT = 2
+
+
+def nearest_centroids(vectors, centroids, chunk_size=65536):
+    """Index of the closest (L2) centroid for every row"""
+    # argmin |x - c|² = argmax x·c - |c|²/2
+    offsets = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        assignment[start:start + chunk_size] = np.argmax(chunk @ centroids.T - offsets, axis=1)
+    return assignment
+
+
+class IVFIndex:
+    """Inverted-file (k-means bucket) index for nearest-neighbour search over a large track catalog.
+
+    Raw audio features are standardised with catalog-wide statistics and
+    grouped by nearest (L2) k-means centroid. Rows of each bucket are stored
+    contiguously (`vectors[list_offsets[i]:list_offsets[i+1]]`), so a query
+    only scans the buckets closest to it. `row_ids` maps stored rows back to
+    the catalog row they came from.
+
+    Distances are Euclidean in the standardised space, or under a per-query
+    linear `metric` over the raw features, e.g. a user's own scaler + PCA, so
+    the index can shortlist in the same space the exact scorer ranks in.
+    """
+
+    def __init__(self, feature_mean, feature_scale, centroids, vectors, row_ids, list_offsets):
+        self.feature_mean = feature_mean
+        self.feature_scale = feature_scale
+        self.centroids = centroids
+        self.vectors = vectors
+        self.row_ids = row_ids
+        self.list_offsets = list_offsets
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, iterations=15, sample_size=100000, seed=0):
+        """Build an index over raw feature rows"""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        n = matrix.shape[0]
+        rng = np.random.default_rng(seed)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+
+        feature_mean = matrix.mean(axis=0)
+        feature_scale = matrix.std(axis=0)
+        feature_scale[feature_scale == 0] = 1.0
+
+        index = cls(feature_mean, feature_scale, None, None, None, None)
+        vectors = index.transform(matrix).astype(np.float32)
+
+        # Lloyd's k-means on a sample, then assign every row
+        train = vectors[rng.choice(n, size=min(n, sample_size), replace=False)]
+        centroids = train[rng.choice(train.shape[0], size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = nearest_centroids(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, train)
+            counts = np.bincount(assignment, minlength=n_lists)
+            empty = counts == 0
+            centroids = sums / np.maximum(counts, 1)[:, None]
+            # Reseed empty buckets with random training rows
+            centroids[empty] = train[rng.choice(train.shape[0], size=int(empty.sum()))]
+
+        assignment = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=n_lists)
+
+        index.centroids = centroids.astype(np.float32)
+        index.vectors = np.ascontiguousarray(vectors[order])
+        index.row_ids = order.astype(np.int64)
+        index.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return index
+
+    def transform(self, raw):
+        """Standardise raw feature rows into the index's search space"""
+        raw = np.atleast_2d(np.asarray(raw, dtype=np.float64))
+        return (raw - self.feature_mean) / self.feature_scale
+
+    def query(self, raw_query, k=10, n_probe=8, metric=None):
+        """Approximate k nearest catalog rows to one raw feature vector; returns (row_ids, distances), nearest first.
+
+        `metric` is an optional (features, d) matrix: distances are then
+        measured between raw rows projected by it. The `n_probe` closest
+        buckets are scanned, and further ones until at least k rows are seen.
+        """
+        q = self.transform(raw_query)[0].astype(np.float32)
+        # Differences in the standardised space map back to raw units by feature_scale
+        weights = np.diag(self.feature_scale) @ metric if metric is not None else np.eye(q.shape[0])
+        weights = weights.astype(np.float32)
+
+        centroid_distances = np.linalg.norm((self.centroids - q) @ weights, axis=1)
+        sizes = np.diff(self.list_offsets)
+        order = np.argsort(centroid_distances, kind='stable')
+        n_probe = max(min(n_probe, self.n_lists), int(np.searchsorted(np.cumsum(sizes[order]), k)) + 1)
+        slices = [(self.list_offsets[i], self.list_offsets[i + 1]) for i in order[:n_probe]]
+
+        rows = np.concatenate([np.arange(start, end) for start, end in slices]) if slices else np.empty(0, np.int64)
+        if rows.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        distances = np.concatenate([
+            np.linalg.norm((self.vectors[start:end] - q) @ weights, axis=1) for start, end in slices
+        ])
+
+        k = min(k, rows.size)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return np.asarray(self.row_ids[rows[top]]), distances[top]
+
+    def save(self, directory):
+        """Write the index as one .npy file per array"""
+        os.makedirs(directory, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'index.json'), 'w') as f:
+            json.dump({"format": INDEX_FORMAT, "rows": len(self), "n_lists": self.n_lists}, f)
+
+    @staticmethod
+    def saved_format(directory):
+        """Format version of a saved index, or None if there is none"""
+        try:
+            with open(os.path.join(directory, 'index.json')) as f:
+                return json.load(f).get('format', 1)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a saved index; with mmap the large arrays are paged in on demand and shared between processes"""
+        mmap_mode = 'r' if mmap else None
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in INDEX_ARRAYS
+        }
+        return cls(**arrays)
+
+
+def main():
+    from candidate_pool import CandidateSnapshot, measure_ann_recall, sample_user_profiles
+    from feature_cache import FEATURE_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Build an IVF index over a raw audio feature matrix and report recall")
+    parser.add_argument('features', help=".npy file with one raw feature row per catalog track (FEATURE_COLUMNS order)")
+    parser.add_argument('output', help="directory to write the index to")
+    parser.add_argument('--lists', type=int, default=None, help="number of k-means buckets (default sqrt(rows))")
+    parser.add_argument('--queries', type=int, default=50, help="synthetic users drawn from the catalog for the recall report")
+    parser.add_argument('-k', type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    matrix = np.load(args.features, mmap_mode='r')
+
+    start = time.perf_counter()
+    index = IVFIndex.build(matrix, n_lists=args.lists)
+    logger.info(f"Built index over {len(index)} rows in {index.n_lists} lists in {time.perf_counter() - start:.1f}s")
+    index.save(args.output)
+
+    snapshot = CandidateSnapshot(range(matrix.shape[0]), matrix, FEATURE_COLUMNS, 0, ann=IVFIndex.load(args.output))
+    profiles = sample_user_profiles(matrix, FEATURE_COLUMNS, args.queries)
+    print(json.dumps(measure_ann_recall(snapshot, profiles, k=args.k), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,26 @@
-from flask import Flask, request, jsonify, session, redirect, send_from_directory
+from flask import Flask, Response, g, request, jsonify, session, redirect
 from flask_cors import CORS
-import spotipy
 from spotipy.oauth2 import SpotifyOAuth
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.decomposition import PCA
 import os
+from concurrent.futures import as_completed, wait
 from datetime import datetime
+import threading
+import time
+import json
 import pickle
 import logging
 from dotenv import load_dotenv
+from spotify_fetch import create_fetcher
+from spotify_client import NoTokenCache, create_client_manager, create_http_session
+from shared_queries import create_shared_query_cache
+from recommendation_cache import create_recommendation_cache
+from job_queue import QueueFull
+from metrics import REGISTRY, HTTP_REQUEST_SECONDS, create_slow_request_profiler, stage, timed_stage
+from tracks import slim_tracks
+from static_files import StaticFiles
+
+# The ML stack (NumPy, pandas and the modules built on them) is imported on
+# first use, so login and static requests on a cold machine never pay for it
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,7 +29,8 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__, static_folder='static', static_url_path='')
+# The built frontend is served by StaticFiles below rather than Flask's static route
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
 CORS(app, supports_credentials=True)
 
@@ -31,68 +41,171 @@ SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', '')
 DEFAULT_REDIRECT_URI = 'http://127.0.0.1:5000/api/callback'
 SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIFY_REDIRECT_URI', DEFAULT_REDIRECT_URI)
 
-# Spotify OAuth setup
+# One keep-alive connection pool shared by every Spotify call in the process
+http_session = create_http_session()
+
+# Spotify OAuth setup; tokens are kept in each user's session, not in a shared cache
 sp_oauth = SpotifyOAuth(
     client_id=SPOTIFY_CLIENT_ID,
     client_secret=SPOTIFY_CLIENT_SECRET,
     redirect_uri=SPOTIFY_REDIRECT_URI,
-    scope="user-read-recently-played user-top-read user-library-read playlist-read-private user-read-private streaming"
+    scope="user-read-recently-played user-top-read user-library-read playlist-read-private user-read-private streaming",
+    requests_session=http_session,
+    cache_handler=NoTokenCache()
 )
+spotify_clients = create_client_manager(sp_oauth, http_session)
+
+# Each user's candidates are ranked this deep in one pass, so further pages are
+# slices of the cached ranking; requests may page down to RECOMMENDATION_MAX_DEPTH
+RECOMMENDATION_DEPTH = int(os.environ.get('RECOMMENDATION_DEPTH', 50))
+RECOMMENDATION_MAX_DEPTH = int(os.environ.get('RECOMMENDATION_MAX_DEPTH', 500))
+
+# Most tracks Spotify's recommendations endpoint returns in one call
+SPOTIFY_RECOMMENDATION_LIMIT = 100
+
+# The top RERANK_POOL_FACTOR × depth candidates by similarity are re-ranked for
+# variety: RERANK_DIVERSITY trades relevance against similarity to tracks already
+# picked (0 disables it) and RERANK_ARTIST_CAP limits tracks per artist (0 = no cap)
+RERANK_POOL_FACTOR = int(os.environ.get('RERANK_POOL_FACTOR', 5))
+RERANK_DIVERSITY = float(os.environ.get('RERANK_DIVERSITY', 0.3))
+RERANK_ARTIST_CAP = int(os.environ.get('RERANK_ARTIST_CAP', 2))
+
+# Share of ranked places given to tracks co-listened by similar users (see cooccurrence.py)
+COOCCURRENCE_SHARE = float(os.environ.get('COOCCURRENCE_SHARE', 0.2))
+
+# After each candidate pool rebuild, this many recently served users are
+# re-ranked in one batch so their next request is a cache hit (0 = off)
+RERANK_ACTIVE_USERS = int(os.environ.get('RERANK_ACTIVE_USERS', 1000))
+
+def blend_tracks(primary, secondary, share, size):
+    """Up to `size` tracks with about every 1/share-th place taken from `secondary`, deduped by ID"""
+    primary, secondary = iter(primary), iter(secondary)
+    blended, seen, taken = [], set(), 0
+    while len(blended) < size:
+        use_secondary = taken + 1 <= share * (len(blended) + 1)
+        track = next(secondary if use_secondary else primary, None)
+        if track is None:
+            # One side ran out; fill from the other
+            track = next(primary if use_secondary else secondary, None)
+            if track is None:
+                break
+        elif use_secondary:
+            taken += 1
+        if track.id not in seen:
+            seen.add(track.id)
+            blended.append(track)
+    return blended
 
 class SongRecommender:
     def __init__(self):
-        self.scaler = StandardScaler()
-        self.pca = PCA(n_components=10)
         self.user_profile = None
-        self.tracks_features = pd.DataFrame()
+        self.fetcher = create_fetcher()
+        # Searches and genre seeds are the same for every user; concurrent
+        # identical calls share one upstream request and a short-lived result
+        self.shared_queries = create_shared_query_cache()
+        self.recommendation_cache = create_recommendation_cache()
+        self._feature_cache = None
+        self._candidate_pool = None
+        self._cooccurrence = None
+        self._init_lock = threading.Lock()
+    
+    @property
+    def feature_cache(self):
+        if self._feature_cache is None:
+            with self._init_lock:
+                if self._feature_cache is None:
+                    from feature_cache import create_feature_cache
+                    self._feature_cache = create_feature_cache()
+        return self._feature_cache
+    
+    @property
+    def candidate_pool(self):
+        if self._candidate_pool is None:
+            with self._init_lock:
+                if self._candidate_pool is None:
+                    from candidate_pool import create_candidate_pool
+                    client_factory = None
+                    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+                        client_factory = spotify_clients.app_client_factory(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
+                    pool = create_candidate_pool(self.extract_audio_features, client_factory)
+                    pool.on_rebuild = self.rerank_active_users
+                    self._candidate_pool = pool
+        return self._candidate_pool
         
+    @property
+    def cooccurrence(self):
+        """Cross-user co-occurrence index, or None when COOCCURRENCE_PATH is unset"""
+        if self._cooccurrence is None:
+            with self._init_lock:
+                if self._cooccurrence is None:
+                    from cooccurrence import create_cooccurrence_index
+                    self._cooccurrence = create_cooccurrence_index() or False
+        return self._cooccurrence or None
+    
+    def record_listening(self, user_id, tracks, merge=False):
+        """Add a user's analyzed tracks to the co-occurrence index; never fails the analysis"""
+        try:
+            if self.cooccurrence is not None and user_id:
+                self.cooccurrence.record(user_id, tracks, merge=merge)
+        except Exception as e:
+            logger.warning(f"Could not record listening history for co-occurrence: {e}")
+    
+    def similar_listener_tracks(self, user_id, k):
+        """Tracks played by users who share this user's tracks (empty if unknown or disabled)"""
+        if self.cooccurrence is None or not user_id:
+            return []
+        try:
+            with stage('similar_listeners'):
+                return self.cooccurrence.recommend(user_id, k)
+        except Exception as e:
+            logger.warning(f"Co-occurrence lookup failed: {e}")
+            return []
+    
+    @timed_stage('feature_extraction')
     def extract_audio_features(self, tracks, sp):
-        """Extract audio features for a list of tracks"""
+        """Extract audio features for a list of Track records"""
+        import numpy as np
+        import pandas as pd
+        from feature_cache import FEATURE_COLUMNS
+        
         try:
-            track_ids = [track['id'] for track in tracks if track and track.get('id')]
-            logger.info(f"Extracting features for {len(track_ids)} tracks")
+            track_ids = list(dict.fromkeys(track.id for track in tracks))
+            logger.debug("Extracting features for %d tracks", len(track_ids))
             
             if not track_ids:
                 logger.warning("No valid track IDs found")
                 return pd.DataFrame()
+            
+            # Only tracks missing from the cache are requested from Spotify
+            vectors, missing_ids = self.feature_cache.get_many(track_ids)
+            logger.info(f"Feature cache: {len(vectors)} cached, {len(missing_ids)} to fetch")
                 
-            # Get audio features in batches of 100
-            features_list = []
-            for i in range(0, len(track_ids), 100):
-                batch = track_ids[i:i+100]
+            # Get audio features in batches of 100, fetched concurrently
+            for batch_number, future in self._submit_feature_batches(missing_ids, sp):
                 try:
-                    logger.info(f"Getting features for batch {i//100 + 1}, {len(batch)} tracks")
-                    features = sp.audio_features(batch)
-                    if features:
-                        valid_features = [f for f in features if f is not None]
-                        features_list.extend(valid_features)
-                        logger.info(f"Got {len(valid_features)} valid features from batch")
-                    else:
-                        logger.warning(f"No features returned for batch {i//100 + 1}")
+                    vectors.update(future.result())
                 except Exception as batch_error:
-                    logger.error(f"Error getting features for batch {i//100 + 1}: {batch_error}")
+                    logger.error(f"Error getting features for batch {batch_number}: {batch_error}")
                     continue
             
-            if not features_list:
+            valid_ids = [track_id for track_id in track_ids if vectors.get(track_id) is not None]
+            if not valid_ids:
                 logger.error("No audio features could be retrieved")
                 return pd.DataFrame()
                 
-            logger.info(f"Total features retrieved: {len(features_list)}")
-            
-            # Convert to DataFrame
-            df = pd.DataFrame(features_list)
-            logger.info(f"DataFrame created with shape: {df.shape}")
+            logger.info(f"Total features retrieved: {len(valid_ids)}")
             
-            # Select relevant features for ML
-            feature_cols = [
-                'danceability', 'energy', 'key', 'loudness', 'mode',
-                'speechiness', 'acousticness', 'instrumentalness',
-                'liveness', 'valence', 'tempo', 'time_signature'
-            ]
+            # Convert to DataFrame indexed by track ID
+            df = pd.DataFrame(
+                np.vstack([vectors[track_id] for track_id in valid_ids]),
+                index=valid_ids,
+                columns=FEATURE_COLUMNS
+            )
+            logger.debug("DataFrame created with shape: %s", df.shape)
             
             # Check which columns are available
-            available_cols = [col for col in feature_cols if col in df.columns]
-            missing_cols = [col for col in feature_cols if col not in df.columns]
+            available_cols = [col for col in FEATURE_COLUMNS if df[col].notna().any()]
+            missing_cols = [col for col in FEATURE_COLUMNS if col not in available_cols]
             
             if missing_cols:
                 logger.warning(f"Missing columns: {missing_cols}")
@@ -102,106 +215,242 @@ class SongRecommender:
                 return pd.DataFrame()
             
             result_df = df[available_cols].fillna(0)
-            logger.info(f"Final feature DataFrame shape: {result_df.shape}")
+            logger.debug("Final feature DataFrame shape: %s", result_df.shape)
             return result_df
             
         except Exception as e:
             logger.error(f"Error in extract_audio_features: {e}")
             return pd.DataFrame()
     
+    def prefetch_audio_features(self, tracks, sp):
+        """Start fetching features for uncached tracks in the background; returns the batch futures"""
+        track_ids = list(dict.fromkeys(track.id for track in tracks))
+        _, missing_ids = self.feature_cache.get_many(track_ids, record_stats=False)
+        return [future for _, future in self._submit_feature_batches(missing_ids, sp)]
+    
+    def _submit_feature_batches(self, track_ids, sp):
+        return [
+            (i//100 + 1, self.fetcher.submit(self._fetch_feature_batch, track_ids[i:i+100], sp))
+            for i in range(0, len(track_ids), 100)
+        ]
+    
+    def _fetch_feature_batch(self, batch, sp):
+        """Fetch one batch of up to 100 audio features and store them in the cache"""
+        from feature_cache import features_to_vector
+        
+        logger.debug("Getting features for %d tracks", len(batch))
+        features = sp.audio_features(batch)
+        if not features:
+            logger.warning(f"No features returned for batch of {len(batch)} tracks")
+            return {}
+        
+        fetched = {track_id: None for track_id in batch}
+        for f in features:
+            if f is not None and f.get('id') in fetched:
+                fetched[f['id']] = features_to_vector(f)
+        self.feature_cache.put_many(fetched)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Got %d valid features from batch", sum(v is not None for v in fetched.values()))
+        return fetched
+    
+    @timed_stage('model_fit')
     def create_user_profile(self, user_tracks_features):
         """Create user profile based on listening history"""
+        from user_model import fit_user_model
+        
         if user_tracks_features.empty:
             return None
             
         # Calculate mean preferences
         user_profile = user_tracks_features.mean()
         
-        # Apply PCA for dimensionality reduction
-        scaled_features = self.scaler.fit_transform(user_tracks_features)
-        pca_features = self.pca.fit_transform(scaled_features)
+        # Apply PCA for dimensionality reduction; the fitted model is kept per user
+        model, pca_profile, stats = fit_user_model(user_tracks_features)
         
         return {
             'preferences': user_profile.to_dict(),
-            'pca_profile': np.mean(pca_features, axis=0)
+            'pca_profile': pca_profile,
+            'model': model,
+            'stats': stats
         }
     
-    def get_recommendations(self, sp, user_profile, seed_tracks=None, num_recommendations=10):
+    @timed_stage('model_update')
+    def update_user_profile(self, user_profile, new_tracks_features, decay=1.0):
+        """Fold newly played tracks into an existing profile without refitting from scratch"""
+        import numpy as np
+        from user_model import refit_user_model, update_stats
+        
+        columns = user_profile['model']['columns']
+        values = new_tracks_features.reindex(columns=columns, fill_value=0).to_numpy(dtype=np.float64)
+        
+        stats = update_stats(user_profile['stats'], values, decay)
+        model, pca_profile = refit_user_model(stats, columns)
+        
+        updated = dict(user_profile)
+        updated.update({
+            'preferences': dict(zip(columns, (stats['sum'] / stats['count']).tolist())),
+            'pca_profile': pca_profile,
+            'model': model,
+            'stats': stats
+        })
+        return updated
+    
+    def get_recommendations(self, sp, user_profile, seed_tracks=None, num_recommendations=10, offset=0, user_id=None):
         """Get song recommendations based on user profile"""
+        events = self.iter_recommendations(sp, user_profile, seed_tracks, num_recommendations, offset, user_id)
+        return [item for kind, item in events if kind == 'track']
+    
+    def iter_recommendations(self, sp, user_profile, seed_tracks=None, num_recommendations=10, offset=0, user_id=None):
+        """Recommendation pipeline as a generator.
+        
+        Yields ('progress', {'stage': ...}) as each stage starts and
+        ('track', track) as soon as a track is ranked or found. `offset`
+        skips that many of the best tracks; with a `user_id` the ranking is
+        cached, so later pages need no rescoring, and tracks played by
+        similar users are blended in.
+        """
+        end = offset + num_recommendations
+        # If in fallback mode or seed tracks provided, use Spotify's recommendation API
+        if user_profile.get('fallback_mode', False) or seed_tracks:
+            # ...unless enough similar users are known to answer without any Spotify calls
+            if user_profile.get('fallback_mode', False) and self.cooccurrence is not None:
+                yield 'progress', {'stage': 'similar_listeners'}
+                similar = self.similar_listener_tracks(user_id, end)
+                if len(similar) >= end:
+                    for track in similar[offset:end]:
+                        yield 'track', track
+                    return
+            yield from self.iter_cached_spotify_recommendations(sp, user_profile, seed_tracks, offset, end, user_id)
+            return
+        
         try:
-            # If in fallback mode or seed tracks provided, use Spotify's recommendation API
-            if user_profile.get('fallback_mode', False) or seed_tracks:
-                return self.get_spotify_recommendations(sp, seed_tracks, num_recommendations)
+            # Original ML-based approach, scored against the shared candidate pool
+            yield 'progress', {'stage': 'candidates'}
+            with stage('candidates'):
+                candidates = self.candidate_pool.get(sp)
             
-            # Original ML-based approach
-            # Get popular tracks from various genres
-            genres = ['pop', 'rock', 'hip-hop', 'electronic', 'indie', 'alternative']
-            candidate_tracks = []
+            if candidates is None or not len(candidates):
+                return
             
-            for genre in genres:
-                try:
-                    # Search for tracks in each genre
-                    results = sp.search(q=f'genre:{genre}', type='track', limit=50)
-                    candidate_tracks.extend(results['tracks']['items'])
-                except Exception as e:
-                    logger.warning(f"Error searching genre {genre}: {e}")
-                    continue
-            
-            if not candidate_tracks:
-                # Fallback: get featured playlists
-                playlists = sp.featured_playlists(limit=5)
-                for playlist in playlists['playlists']['items']:
-                    try:
-                        tracks = sp.playlist_tracks(playlist['id'], limit=20)
-                        candidate_tracks.extend([item['track'] for item in tracks['items'] if item['track']])
-                    except Exception as e:
-                        logger.warning(f"Error getting playlist tracks: {e}")
-                        continue
-            
-            # Remove duplicates
-            seen_ids = set()
-            unique_tracks = []
-            for track in candidate_tracks:
-                if track and track.get('id') and track['id'] not in seen_ids:
-                    seen_ids.add(track['id'])
-                    unique_tracks.append(track)
-            
-            if not unique_tracks:
-                return []
-            
-            # Extract features for candidate tracks
-            candidate_features = self.extract_audio_features(unique_tracks, sp)
-            
-            if candidate_features.empty:
-                return unique_tracks[:num_recommendations]
-            
-            # Scale candidate features
-            scaled_candidates = self.scaler.transform(candidate_features)
-            candidate_pca = self.pca.transform(scaled_candidates)
-            
-            # Calculate similarity with user profile
-            user_pca_profile = user_profile['pca_profile'].reshape(1, -1)
-            similarities = cosine_similarity(user_pca_profile, candidate_pca)[0]
-            
-            # Get top recommendations
-            top_indices = np.argsort(similarities)[-num_recommendations:][::-1]
-            recommendations = [unique_tracks[i] for i in top_indices]
-            
-            return recommendations
+            # Project candidates with the user's own scaler/PCA and rank them; the ranking is
+            # reused until the profile, the candidate snapshot or the co-occurrence index changes
+            profile_version = user_profile.get('updated_at')
+            cooccurrence_version = self.cooccurrence.version if self.cooccurrence is not None else None
+            candidate_version = (candidates.version, cooccurrence_version)
+            ranked = self.recommendation_cache.get(user_id, profile_version, candidate_version, end)
+            if ranked is None:
+                depth = max(end, RECOMMENDATION_DEPTH)
+                yield 'progress', {'stage': 'scoring', 'candidates': len(candidates)}
+                with stage('scoring'):
+                    shortlist = candidates.top_k([user_profile], depth * RERANK_POOL_FACTOR)[0]
+                yield 'progress', {'stage': 'reranking', 'candidates': len(shortlist)}
+                with stage('reranking'):
+                    rows = candidates.rerank(user_profile, shortlist, depth, RERANK_DIVERSITY, RERANK_ARTIST_CAP)
+                    ranked = [candidates.tracks[i] for i in rows]
+                if COOCCURRENCE_SHARE > 0 and self.cooccurrence is not None:
+                    yield 'progress', {'stage': 'similar_listeners'}
+                    similar = self.similar_listener_tracks(user_id, depth)
+                    ranked = blend_tracks(ranked, similar, COOCCURRENCE_SHARE, depth)
+                self.recommendation_cache.put(user_id, profile_version, candidate_version, ranked, depth)
             
         except Exception as e:
             logger.error(f"Error in get_recommendations: {e}")
-            return self.get_spotify_recommendations(sp, seed_tracks, num_recommendations)
+            yield from self.iter_cached_spotify_recommendations(sp, user_profile, seed_tracks, offset, end, user_id)
+            return
+        
+        for track in ranked[offset:end]:
+            yield 'track', track
+    
+    def iter_cached_spotify_recommendations(self, sp, user_profile, seed_tracks, offset, end, user_id):
+        """Spotify's recommendations for the seeds, fetched once and paged through like the ML ranking.
+        
+        Spotify answers differently on every call, so re-fetching each page
+        would repeat and skip tracks. The list is fetched as deep as one call
+        allows, so every page of it is consistent, and cached per user under
+        the seeds it was fetched for.
+        """
+        if isinstance(seed_tracks, str):
+            seed_tracks = seed_tracks.split(',')
+        profile_version = user_profile.get('updated_at')
+        candidate_version = ('spotify', tuple(seed_tracks) if seed_tracks else None)
+        depth = SPOTIFY_RECOMMENDATION_LIMIT
+        ranked = self.recommendation_cache.get(user_id, profile_version, candidate_version, min(end, depth))
+        if ranked is None:
+            ranked = []
+            for kind, item in self.iter_spotify_recommendations(sp, seed_tracks, depth):
+                if kind == 'track':
+                    ranked.append(item)
+                else:
+                    yield kind, item
+            if ranked:
+                self.recommendation_cache.put(user_id, profile_version, candidate_version, ranked, depth)
+        for track in ranked[offset:end]:
+            yield 'track', track
+    
+    def precompute_recommendations(self, user_profiles, candidates=None, depth=RECOMMENDATION_DEPTH):
+        """Rank many users against the candidate pool in one batch and cache their rankings.
+        
+        `user_profiles` maps user IDs to stored profiles; fallback and missing
+        profiles are skipped. Returns the number of users ranked.
+        """
+        if candidates is None:
+            candidates = self.candidate_pool.snapshot
+        profiles = {
+            user_id: profile for user_id, profile in user_profiles.items()
+            if profile and not profile.get('fallback_mode', False)
+        }
+        if candidates is None or not len(candidates) or not profiles:
+            return 0
+        
+        cooccurrence_version = self.cooccurrence.version if self.cooccurrence is not None else None
+        candidate_version = (candidates.version, cooccurrence_version)
+        user_ids = list(profiles)
+        with stage('scoring'):
+            shortlists = candidates.top_k([profiles[user_id] for user_id in user_ids], depth * RERANK_POOL_FACTOR)
+        for user_id, shortlist in zip(user_ids, shortlists):
+            profile = profiles[user_id]
+            with stage('reranking'):
+                rows = candidates.rerank(profile, shortlist, depth, RERANK_DIVERSITY, RERANK_ARTIST_CAP)
+                ranked = [candidates.tracks[i] for i in rows]
+            if COOCCURRENCE_SHARE > 0 and self.cooccurrence is not None:
+                ranked = blend_tracks(ranked, self.similar_listener_tracks(user_id, depth), COOCCURRENCE_SHARE, depth)
+            self.recommendation_cache.put(user_id, profile.get('updated_at'), candidate_version, ranked, depth)
+        return len(user_ids)
+    
+    def rerank_active_users(self, candidates=None):
+        """Re-rank the most recently served users, e.g. after the candidate pool was rebuilt"""
+        if RERANK_ACTIVE_USERS <= 0:
+            return 0
+        user_ids = self.recommendation_cache.users(RERANK_ACTIVE_USERS)
+        if not user_ids:
+            return 0
+        store = get_profile_store()
+        started = time.perf_counter()
+        ranked = self.precompute_recommendations({user_id: store.get(user_id) for user_id in user_ids}, candidates)
+        logger.info(f"Re-ranked {ranked} active users in {time.perf_counter() - started:.2f}s")
+        return ranked
+    
+    def search_tracks(self, sp, query, limit):
+        """Track records for a track search, shared between users through shared_queries"""
+        def search_tracks(query, limit):
+            return slim_tracks(self.fetcher.call(sp.search, q=query, type='track', limit=limit)['tracks']['items'])
+        # Keyed on the query alone, so concurrent users share one upstream search
+        return self.shared_queries.call(search_tracks, query, limit)
     
     def get_spotify_recommendations(self, sp, seed_tracks=None, num_recommendations=10):
         """Get recommendations using Spotify's built-in recommendation system"""
+        return [item for kind, item in self.iter_spotify_recommendations(sp, seed_tracks, num_recommendations)
+                if kind == 'track']
+    
+    def iter_spotify_recommendations(self, sp, seed_tracks=None, num_recommendations=10):
+        """Generator behind get_spotify_recommendations, yielding the same events as iter_recommendations"""
         try:
             logger.info("Using Spotify's built-in recommendation system")
             
             if not seed_tracks:
                 # Get some popular tracks as seeds
-                results = sp.search(q='year:2023-2024', type='track', limit=5)
-                seed_tracks = [track['id'] for track in results['tracks']['items']]
+                yield 'progress', {'stage': 'seeds'}
+                seed_tracks = [track.id for track in self.search_tracks(sp, 'year:2023-2024', 5)]
             
             # Ensure seed_tracks is a list, not a string
             if isinstance(seed_tracks, str):
@@ -215,44 +464,60 @@ class SongRecommender:
             # Try different recommendation approaches
             try:
                 # First try: Use seed tracks
-                recommendations = sp.recommendations(
+                yield 'progress', {'stage': 'seed_recommendations'}
+                recommendations = self.fetcher.call(
+                    sp.recommendations,
                     seed_tracks=seed_tracks,
                     limit=num_recommendations
                 )
                 logger.info(f"Got {len(recommendations['tracks'])} recommendations using seed tracks")
-                return recommendations['tracks']
+                tracks = slim_tracks(recommendations['tracks'])
                 
             except Exception as seed_error:
                 logger.warning(f"Seed tracks failed: {seed_error}")
                 
                 # Second try: Use genres as seeds
                 try:
-                    available_genres = sp.recommendation_genre_seeds()['genres']
+                    yield 'progress', {'stage': 'genre_recommendations'}
+                    def recommendation_genre_seeds():
+                        return self.fetcher.call(sp.recommendation_genre_seeds)
+                    available_genres = self.shared_queries.call(recommendation_genre_seeds)['genres']
                     selected_genres = available_genres[:3]  # Use first 3 genres
                     logger.info(f"Trying with genres: {selected_genres}")
                     
-                    recommendations = sp.recommendations(
+                    recommendations = self.fetcher.call(
+                        sp.recommendations,
                         seed_genres=selected_genres,
                         limit=num_recommendations
                     )
                     logger.info(f"Got {len(recommendations['tracks'])} recommendations using genres")
-                    return recommendations['tracks']
+                    tracks = slim_tracks(recommendations['tracks'])
                     
                 except Exception as genre_error:
                     logger.warning(f"Genre recommendations failed: {genre_error}")
-                    
-                    # Third try: Get popular playlists
-                    return self.get_playlist_tracks(sp, num_recommendations)
+                    tracks = None
             
         except Exception as e:
             logger.error(f"Error getting Spotify recommendations: {e}")
-            return self.get_playlist_tracks(sp, num_recommendations)
+            tracks = None
+        
+        if tracks is None:
+            # Third try: Get popular playlists
+            yield from self.iter_playlist_tracks(sp, num_recommendations)
+            return
+        for track in tracks:
+            yield 'track', track
     
     def get_playlist_tracks(self, sp, num_recommendations=10):
         """Fallback: Get tracks using search (works with basic Spotify app permissions)"""
+        return [item for kind, item in self.iter_playlist_tracks(sp, num_recommendations) if kind == 'track']
+    
+    def iter_playlist_tracks(self, sp, num_recommendations=10):
+        """Generator behind get_playlist_tracks; each search's tracks are yielded as soon as it returns"""
         try:
             logger.info("Falling back to search-based recommendations")
             tracks = []
+            seen_ids = set()
             
             # Search for popular music using different terms
             search_terms = [
@@ -272,29 +537,126 @@ class SongRecommender:
                     break
                     
                 try:
-                    logger.info(f"Searching for: {term}")
-                    results = sp.search(q=term, type='track', limit=5)
+                    logger.debug("Searching for: %s", term)
+                    yield 'progress', {'stage': 'search', 'query': term}
+                    results = self.search_tracks(sp, term, 5)
                     
-                    for track in results['tracks']['items']:
-                        if track and len(tracks) < num_recommendations:
+                    for track in results:
+                        if len(tracks) < num_recommendations:
                             # Avoid duplicates
-                            if not any(t['id'] == track['id'] for t in tracks):
+                            if track.id not in seen_ids:
+                                seen_ids.add(track.id)
                                 tracks.append(track)
+                                yield 'track', track
                                 
                 except Exception as search_error:
                     logger.warning(f"Search failed for '{term}': {search_error}")
                     continue
             
             logger.info(f"Got {len(tracks)} tracks from search")
-            return tracks[:num_recommendations]
             
         except Exception as e:
             logger.error(f"Error getting search tracks: {e}")
-            return []
 
 # Initialize recommender
 recommender = SongRecommender()
 
+# User profiles live server-side; the session cookie only carries the key
+_profile_store = None
+
+def get_profile_store():
+    global _profile_store
+    if _profile_store is None:
+        from profile_store import create_profile_store
+        _profile_store = create_profile_store()
+    return _profile_store
+
+# Profiles are refitted from full history after this many seconds; in between
+# only new plays are folded in, with older history weighted down by PROFILE_DECAY
+PROFILE_FULL_REFRESH = int(os.environ.get('PROFILE_FULL_REFRESH', 7 * 24 * 3600))
+PROFILE_DECAY = float(os.environ.get('PROFILE_DECAY', 1.0))
+
+def session_user_id():
+    """Spotify user ID behind the session's profile handle, or None.
+
+    The session cookie is signed but readable, so it only carries an opaque
+    handle that the profile store maps back to the user.
+    """
+    handle = session.get('profile_key')
+    return get_profile_store().resolve_handle(handle) if handle else None
+
+def load_user_profile():
+    """Look up the current session's profile in the profile store"""
+    user_id = session_user_id()
+    return get_profile_store().get(user_id) if user_id else None
+
+def get_spotify_client(token_info):
+    """Spotify client for the session's token, storing a refreshed token back in the session"""
+    sp, current_token_info = spotify_clients.client_for(token_info)
+    if current_token_info is not token_info:
+        session['token_info'] = current_token_info
+    return sp
+
+# Opt-in cProfile dumps of slow requests (SLOW_REQUEST_PROFILE_MS)
+slow_request_profiler = create_slow_request_profiler()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = slow_request_profiler.start() if slow_request_profiler else None
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # Route templates, not raw paths, keep the label set small
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=str(response.status_code))
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            slow_request_profiler.stop(profiler, elapsed, f"{request.method} {request.path}")
+    return response
+
+@app.teardown_request
+def release_profiler(error=None):
+    # after_request is skipped when a view raises; never leave the profiler held
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        slow_request_profiler.stop(profiler, 0, request.path)
+
+def cache_metrics():
+    """Current counters of every initialised cache, keyed by (cache,)"""
+    caches = {
+        "shared_queries": recommender.shared_queries.stats(),
+        "recommendations": recommender.recommendation_cache.stats()
+    }
+    if recommender._feature_cache is not None:
+        stats = recommender._feature_cache.stats()
+        caches["audio_features"] = dict(stats, hits=stats['hits'] + stats['disk_hits'])
+    return caches
+
+REGISTRY.callback('cache_hits_total', "Cache lookups answered from the cache", ['cache'],
+                  lambda: {(name,): c['hits'] for name, c in cache_metrics().items()}, kind='counter')
+REGISTRY.callback('cache_misses_total', "Cache lookups that had to go upstream", ['cache'],
+                  lambda: {(name,): c['misses'] for name, c in cache_metrics().items()}, kind='counter')
+REGISTRY.callback('cache_hit_ratio', "Share of cache lookups answered from the cache", ['cache'],
+                  lambda: {(name,): c['hits'] / max(c['hits'] + c['misses'], 1) for name, c in cache_metrics().items()})
+REGISTRY.callback('cache_entries', "Entries currently held by each cache", ['cache'],
+                  lambda: {(name,): c['size'] for name, c in cache_metrics().items()})
+
+def candidate_pool_metrics():
+    pool = recommender._candidate_pool
+    snapshot = pool.snapshot if pool is not None else None
+    return {(): len(snapshot)} if snapshot is not None else {}
+
+REGISTRY.callback('candidate_pool_tracks', "Tracks in the current candidate pool snapshot", [], candidate_pool_metrics)
+
+@app.route('/api/metrics')
+def metrics():
+    """Prometheus text-format metrics for this worker process"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api')
 def api_info():
     return jsonify({"message": "Spotify Song Recommender API"})
@@ -310,6 +672,8 @@ def handle_spotify_callback():
     if code:
         token_info = sp_oauth.get_access_token(code)
         session['token_info'] = token_info
+        # The profile handle belongs to whoever was logged in before; it is set again on analysis
+        session.pop('profile_key', None)
         
         # Determine the correct frontend URL for redirect
         # In production, use the app domain; in development, use localhost:3000
@@ -345,8 +709,8 @@ def get_user_profile():
         return jsonify({"error": "Not authenticated"}), 401
     
     try:
-        sp = spotipy.Spotify(auth=token_info['access_token'])
-        user = sp.current_user()
+        sp = get_spotify_client(token_info)
+        user = recommender.fetcher.call(sp.current_user)
         return jsonify({
             "id": user['id'],
             "display_name": user['display_name'],
@@ -364,150 +728,325 @@ def analyze_listening_habits():
         return jsonify({"error": "Not authenticated"}), 401
     
     try:
-        sp = spotipy.Spotify(auth=token_info['access_token'])
+        sp = get_spotify_client(token_info)
+        body, status, user_id = analyze_user(sp, load_user_profile(), full=request.args.get('full') == '1')
+        if status == 200:
+            session['profile_key'] = get_profile_store().handle_for(user_id)
+        return jsonify(body), status
         
-        # Test API access first
+    except Exception as e:
+        logger.error(f"Error analyzing listening habits: {e}")
+        import traceback
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        return jsonify({
+            "error": f"Failed to analyze listening habits: {str(e)}"
+        }), 500
+
+@timed_stage('analysis')
+def analyze_user(sp, existing_profile=None, full=False, user_id=None):
+    """Analyze a user's listening history and store their profile.
+    
+    Works outside a request, so it can also run as a background job. The
+    user is looked up through `sp` unless `user_id` is already known.
+    Returns (response body, HTTP status, user ID or None).
+    """
+    fetcher = recommender.fetcher
+    
+    # Returning users only need the plays since their last analysis
+    if not full and can_update_incrementally(existing_profile):
+        return update_listening_habits(sp, existing_profile, user_id)
+    
+    # Issue the independent history calls concurrently, alongside the auth check
+    user_future = fetcher.submit(sp.current_user) if user_id is None else None
+    # (label, future, whether items wrap the track as item['track'])
+    history_futures = [
+        ('short_term top tracks', fetcher.submit(sp.current_user_top_tracks, limit=20, time_range='short_term'), False),
+        ('medium_term top tracks', fetcher.submit(sp.current_user_top_tracks, limit=20, time_range='medium_term'), False),
+        ('long_term top tracks', fetcher.submit(sp.current_user_top_tracks, limit=20, time_range='long_term'), False),
+        ('recent tracks', fetcher.submit(sp.current_user_recently_played, limit=50), True)
+    ]
+    
+    # Test API access first
+    if user_future is not None:
         try:
-            user = sp.current_user()
-            logger.info(f"Successfully authenticated user: {user['id']}")
+            user_id = user_future.result()['id']
+            logger.info(f"Successfully authenticated user: {user_id}")
         except Exception as auth_error:
             logger.error(f"Authentication test failed: {auth_error}")
-            return jsonify({"error": "Authentication failed. Please log in again."}), 401
-        
-        # Get user's data with better error handling
-        all_tracks = []
-        
+            return {"error": "Authentication failed. Please log in again."}, 401, None
+    
+    # Get user's data with better error handling. Feature lookups for each
+    # source start as soon as it arrives, overlapping the calls still in flight.
+    tracks_by_source = {}
+    feature_futures = []
+    recent_cursor = None
+    pending = {future: (label, wrapped) for label, future, wrapped in history_futures}
+    for future in as_completed(pending):
+        label, wrapped = pending[future]
         try:
-            # Get top tracks (these are more likely to exist)
-            logger.info("Fetching top tracks...")
-            top_tracks_short = sp.current_user_top_tracks(limit=20, time_range='short_term')
-            top_tracks_medium = sp.current_user_top_tracks(limit=20, time_range='medium_term')
-            top_tracks_long = sp.current_user_top_tracks(limit=20, time_range='long_term')
-            
-            all_tracks.extend(top_tracks_short['items'])
-            all_tracks.extend(top_tracks_medium['items']) 
-            all_tracks.extend(top_tracks_long['items'])
-            logger.info(f"Found {len(all_tracks)} top tracks")
-            
-        except Exception as top_tracks_error:
-            logger.warning(f"Error getting top tracks: {top_tracks_error}")
-        
+            page = future.result()
+            items = page['items']
+            if label == 'recent tracks':
+                recent_cursor = (page.get('cursors') or {}).get('after')
+            # Only slim records are kept; the raw JSON is dropped with the page
+            source_tracks = slim_tracks(item['track'] if wrapped else item for item in items)
+            tracks_by_source[label] = source_tracks
+            feature_futures.extend(recommender.prefetch_audio_features(source_tracks, sp))
+            logger.info(f"Found {len(source_tracks)} {label}")
+        except Exception as source_error:
+            logger.warning(f"Error getting {label}: {source_error}")
+    
+    all_tracks = []
+    for label, _, _ in history_futures:
+        all_tracks.extend(tracks_by_source.get(label, []))
+    
+    # If still no tracks, try saved tracks
+    if len(all_tracks) < 5:
         try:
-            # Get recently played tracks
-            logger.info("Fetching recently played tracks...")
-            recent_tracks = sp.current_user_recently_played(limit=50)
-            recent_track_items = [item['track'] for item in recent_tracks['items'] if item['track']]
-            all_tracks.extend(recent_track_items)
-            logger.info(f"Found {len(recent_track_items)} recent tracks")
-            
-        except Exception as recent_error:
-            logger.warning(f"Error getting recent tracks: {recent_error}")
-        
-        # If still no tracks, try saved tracks
-        if len(all_tracks) < 5:
-            try:
-                logger.info("Trying saved tracks...")
-                saved_tracks = sp.current_user_saved_tracks(limit=50)
-                saved_track_items = [item['track'] for item in saved_tracks['items'] if item['track']]
-                all_tracks.extend(saved_track_items)
-                logger.info(f"Found {len(saved_track_items)} saved tracks")
-            except Exception as saved_error:
-                logger.warning(f"Error getting saved tracks: {saved_error}")
-        
-        if not all_tracks:
-            return jsonify({
-                "error": "No listening history found. Please listen to some music on Spotify first, then try again."
-            }), 400
-        
-        # Remove duplicates
-        seen_ids = set()
-        unique_tracks = []
-        for track in all_tracks:
-            if track and track.get('id') and track['id'] not in seen_ids:
-                seen_ids.add(track['id'])
-                unique_tracks.append(track)
-        
-        logger.info(f"Found {len(unique_tracks)} unique tracks for analysis")
-        
-        if len(unique_tracks) < 3:
-            return jsonify({
-                "error": "Not enough tracks for analysis. Please listen to more music on Spotify first."
-            }), 400
-        
-        # Extract audio features
-        tracks_features = recommender.extract_audio_features(unique_tracks, sp)
+            logger.info("Trying saved tracks...")
+            saved_tracks = fetcher.call(sp.current_user_saved_tracks, limit=50)
+            saved_track_items = slim_tracks(item['track'] for item in saved_tracks['items'])
+            all_tracks.extend(saved_track_items)
+            logger.info(f"Found {len(saved_track_items)} saved tracks")
+        except Exception as saved_error:
+            logger.warning(f"Error getting saved tracks: {saved_error}")
+    
+    # Let prefetched feature batches land in the cache before extraction
+    wait(feature_futures)
+    
+    if not all_tracks:
+        return {
+            "error": "No listening history found. Please listen to some music on Spotify first, then try again."
+        }, 400, user_id
+    
+    # Remove duplicates
+    seen_ids = set()
+    unique_tracks = []
+    for track in all_tracks:
+        if track.id not in seen_ids:
+            seen_ids.add(track.id)
+            unique_tracks.append(track)
+    
+    logger.info(f"Found {len(unique_tracks)} unique tracks for analysis")
+    
+    if len(unique_tracks) < 3:
+        return {
+            "error": "Not enough tracks for analysis. Please listen to more music on Spotify first."
+        }, 400, user_id
+    
+    # Extract audio features
+    tracks_features = recommender.extract_audio_features(unique_tracks, sp)
+    
+    if tracks_features.empty:
+        import numpy as np
+        from user_model import PCA_COMPONENTS
         
-        if tracks_features.empty:
-            # Fallback: Use simplified analysis based on track metadata
-            logger.info("Audio features unavailable, using fallback analysis")
-            user_profile = {
-                'preferences': {
-                    'energy': 0.6,  # Default moderate values
-                    'danceability': 0.5,
-                    'valence': 0.5,
-                    'acousticness': 0.3,
-                    'instrumentalness': 0.1,
-                    'speechiness': 0.1,
-                    'liveness': 0.2,
-                    'loudness': -10,
-                    'tempo': 120,
-                    'key': 5,
-                    'mode': 1,
-                    'time_signature': 4
-                },
-                'pca_profile': [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],  # Default PCA values
-                'fallback_mode': True
-            }
-            session['user_profile'] = user_profile
-            
+        # Fallback: Use simplified analysis based on track metadata
+        logger.info("Audio features unavailable, using fallback analysis")
+        user_profile = {
+            'preferences': {
+                'energy': 0.6,  # Default moderate values
+                'danceability': 0.5,
+                'valence': 0.5,
+                'acousticness': 0.3,
+                'instrumentalness': 0.1,
+                'speechiness': 0.1,
+                'liveness': 0.2,
+                'loudness': -10,
+                'tempo': 120,
+                'key': 5,
+                'mode': 1,
+                'time_signature': 4
+            },
+            'pca_profile': np.zeros(PCA_COMPONENTS),  # Default PCA values
+            'fallback_mode': True,
             # Use track IDs for seed-based recommendations instead
-            seed_tracks = [track['id'] for track in unique_tracks[:5] if track.get('id')]
-            session['seed_tracks'] = seed_tracks
-            
-        else:
-            # Create user profile
-            user_profile = recommender.create_user_profile(tracks_features)
-            user_profile['fallback_mode'] = False
-            session['user_profile'] = user_profile
-        
-        # Calculate listening habits summary
-        preferences = user_profile['preferences']
-        
-        # Determine music taste profile
-        taste_profile = {
-            "energy_level": "High" if preferences['energy'] > 0.7 else "Medium" if preferences['energy'] > 0.4 else "Low",
-            "danceability": "High" if preferences['danceability'] > 0.7 else "Medium" if preferences['danceability'] > 0.4 else "Low",
-            "valence": "Positive" if preferences['valence'] > 0.6 else "Neutral" if preferences['valence'] > 0.4 else "Melancholic",
-            "acousticness": "Acoustic" if preferences['acousticness'] > 0.5 else "Electronic",
-            "instrumentalness": "Instrumental" if preferences['instrumentalness'] > 0.5 else "Vocal"
+            'seed_tracks': [track.id for track in unique_tracks[:5]]
         }
         
-        return jsonify({
-            "total_tracks_analyzed": len(unique_tracks),
-            "preferences": preferences,
-            "taste_profile": taste_profile,
-            "top_tracks": [
-                {
-                    "name": track['name'],
-                    "artist": track['artists'][0]['name'],
-                    "image": track['album']['images'][0]['url'] if track['album']['images'] else None
-                }
-                for track in unique_tracks[:10]
-            ]
+    else:
+        # Create user profile
+        user_profile = recommender.create_user_profile(tracks_features)
+        user_profile['fallback_mode'] = False
+    
+    recommender.record_listening(user_id, unique_tracks)
+    user_profile.update({
+        'user_id': user_id,
+        'total_tracks_analyzed': len(unique_tracks),
+        'top_tracks': [
+            {"name": track.name, "artist": track.artist, "image": track.image}
+            for track in unique_tracks[:10]
+        ],
+        'recent_cursor': recent_cursor,
+        'analyzed_at': time.time(),
+        # Any change to the profile gets a new version, invalidating cached recommendations
+        'updated_at': time.time()
+    })
+    get_profile_store().set(user_id, user_profile)
+    
+    return analysis_summary(user_profile), 200, user_id
+
+@app.route('/api/analysis-jobs', methods=['POST'])
+def submit_analysis_job():
+    """Queue a listening-habit analysis for the current user; poll /api/analysis-jobs/<id> for the result"""
+    token_info = session.get('token_info', None)
+    if not token_info:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    try:
+        sp = get_spotify_client(token_info)
+        user = recommender.fetcher.call(sp.current_user)
+    except Exception as auth_error:
+        logger.error(f"Authentication test failed: {auth_error}")
+        return jsonify({"error": "Authentication failed. Please log in again."}), 401
+    
+    try:
+        # A user with an analysis already queued or running gets that job back
+        job, _ = get_job_queue().submit('analysis', user['id'], {
+            'token_info': session['token_info'],
+            'user_id': user['id'],
+            'full': request.args.get('full') == '1'
         })
-        
-    except Exception as e:
-        logger.error(f"Error analyzing listening habits: {e}")
-        import traceback
-        logger.error(f"Full traceback: {traceback.format_exc()}")
-        return jsonify({
-            "error": f"Failed to analyze listening habits: {str(e)}"
-        }), 500
+    except QueueFull:
+        return jsonify({"error": "Too many analyses in progress. Please try again shortly."}), 503, {'Retry-After': '10'}
+    
+    session['profile_key'] = get_profile_store().handle_for(user['id'])
+    return jsonify(job_status(job)), 202
+
+@app.route('/api/analysis-jobs/<job_id>')
+def get_analysis_job(job_id):
+    if not session.get('token_info'):
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    job = get_job_queue().get(job_id)
+    if not job or job['kind'] != 'analysis' or job['key'] != session_user_id():
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+def job_status(job):
+    """Public view of a job; the payload (which holds the user's token) is never returned"""
+    status = {"job_id": job['id'], "status": job['status']}
+    if job['status'] == 'queued':
+        status['queue_position'] = get_job_queue().position(job)
+    elif job['status'] == 'done':
+        status['result'] = job['result']
+    elif job['status'] == 'failed':
+        status['error'] = job['error']
+    return status
+
+def run_analysis_job(payload):
+    """Job handler: analyze a user's history off the request thread"""
+    sp, _ = spotify_clients.client_for(payload['token_info'])
+    user_id = payload['user_id']
+    body, status, _ = analyze_user(sp, get_profile_store().get(user_id), payload['full'], user_id=user_id)
+    if status != 200:
+        raise RuntimeError(body['error'])
+    return body
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                from job_queue import create_job_queue
+                queue = create_job_queue()
+                queue.register('analysis', run_analysis_job)
+                _job_queue = queue
+    return _job_queue
+
+def can_update_incrementally(user_profile):
+    """Whether a stored profile can be brought up to date from recent plays alone"""
+    if not user_profile or user_profile.get('fallback_mode', True) or 'stats' not in user_profile:
+        return False
+    if not user_profile.get('recent_cursor'):
+        return False
+    return time.time() - user_profile.get('analyzed_at', 0) < PROFILE_FULL_REFRESH
+
+def update_listening_habits(sp, user_profile, user_id=None):
+    """Incremental analysis: fetch plays newer than the stored cursor and update the profile in O(new tracks)"""
+    fetcher = recommender.fetcher
+    user_future = fetcher.submit(sp.current_user) if user_id is None else None
+    recent_future = fetcher.submit(
+        sp.current_user_recently_played, limit=50, after=user_profile['recent_cursor']
+    )
+    
+    if user_future is not None:
+        try:
+            user_id = user_future.result()['id']
+            logger.info(f"Successfully authenticated user: {user_id}")
+        except Exception as auth_error:
+            logger.error(f"Authentication test failed: {auth_error}")
+            return {"error": "Authentication failed. Please log in again."}, 401, None
+    
+    # Only the profile's owner is updated incrementally; anyone else (e.g. another
+    # account logged in from the same browser) gets a profile of their own
+    if user_profile.get('user_id') != user_id:
+        logger.info(f"Stored profile does not belong to {user_id}; running a full analysis")
+        return analyze_user(sp, None, full=True, user_id=user_id)
+    
+    try:
+        recent_tracks = recent_future.result()
+        new_tracks = slim_tracks(item['track'] for item in recent_tracks['items'])
+        cursor = (recent_tracks.get('cursors') or {}).get('after') or user_profile['recent_cursor']
+    except Exception as recent_error:
+        logger.warning(f"Error getting recent tracks: {recent_error}")
+        new_tracks, cursor = [], user_profile['recent_cursor']
+    logger.info(f"Found {len(new_tracks)} plays since last analysis")
+    
+    if new_tracks:
+        recommender.record_listening(user_id, new_tracks, merge=True)
+        # Every play counts, so repeated listens weigh more
+        new_features = recommender.extract_audio_features(new_tracks, sp)
+        if not new_features.empty:
+            play_ids = [track.id for track in new_tracks if track.id in new_features.index]
+            user_profile = recommender.update_user_profile(
+                user_profile, new_features.loc[play_ids], decay=PROFILE_DECAY
+            )
+            user_profile['total_tracks_analyzed'] = user_profile.get('total_tracks_analyzed', 0) + len(set(play_ids))
+            # updated_at versions cached rankings, so it only moves when the model did
+            user_profile['updated_at'] = time.time()
+    
+    user_profile['recent_cursor'] = cursor
+    get_profile_store().set(user_id, user_profile)
+    return analysis_summary(user_profile), 200, user_id
+
+def analysis_summary(user_profile):
+    """Listening habits response body for a stored profile"""
+    # Calculate listening habits summary
+    preferences = user_profile['preferences']
+    
+    # Determine music taste profile
+    taste_profile = {
+        "energy_level": "High" if preferences['energy'] > 0.7 else "Medium" if preferences['energy'] > 0.4 else "Low",
+        "danceability": "High" if preferences['danceability'] > 0.7 else "Medium" if preferences['danceability'] > 0.4 else "Low",
+        "valence": "Positive" if preferences['valence'] > 0.6 else "Neutral" if preferences['valence'] > 0.4 else "Melancholic",
+        "acousticness": "Acoustic" if preferences['acousticness'] > 0.5 else "Electronic",
+        "instrumentalness": "Instrumental" if preferences['instrumentalness'] > 0.5 else "Vocal"
+    }
+    
+    return {
+        "total_tracks_analyzed": user_profile.get('total_tracks_analyzed', 0),
+        "preferences": preferences,
+        "taste_profile": taste_profile,
+        "top_tracks": user_profile.get('top_tracks', [])
+    }
+
+def recommendation_page():
+    """(offset, limit) from the query string, or None if out of range"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', 10, type=int)
+    if offset < 0 or not 0 < limit <= 50 or offset + limit > RECOMMENDATION_MAX_DEPTH:
+        return None
+    return offset, limit
 
 @app.route('/api/recommendations')
 def get_recommendations():
+    """A page of recommendations; ?offset=10&limit=10 pages on past the first ten ("more like this")"""
     token_info = session.get('token_info', None)
-    user_profile = session.get('user_profile', None)
+    user_profile = load_user_profile()
     
     if not token_info:
         return jsonify({"error": "Not authenticated"}), 401
@@ -515,58 +1054,177 @@ def get_recommendations():
     if not user_profile:
         return jsonify({"error": "No user profile found. Please analyze listening habits first."}), 400
     
+    page = recommendation_page()
+    if page is None:
+        return jsonify({"error": f"Invalid offset/limit (limit 1-50, at most {RECOMMENDATION_MAX_DEPTH} in total)"}), 400
+    offset, limit = page
+    
     try:
-        sp = spotipy.Spotify(auth=token_info['access_token'])
+        sp = get_spotify_client(token_info)
         
         # Get seed tracks if in fallback mode
         seed_tracks = None
         if user_profile.get('fallback_mode', False):
-            seed_tracks = session.get('seed_tracks', None)
+            seed_tracks = user_profile.get('seed_tracks', None)
         
-        recommendations = recommender.get_recommendations(sp, user_profile, seed_tracks)
+        recommendations = recommender.get_recommendations(
+            sp, user_profile, seed_tracks, limit, offset, session_user_id()
+        )
         
         # Format recommendations
-        formatted_recommendations = []
-        for track in recommendations:
-            if track and track.get('id'):
-                formatted_recommendations.append({
-                    "id": track['id'],
-                    "name": track['name'],
-                    "artist": track['artists'][0]['name'] if track['artists'] else 'Unknown',
-                    "album": track['album']['name'],
-                    "image": track['album']['images'][0]['url'] if track['album']['images'] else None,
-                    "preview_url": track.get('preview_url'),
-                    "external_url": track['external_urls']['spotify'],
-                    "popularity": track.get('popularity', 0)
-                })
-        
-        return jsonify({
-            "recommendations": formatted_recommendations,
-            "total": len(formatted_recommendations)
-        })
+        with stage('formatting'):
+            formatted_recommendations = [track.to_dict() for track in recommendations]
+            
+            return jsonify({
+                "recommendations": formatted_recommendations,
+                "total": len(formatted_recommendations),
+                "offset": offset,
+                "next_offset": offset + limit if len(recommendations) == limit else None
+            })
         
     except Exception as e:
         logger.error(f"Error getting recommendations: {e}")
         return jsonify({"error": "Failed to get recommendations"}), 500
 
+@app.route('/api/recommendations/stream')
+def stream_recommendations():
+    """Recommendations as newline-delimited JSON events, each track sent as soon as it is ranked or found.
+    
+    Events: {"event": "progress", "stage": ...}, {"event": "track", "track": ...},
+    then {"event": "done", "total": n, "next_offset": ...} or {"event": "error", "error": ...}.
+    Takes the same offset/limit parameters as /api/recommendations.
+    """
+    token_info = session.get('token_info', None)
+    user_profile = load_user_profile()
+    
+    if not token_info:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    if not user_profile:
+        return jsonify({"error": "No user profile found. Please analyze listening habits first."}), 400
+    
+    page = recommendation_page()
+    if page is None:
+        return jsonify({"error": f"Invalid offset/limit (limit 1-50, at most {RECOMMENDATION_MAX_DEPTH} in total)"}), 400
+    offset, limit = page
+    
+    # Resolved before streaming starts, so a refreshed token and the session's
+    # profile handle are read while the request context is still active
+    sp = get_spotify_client(token_info)
+    user_id = session_user_id()
+    seed_tracks = user_profile.get('seed_tracks', None) if user_profile.get('fallback_mode', False) else None
+    
+    def generate():
+        total = 0
+        try:
+            events = recommender.iter_recommendations(sp, user_profile, seed_tracks, limit, offset, user_id)
+            for kind, item in events:
+                if kind == 'progress':
+                    yield json.dumps(dict(item, event='progress')) + '\n'
+                else:
+                    total += 1
+                    yield json.dumps({"event": "track", "track": item.to_dict()}) + '\n'
+            next_offset = offset + limit if total == limit else None
+            yield json.dumps({"event": "done", "total": total, "next_offset": next_offset}) + '\n'
+        except Exception as e:
+            logger.error(f"Error streaming recommendations: {e}")
+            yield json.dumps({"event": "error", "error": "Failed to get recommendations"}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        # Keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    return jsonify({
+        "audio_features": recommender.feature_cache.stats(),
+        "shared_queries": recommender.shared_queries.stats(),
+        "recommendations": recommender.recommendation_cache.stats(),
+        "cooccurrence": recommender.cooccurrence.stats() if recommender.cooccurrence is not None else None
+    })
+
 @app.route('/api/logout')
 def logout():
     session.clear()
     return jsonify({"message": "Logged out successfully"})
 
-# Serve React App (for production)
+# Serve React App (for production); the build directory is indexed once at startup
+static_files = StaticFiles(os.path.join(app.root_path, 'static'))
+
+def serve_index():
+    response = static_files.response('index.html')
+    if response is None:
+        return jsonify({"error": "Frontend not built"}), 404
+    return response
+
 @app.route('/')
 def serve_react_app():
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_index()
 
 @app.route('/<path:path>')
 def serve_static_files(path):
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+    response = static_files.response(path)
+    if response is not None:
+        return response
+    # Client-side routes such as /dashboard get the app shell; missing files and API paths are real 404s
+    if path.startswith('api/') or '.' in path.rsplit('/', 1)[-1]:
+        return jsonify({"error": "Not found"}), 404
+    return serve_index()
+
+# 'eager' loads the ML stack and candidate pool at startup (before forking
+# workers); 'lazy' defers them to the first request that needs them and warms
+# them in the background once the server is accepting connections
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+
+def warm_up():
+    """Import the ML stack and build the shared recommender state"""
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import scoring  # noqa: F401
+    import user_model  # noqa: F401
+    get_profile_store()
+    recommender.cooccurrence
+    recommender.feature_cache
+    recommender.candidate_pool.preload()
+
+def warm_up_in_background():
+    """Warm up on a daemon thread so the server can answer cheap requests meanwhile"""
+    started = time.perf_counter()
+    
+    def run():
+        try:
+            warm_up()
+            logger.info(f"Background warm-up finished in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Background warm-up failed: {e}")
+    
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+def preload():
+    """Load shared state before a prefork server forks its workers, so pages are shared copy-on-write"""
+    if STARTUP_MODE == 'lazy':
+        return
+    warm_up()
+    # Threads started while preloading would not survive the fork
+    recommender.fetcher.shutdown()
+
+def shutdown():
+    """Stop background work so a worker can exit promptly"""
+    if recommender._candidate_pool is not None:
+        recommender._candidate_pool.stop()
+    if recommender._cooccurrence:
+        recommender._cooccurrence.stop()
+    recommender.fetcher.shutdown(wait=False)
+    if _job_queue is not None:
+        _job_queue.stop()
 
 if __name__ == '__main__':
+    if STARTUP_MODE == 'lazy':
+        warm_up_in_background()
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') != 'production'
     app.run(host='0.0.0.0', port=port, debug=debug)
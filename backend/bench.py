@@ -0,0 +1,231 @@
+"""Offline benchmarks against a local fake Spotify API: endpoint load and recommender micro-benchmarks.
+
+Run from the backend directory:
+    python bench.py load --users 50 --concurrency 8 --latency-ms 50
+    python bench.py micro --max-size 1000000
+    python bench.py all --save-baseline          # record bench_baseline.json
+    python bench.py all --check                  # exit 1 if p50/p99 regressed
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_spotify import load_fixtures, start_server
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+_app = None
+
+
+def load_app(port):
+    """Import the app configured against the fake API on `port`, with no other network access"""
+    global _app
+    if _app is None:
+        os.environ.update({
+            'SPOTIFY_API_URL': f'http://127.0.0.1:{port}/v1/',
+            'SPOTIFY_ACCOUNTS_URL': f'http://127.0.0.1:{port}',
+            'CANDIDATE_POOL_REFRESH': '0',
+            'STARTUP_MODE': 'lazy',
+            'PROFILE_STORE': 'memory',
+            'JOB_QUEUE': 'memory'
+        })
+        os.environ.setdefault('SPOTIFY_CLIENT_ID', 'benchmark')
+        os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'benchmark')
+        for name in ['CATALOG_PATH', 'FEATURE_CACHE_PATH', 'SLOW_REQUEST_PROFILE_MS']:
+            os.environ.pop(name, None)
+        # A fresh co-occurrence index per run, so no state carries over between benchmarks
+        cooccurrence_path = tempfile.mkdtemp(prefix='bench-cooccurrence-')
+        atexit.register(shutil.rmtree, cooccurrence_path, ignore_errors=True)
+        os.environ['COOCCURRENCE_PATH'] = cooccurrence_path
+        import logging
+        logging.disable(logging.INFO)
+        import app
+        _app = app
+    return _app
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies, wall_time, errors=0):
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput_per_s": round(len(latencies) / wall_time, 2) if wall_time else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+def run_load(app, users, concurrency, requests_per_user):
+    """Each simulated user analyzes their history, then asks for recommendations several times"""
+    latencies = {'/api/analyze-listening-habits': [], '/api/recommendations': []}
+    errors = {path: 0 for path in latencies}
+    lock = threading.Lock()
+
+    def simulate(user_number):
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            # The fake API treats the access token as the user ID
+            session['token_info'] = {'access_token': f'bench-user-{user_number}'}
+        for path in ['/api/analyze-listening-habits'] + ['/api/recommendations'] * requests_per_user:
+            start = time.perf_counter()
+            response = client.get(path)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[path].append(elapsed)
+                if response.status_code != 200:
+                    errors[path] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(simulate, range(users)))
+    wall_time = time.perf_counter() - started
+    return {path: summarize(values, wall_time, errors[path]) for path, values in latencies.items()}
+
+
+def measure(fn, min_time=0.5, min_runs=3, max_runs=50):
+    """Latencies of repeated fn() calls, run until min_time has elapsed (within the run limits)"""
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < min_runs or (time.perf_counter() - started < min_time and len(latencies) < max_runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_micro(app, sizes, max_extract, min_time):
+    """Micro-benchmarks of feature extraction, profile fitting and scoring by input size"""
+    import numpy as np
+    import pandas as pd
+    from candidate_pool import CandidateSnapshot
+    from feature_cache import FEATURE_COLUMNS, FeatureCache
+    from fake_spotify import fake_audio_features, fake_track
+    from scoring import ScoringEngine
+    from tracks import Track
+
+    recommender = app.recommender
+    sp = app.spotify_clients.client('bench-user-micro')
+    rng = np.random.default_rng(0)
+
+    def feature_matrix(n):
+        rows = [fake_audio_features(f'micro-{i}') for i in range(min(n, 1000))]
+        base = np.array([[row[col] for col in FEATURE_COLUMNS] for row in rows], dtype=np.float64)
+        return base[rng.integers(0, len(base), size=n)] + rng.normal(0, 0.01, size=(n, len(FEATURE_COLUMNS)))
+
+    history = pd.DataFrame(feature_matrix(200), columns=FEATURE_COLUMNS)
+    user_profile = recommender.create_user_profile(history)
+    report = {}
+
+    for n in sizes:
+        if n <= max_extract:
+            tracks = [Track.from_spotify(fake_track(f'micro-extract-{n}-{i}')) for i in range(n)]
+            # Cold: every feature is fetched from the fake API; warm: all served from the cache
+            def extract_cold():
+                recommender._feature_cache = FeatureCache(max_size=max(n, 1))
+                recommender.extract_audio_features(tracks, sp)
+            latencies = measure(extract_cold, min_time, max_runs=5)
+            report[f'extract_audio_features_cold.{n}'] = summarize(latencies, sum(latencies))
+            latencies = measure(lambda: recommender.extract_audio_features(tracks, sp), min_time)
+            report[f'extract_audio_features_warm.{n}'] = summarize(latencies, sum(latencies))
+
+        features = pd.DataFrame(feature_matrix(n), columns=FEATURE_COLUMNS)
+        latencies = measure(lambda: recommender.create_user_profile(features), min_time)
+        report[f'create_user_profile.{n}'] = summarize(latencies, sum(latencies))
+
+        matrix = feature_matrix(n)
+        engine = ScoringEngine(matrix, FEATURE_COLUMNS)
+        latencies = measure(lambda: engine.top_k([user_profile], 10), min_time)
+        report[f'scoring_exact.{n}'] = summarize(latencies, sum(latencies))
+
+        if n >= 10000:
+            # The index is built here, outside the measured query latency
+            snapshot = CandidateSnapshot(range(n), matrix, FEATURE_COLUMNS, 1, ann_min_candidates=10000)
+            latencies = measure(lambda: snapshot.top_k([user_profile], 10), min_time)
+            report[f'scoring_ann.{n}'] = summarize(latencies, sum(latencies))
+
+    recommender._feature_cache = None
+    return report
+
+
+def compare(report, baseline, tolerance, slack_ms=1.0):
+    """Metrics whose p50/p99 exceed the baseline by more than tolerance (plus a small absolute slack)"""
+    regressions = []
+    for section, results in report.items():
+        for name, result in results.items():
+            expected = baseline.get(section, {}).get(name)
+            if not expected:
+                continue
+            for key in ['p50_ms', 'p99_ms']:
+                limit = expected[key] * (1 + tolerance) + slack_ms
+                if result[key] > limit:
+                    regressions.append(f"{section} {name} {key}: {result[key]:.3f} > {limit:.3f} (baseline {expected[key]:.3f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('suite', choices=['load', 'micro', 'all'])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=3, help="recommendation requests per simulated user")
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="fake Spotify latency per call (load suite)")
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--fixtures', help="recorded responses to replay (see fake_spotify.py)")
+    parser.add_argument('--max-size', type=int, default=1000000, help="largest micro-benchmark size (powers of ten from 100)")
+    parser.add_argument('--max-extract', type=int, default=10000, help="largest size for the feature extraction benchmark")
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds spent per micro-benchmark")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help="fail if latency regressed past the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown over the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    server, _ = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, fixtures=fixtures)
+    app = load_app(server.server_address[1])
+
+    report = {}
+    if args.suite in ('load', 'all'):
+        report['load'] = run_load(app, args.users, args.concurrency, args.requests)
+    if args.suite in ('micro', 'all'):
+        # Micro-benchmarks measure our own code, not the fake network delay
+        micro_server, _ = start_server(fixtures=fixtures)
+        app.spotify_clients.api_url = f'http://127.0.0.1:{micro_server.server_address[1]}/v1/'
+        sizes = [10 ** exponent for exponent in range(2, 7) if 10 ** exponent <= args.max_size]
+        report['micro'] = run_micro(app, sizes, args.max_extract, args.min_time)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first", file=sys.stderr)
+            sys.exit(2)
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Latency regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("No latency regressions against the baseline", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
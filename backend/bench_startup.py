@@ -0,0 +1,130 @@
+"""Startup benchmark: import time and first-request latency in eager and lazy startup modes.
+
+Run from the backend directory: python bench_startup.py [--runs N]
+Each measurement runs in a fresh interpreter so module caches are cold. All
+Spotify calls go to a local fake API (fake_spotify.py) served by this
+process, and one analyzed profile is stored up front so the first ML
+request scores recommendations end to end.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from fake_spotify import start_server
+
+BENCHMARK_USER = 'benchmark-user'
+
+# Analyze the benchmark user once into the shared profile store; prints their session handle
+SETUP = r'''
+import app
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session['token_info'] = {'access_token': %r}
+response = client.get('/api/analyze-listening-habits')
+assert response.status_code == 200, response.get_data(as_text=True)
+with client.session_transaction() as session:
+    print(session['profile_key'])
+''' % BENCHMARK_USER
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.preload()
+preloaded = time.perf_counter()
+
+client = app.app.test_client()
+start = time.perf_counter()
+client.get('/api')
+first_request = time.perf_counter() - start
+
+# First request that needs the ML stack: load the stored profile, build or reuse
+# the candidate pool and score it
+with client.session_transaction() as session:
+    session['token_info'] = {'access_token': %r}
+    session['profile_key'] = sys.argv[1]
+start = time.perf_counter()
+response = client.get('/api/recommendations')
+first_ml_request = time.perf_counter() - start
+assert response.status_code == 200, response.get_data(as_text=True)
+assert response.get_json()['total'] > 0, "no recommendations scored"
+
+print(json.dumps({
+    "import_s": imported - started,
+    "preload_s": preloaded - imported,
+    "first_request_s": first_request,
+    "first_ml_request_s": first_ml_request
+}))
+''' % BENCHMARK_USER
+
+IMPORT_ONLY = r'''
+import sys, time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started, 'numpy' in sys.modules, 'pandas' in sys.modules)
+'''
+
+
+def probe_env(api_port, data_dir, mode):
+    """Environment for a probe: the fake API on `api_port` and a profile store in `data_dir`"""
+    env = dict(os.environ)
+    env.update({
+        'SPOTIFY_API_URL': f'http://127.0.0.1:{api_port}/v1/',
+        'SPOTIFY_ACCOUNTS_URL': f'http://127.0.0.1:{api_port}',
+        'SPOTIFY_CLIENT_ID': 'benchmark',
+        'SPOTIFY_CLIENT_SECRET': 'benchmark',
+        'CANDIDATE_POOL_REFRESH': '0',
+        'PROFILE_STORE': 'sqlite',
+        'PROFILE_STORE_PATH': os.path.join(data_dir, 'profiles.db'),
+        'JOB_QUEUE': 'memory',
+        'STARTUP_MODE': mode
+    })
+    for name in ['CATALOG_PATH', 'FEATURE_CACHE_PATH', 'COOCCURRENCE_PATH', 'SLOW_REQUEST_PROFILE_MS']:
+        env.pop(name, None)
+    return env
+
+
+def run_probe(code, env, *args):
+    result = subprocess.run(
+        [sys.executable, '-c', code, *args], env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server, _ = start_server()
+    api_port = server.server_address[1]
+    data_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        handle = run_probe(SETUP, probe_env(api_port, data_dir, 'lazy'))
+        report = {}
+        for mode in ['eager', 'lazy']:
+            env = probe_env(api_port, data_dir, mode)
+            samples = [json.loads(run_probe(PROBE, env, handle)) for _ in range(args.runs)]
+            import_seconds, numpy_loaded, pandas_loaded = run_probe(IMPORT_ONLY, env).split()
+            report[mode] = {
+                f"{key[:-2]}_ms": round(statistics.median(sample[key] for sample in samples) * 1000, 1)
+                for key in ['import_s', 'preload_s', 'first_request_s', 'first_ml_request_s']
+            }
+            report[mode]['ml_stack_loaded_at_import'] = numpy_loaded == 'True' or pandas_loaded == 'True'
+    finally:
+        server.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from ann_index import INDEX_FORMAT, IVFIndex
+from feature_cache import FEATURE_COLUMNS
+from forking import after_fork_in_child
+from scoring import ScoringEngine, mmr_rerank
+from spotify_fetch import call_with_retry
+from track_catalog import MANIFEST, TrackCatalog, append_tracks, catalog_lock
+from tracks import slim_tracks
+from user_model import affine_projection, feature_stats, refit_user_model
+
+logger = logging.getLogger(__name__)
+
+CANDIDATE_GENRES = ['pop', 'rock', 'hip-hop', 'electronic', 'indie', 'alternative']
+
+# Candidates shortlisted by the ANN index per requested recommendation
+ANN_SHORTLIST_FACTOR = 20
+
+# Share of the ANN index's buckets scanned per user. A user's PCA keeps fewer
+# components than there are features, so the rows they rank closest spread
+# across more buckets than a plain nearest-neighbour query would touch.
+ANN_PROBE_FRACTION = 0.35
+
+
+class CandidateSnapshot:
+    """Immutable view of the shared candidate set.
+
+    `matrix` holds the raw audio features (one row per entry of `tracks`,
+    columns named by `columns`) and `scorer` scores user profiles against it.
+    `tracks` is a list of Track records or, for catalog-backed pools, a lazy
+    sequence of them read from the catalog. Snapshots with at
+    least `ann_min_candidates` tracks also get an IVF index used to shortlist
+    candidates before exact scoring; pass `ann` to reuse one built elsewhere.
+    Tracks without audio features are not part of a snapshot.
+    """
+
+    def __init__(self, tracks, matrix, columns, version, ann_min_candidates=20000, ann=None):
+        self.tracks = tracks
+        self.columns = list(columns)
+        # Memory-mapped catalog matrices are used as-is so pages stay shared
+        self.matrix = np.ascontiguousarray(matrix)
+        if ann is None and len(tracks) >= ann_min_candidates:
+            ann = IVFIndex.build(self.matrix)
+        self.ann = ann
+        self._scorer = None
+        self.version = version
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    @property
+    def scorer(self):
+        # Built on first brute-force use; ANN-backed snapshots only score shortlists
+        if self._scorer is None:
+            self._scorer = ScoringEngine(self.matrix, self.columns)
+        return self._scorer
+
+    def top_k(self, user_profiles, k):
+        """Row indices of each profile's k best candidates, best first"""
+        if self.ann is None:
+            top_indices, _ = self.scorer.top_k(user_profiles, k)
+            return [list(row) for row in top_indices]
+
+        # Large catalogs: shortlist the rows nearest the user's PCA profile in the user's own
+        # scaled + PCA space (where ScoringEngine ranks by closeness), then rank exactly
+        results = []
+        for user_profile in user_profiles:
+            projection = affine_projection(user_profile['model'], self.columns)
+            target = np.zeros(projection.shape[1])
+            profile = np.asarray(user_profile['pca_profile'], dtype=np.float64)[:projection.shape[1]]
+            target[:profile.shape[0]] = profile
+            # A raw feature vector that projects onto the profile, e.g. the user's mean
+            query = np.linalg.lstsq(projection[:-1].T, target - projection[-1], rcond=None)[0]
+            n_probe = max(8, int(self.ann.n_lists * ANN_PROBE_FRACTION))
+            rows, _ = self.ann.query(query, k=k * ANN_SHORTLIST_FACTOR, n_probe=n_probe, metric=projection[:-1])
+            shortlist = ScoringEngine(self.matrix[rows], self.columns)
+            top_indices, _ = shortlist.top_k([user_profile], k)
+            results.append([rows[i] for i in top_indices[0]])
+        return results
+
+    def rerank(self, user_profile, rows, k, diversity=0.3, artist_cap=2):
+        """The k best of a relevance-ordered shortlist of rows, re-ranked for variety.
+
+        Maximal marginal relevance over the shortlist in the user's PCA space
+        demotes near-identical tracks, and no artist gets more than
+        `artist_cap` places while other artists remain.
+        """
+        if len(rows) <= 1 or (diversity <= 0 and artist_cap <= 0):
+            return list(rows[:k])
+        shortlist = ScoringEngine(self.matrix[rows], self.columns)
+        relevance = shortlist.similarities([user_profile])[0]
+        vectors = shortlist.unit_vectors(user_profile) if diversity > 0 else None
+        artists = [self.tracks[row].artist for row in rows] if artist_cap > 0 else None
+        return [rows[i] for i in mmr_rerank(relevance, vectors, k, diversity, artists, artist_cap)]
+
+
+def load_catalog_ann(catalog, matrix):
+    """The IVF index for a catalog version, memory-mapped from `ann-<version>/` in the catalog directory.
+
+    The first process to need it builds and saves it while the others wait
+    and then map the same files, so k-means runs once per catalog version
+    rather than in every worker. Indexes of older versions are removed.
+    """
+    directory = catalog.directory
+    path = os.path.join(directory, f'ann-{catalog.version:06d}')
+    if IVFIndex.saved_format(path) != INDEX_FORMAT:
+        with catalog_lock(directory, 'ann.lock'):
+            if IVFIndex.saved_format(path) != INDEX_FORMAT:
+                start = time.perf_counter()
+                # Written aside and renamed, so a directory that exists is complete
+                # (one in an older format is replaced)
+                shutil.rmtree(path + '.tmp', ignore_errors=True)
+                shutil.rmtree(path, ignore_errors=True)
+                IVFIndex.build(matrix).save(path + '.tmp')
+                os.rename(path + '.tmp', path)
+                logger.info(f"Built ANN index for catalog v{catalog.version} in {time.perf_counter() - start:.1f}s")
+                # Processes that still have an older index mapped keep using it until they reopen
+                for old in glob.glob(os.path.join(directory, 'ann-[0-9]*')):
+                    if old.endswith('.tmp') or old >= path:
+                        continue
+                    shutil.rmtree(old, ignore_errors=True)
+    return IVFIndex.load(path, mmap=True)
+
+
+def measure_ann_recall(snapshot, user_profiles, k=50):
+    """Recall@k of an ANN-backed snapshot's top_k against exact ScoringEngine scoring, with mean latencies in ms"""
+    start = time.perf_counter()
+    approximate = snapshot.top_k(user_profiles, k)
+    ann_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact, _ = snapshot.scorer.top_k(user_profiles, k)
+    exact_time = time.perf_counter() - start
+
+    hits = sum(len(set(a) & set(e.tolist())) for a, e in zip(approximate, exact))
+    n_queries = max(len(user_profiles), 1)
+    return {
+        "k": k,
+        "queries": len(user_profiles),
+        "recall": hits / (n_queries * min(k, len(snapshot))),
+        "ann_ms": ann_time / n_queries * 1000,
+        "exact_ms": exact_time / n_queries * 1000
+    }
+
+
+def sample_user_profiles(matrix, columns, count, history=30, spread=300, seed=0):
+    """Synthetic user profiles fitted on catalog rows, for recall measurements.
+
+    Half listen to random tracks; the other half to tracks among the `spread`
+    nearest neighbours of a random track, like users with a narrow taste.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    standardized = (matrix - matrix.mean(axis=0)) / np.where(matrix.std(axis=0) > 0, matrix.std(axis=0), 1.0)
+    profiles = []
+    for i in range(count):
+        if i % 2:
+            seed_row = standardized[rng.integers(matrix.shape[0])]
+            pool = np.argsort(np.linalg.norm(standardized - seed_row, axis=1))[:spread]
+        else:
+            pool = np.arange(matrix.shape[0])
+        rows = rng.choice(pool, size=min(history, pool.shape[0]), replace=False)
+        model, pca_profile = refit_user_model(feature_stats(matrix[rows]), columns)
+        profiles.append({'model': model, 'pca_profile': pca_profile})
+    return profiles
+
+
+def fetch_candidate_tracks(sp, genres=CANDIDATE_GENRES):
+    """Track records of popular tracks per genre, falling back to featured playlists, deduped by ID.
+
+    Calls go through call_with_retry: the shared HTTP adapter leaves 429s to it.
+    """
+    candidate_tracks = []
+
+    for genre in genres:
+        try:
+            # Search for tracks in each genre
+            results = call_with_retry(sp.search, q=f'genre:{genre}', type='track', limit=50)
+            candidate_tracks.extend(slim_tracks(results['tracks']['items']))
+        except Exception as e:
+            logger.warning(f"Error searching genre {genre}: {e}")
+            continue
+
+    if not candidate_tracks:
+        # Fallback: get featured playlists
+        try:
+            playlists = call_with_retry(sp.featured_playlists, limit=5)
+            for playlist in playlists['playlists']['items']:
+                try:
+                    tracks = call_with_retry(sp.playlist_tracks, playlist['id'], limit=20)
+                    candidate_tracks.extend(slim_tracks(item['track'] for item in tracks['items']))
+                except Exception as e:
+                    logger.warning(f"Error getting playlist tracks: {e}")
+                    continue
+        except Exception as e:
+            logger.warning(f"Error getting featured playlists: {e}")
+
+    # Remove duplicates
+    seen_ids = set()
+    unique_tracks = []
+    for track in candidate_tracks:
+        if track.id not in seen_ids:
+            seen_ids.add(track.id)
+            unique_tracks.append(track)
+
+    return unique_tracks
+
+
+class CandidatePool:
+    """Shared, periodically rebuilt candidate index for the ML recommendation path.
+
+    A background thread rebuilds the snapshot every `refresh_interval` seconds
+    and swaps it in with a single reference assignment, so readers never see a
+    half-built index and never need a lock. A snapshot preloaded before fork
+    is kept until its first refresh is due, and a rebuild that finds the same
+    candidates keeps the current snapshot (and its version). When no app-level
+    Spotify client is available, the first request bootstraps the pool with
+    its own client. `on_rebuild(snapshot)`, if set, is called from the
+    refresher after it swaps in a new snapshot.
+    """
+
+    def __init__(self, extract_features, client_factory=None, refresh_interval=3600, genres=CANDIDATE_GENRES,
+                 ann_min_candidates=20000, catalog_path=None):
+        self.extract_features = extract_features
+        self.catalog_path = catalog_path
+        self.ann_min_candidates = ann_min_candidates
+        self.client_factory = client_factory
+        self.refresh_interval = refresh_interval
+        self.genres = genres
+        self.on_rebuild = None
+        self._snapshot = None
+        self._version = 0
+        self._catalog_version = None
+        # time.monotonic() of the last build attempt; inherited across fork with the snapshot
+        self._last_build = float('-inf')
+        self._reset_threads()
+        # The refresher thread does not survive fork; each worker starts its own
+        after_fork_in_child(self._reset_threads)
+
+    def _reset_threads(self):
+        self._build_lock = threading.Lock()
+        self._refresher_lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def build(self, sp=None):
+        """Fetch candidates and their features and swap in a new snapshot.
+
+        With a catalog configured, fetched tracks are appended to it and the
+        snapshot is served from the (memory-mapped) catalog instead. Builds
+        run one at a time.
+        """
+        with self._build_lock:
+            return self._build(sp)
+
+    def _build(self, sp):
+        self._last_build = time.monotonic()
+        fetched = self._fetch(sp) if sp is not None else None
+        ann = None
+
+        if self.catalog_path:
+            if fetched is not None:
+                tracks, features = fetched
+                features = features.reindex(columns=FEATURE_COLUMNS, fill_value=0)
+                append_tracks(
+                    self.catalog_path, list(features.index), features.to_numpy(dtype=np.float32),
+                    [track.to_dict() for track in tracks], FEATURE_COLUMNS
+                )
+            if not os.path.exists(os.path.join(self.catalog_path, MANIFEST)):
+                logger.warning(f"No track catalog found at {self.catalog_path}")
+                return self._snapshot
+            catalog = TrackCatalog(self.catalog_path)
+            if not len(catalog):
+                return self._snapshot
+            if self._snapshot is not None and catalog.version == self._catalog_version:
+                # Nothing ingested since the last build; keep the current index
+                return self._snapshot
+            self._catalog_version = catalog.version
+            tracks, matrix, columns = catalog.records(), catalog.matrix(), catalog.columns
+            if len(catalog) >= self.ann_min_candidates:
+                ann = load_catalog_ann(catalog, matrix)
+        else:
+            if fetched is None:
+                return self._snapshot
+            tracks, features = fetched
+            if self._snapshot is not None and [t.id for t in tracks] == [t.id for t in self._snapshot.tracks]:
+                logger.info(f"Candidate pool refresh found the same {len(tracks)} tracks; keeping v{self._version}")
+                return self._snapshot
+            matrix, columns = features.to_numpy(dtype=np.float64), features.columns
+
+        self._version += 1
+        snapshot = CandidateSnapshot(tracks, matrix, columns, self._version, self.ann_min_candidates, ann)
+        self._snapshot = snapshot
+        logger.info(f"Candidate pool v{snapshot.version} built with {len(snapshot)} tracks")
+        return snapshot
+
+    def _fetch(self, sp):
+        """Candidate tracks with audio features, as (tracks, features) aligned by row"""
+        tracks = fetch_candidate_tracks(sp, self.genres)
+        if not tracks:
+            logger.warning("Candidate pool refresh found no tracks")
+            return None
+
+        features = self.extract_features(tracks, sp)
+        if features.empty:
+            logger.warning("Candidate pool refresh found no audio features")
+            return None
+
+        tracks_by_id = {track.id: track for track in tracks}
+        return [tracks_by_id[track_id] for track_id in features.index], features
+
+    def preload(self):
+        """Build the first snapshot without starting the refresher, e.g. before forking workers"""
+        if self.client_factory is None and not self.catalog_path:
+            return None
+        try:
+            return self.build(self.client_factory() if self.client_factory else None)
+        except Exception as e:
+            logger.error(f"Candidate pool preload failed: {e}")
+            return None
+
+    def get(self, sp=None):
+        """Return the current snapshot, building it with `sp` if the pool is still empty"""
+        self._ensure_refresher()
+        snapshot = self._snapshot
+        if snapshot is not None or (sp is None and not self.catalog_path):
+            return snapshot
+
+        # Only one build bootstraps the pool, whether a request's or the refresher's
+        # first one; everyone else waits for it and reuses it
+        with self._build_lock:
+            if self._snapshot is None:
+                self._build(sp)
+        return self._snapshot
+
+    def _ensure_refresher(self):
+        if (self.client_factory is None and not self.catalog_path) or self.refresh_interval <= 0:
+            return
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._refresher_lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name='candidate-pool', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            # A snapshot preloaded before fork (shared copy-on-write) or just bootstrapped
+            # by a request is current until its refresh is due
+            due = self._last_build + self.refresh_interval - time.monotonic()
+            if due > 0:
+                self._stop.wait(due)
+                continue
+            try:
+                # Catalog-only pools just reopen the catalog to pick up ingested segments
+                sp = self.client_factory() if self.client_factory else None
+                with self._build_lock:
+                    previous = self._snapshot
+                    if time.monotonic() - self._last_build >= self.refresh_interval:
+                        self._build(sp)
+                    snapshot = self._snapshot
+            except Exception as e:
+                logger.error(f"Candidate pool refresh failed: {e}")
+                continue
+            if snapshot is not previous and self.on_rebuild is not None:
+                try:
+                    self.on_rebuild(snapshot)
+                except Exception as e:
+                    logger.error(f"Candidate pool rebuild hook failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def create_candidate_pool(extract_features, client_factory=None):
+    """Build the candidate pool from CANDIDATE_POOL_* environment variables.
+
+    Background refreshes need an app-level client from `client_factory`, so
+    they only run when the app's Spotify credentials are configured.
+    """
+    return CandidatePool(
+        extract_features,
+        client_factory=client_factory,
+        refresh_interval=int(os.environ.get('CANDIDATE_POOL_REFRESH', 3600)),
+        ann_min_candidates=int(os.environ.get('ANN_MIN_CANDIDATES', 20000)),
+        catalog_path=os.environ.get('CATALOG_PATH') or None
+    )
@@ -0,0 +1,289 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+from forking import after_fork_in_child
+from sqlite_connections import ThreadLocalConnections
+from tracks import Track
+
+logger = logging.getLogger(__name__)
+
+# Most recent distinct tracks kept per user; pair counts grow with its square
+MAX_BASKET = 500
+
+
+class CooccurrenceIndex:
+    """Item-item co-occurrence counts over analyzed users' listening histories ("users like you also play").
+
+    Each analyzed user contributes one deduplicated basket of track IDs,
+    stored in SQLite as it arrives. `update()` folds changed baskets into a
+    sparse symmetric matrix C = Σ bᵀb in one batch, adding each new basket's
+    outer product and subtracting the one it replaces, and saves C as a new
+    version. Updates are serialised across processes by the database write
+    lock; every process reloads the latest version on its own, so a query
+    is one sparse row-vector product over the user's basket.
+    """
+
+    def __init__(self, directory, max_basket=MAX_BASKET, min_listeners=2, update_interval=300, reload_interval=30):
+        self.directory = directory
+        self.max_basket = max_basket
+        self.min_listeners = min_listeners
+        self.update_interval = update_interval
+        self.reload_interval = reload_interval
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'baskets.db')
+        self._state = None
+        self._checked_at = 0.0
+        self._connection = ThreadLocalConnections(self.db_path, timeout=30)
+        self._reset()
+        # The updater thread does not survive fork
+        after_fork_in_child(self._reset)
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS baskets ("
+                "user_id TEXT PRIMARY KEY, track_ids TEXT, applied TEXT, pending INTEGER, updated_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS baskets_pending ON baskets (pending)")
+            db.execute("CREATE TABLE IF NOT EXISTS tracks (track_id TEXT PRIMARY KEY, record TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+    def _reset(self):
+        self._load_lock = threading.Lock()
+        self._updater = None
+        self._stop = threading.Event()
+
+    def _matrix_path(self, version):
+        return os.path.join(self.directory, f'cooccurrence-{version:08d}.npz')
+
+    def _stored_version(self, db):
+        row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _read_matrix(self, version):
+        """(CSR count matrix, track ID array) saved as `version`; empty for version 0"""
+        if version == 0:
+            return sparse.csr_matrix((0, 0), dtype=np.int32), np.empty(0, dtype='U32')
+        with np.load(self._matrix_path(version)) as data:
+            n = data['ids'].shape[0]
+            matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=(n, n))
+            return matrix, data['ids']
+
+    def record(self, user_id, tracks, merge=False):
+        """Store a user's listened Track records as their basket, or with `merge` add them to it"""
+        track_ids = list(dict.fromkeys(track.id for track in tracks))
+        if not track_ids:
+            return
+        with self._connection() as db:
+            if merge:
+                row = db.execute("SELECT track_ids FROM baskets WHERE user_id = ?", (user_id,)).fetchone()
+                if row:
+                    # Newest plays first, so the oldest fall off once the basket is full
+                    track_ids = list(dict.fromkeys(track_ids + json.loads(row[0])))
+            db.execute(
+                "INSERT INTO baskets (user_id, track_ids, applied, pending, updated_at) VALUES (?, ?, NULL, 1, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET "
+                "track_ids = excluded.track_ids, pending = 1, updated_at = excluded.updated_at",
+                (user_id, json.dumps(track_ids[:self.max_basket]), time.time())
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO tracks (track_id, record) VALUES (?, ?)",
+                [(track.id, json.dumps(track.to_dict(), separators=(',', ':'))) for track in tracks]
+            )
+        self._ensure_updater()
+
+    def update(self, batch_size=1000):
+        """Fold up to `batch_size` changed baskets into the matrix; returns how many were applied"""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(
+                "SELECT user_id, track_ids, applied FROM baskets WHERE pending = 1 LIMIT ?", (batch_size,)
+            ).fetchall()
+            if not rows:
+                db.execute("COMMIT")
+                return 0
+            version = self._stored_version(db)
+            matrix, ids = self._read_matrix(version)
+
+            ids = list(ids)
+            index = {track_id: i for i, track_id in enumerate(ids)}
+            new_baskets = [json.loads(row[1]) for row in rows]
+            old_baskets = [json.loads(row[2]) if row[2] else [] for row in rows]
+            for basket in new_baskets:
+                for track_id in basket:
+                    if track_id not in index:
+                        index[track_id] = len(ids)
+                        ids.append(track_id)
+            n = len(ids)
+
+            def incidence(baskets):
+                rows = np.repeat(np.arange(len(baskets)), [len(basket) for basket in baskets])
+                cols = np.fromiter((index[t] for basket in baskets for t in basket), dtype=np.int64, count=len(rows))
+                return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(baskets), n))
+
+            new, old = incidence(new_baskets), incidence(old_baskets)
+            matrix.resize((n, n))
+            matrix = (matrix + (new.T @ new) - (old.T @ old)).tocsr()
+            matrix.eliminate_zeros()
+
+            version += 1
+            path = self._matrix_path(version)
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, data=matrix.data.astype(np.int32), indices=matrix.indices, indptr=matrix.indptr,
+                         ids=np.array(ids, dtype='U32'))
+            os.replace(path + '.tmp', path)
+            db.executemany(
+                "UPDATE baskets SET applied = track_ids, pending = 0 WHERE user_id = ?", [(row[0],) for row in rows]
+            )
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        # Other processes load the new version on their next check; the previous file is kept
+        # for any still loading it, anything older is no longer read
+        keep = {path, self._matrix_path(version - 1)}
+        for old_path in glob.glob(os.path.join(self.directory, 'cooccurrence-*.npz')):
+            if old_path not in keep:
+                os.remove(old_path)
+        logger.info(f"Co-occurrence index v{version}: {len(rows)} baskets applied, {n} tracks, {matrix.nnz} pairs")
+        return len(rows)
+
+    def _current(self):
+        """The loaded (version, matrix, ids, index, listeners), reloaded when a newer version was saved"""
+        now = time.monotonic()
+        if self._state is not None and now - self._checked_at < self.reload_interval:
+            return self._state
+        with self._load_lock:
+            if self._state is None or now - self._checked_at >= self.reload_interval:
+                version = self._stored_version(self._connection())
+                if self._state is None or self._state[0] != version:
+                    matrix, ids = self._read_matrix(version)
+                    # The diagonal counts each track's listeners
+                    listeners = matrix.diagonal().astype(np.float64)
+                    self._state = (version, matrix, ids, {t: i for i, t in enumerate(ids)}, listeners)
+                self._checked_at = now
+        return self._state
+
+    @property
+    def version(self):
+        return self._current()[0]
+
+    def similar(self, user_id, k):
+        """Up to k (track ID, score) pairs most played by users who share tracks with this user, best first.
+
+        Scores sum co-occurrence counts over the user's basket, divided by the
+        square root of each track's listener count so ubiquitous tracks do not
+        crowd out everything else. The user's own tracks are excluded.
+        """
+        row = self._connection().execute("SELECT track_ids FROM baskets WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return []
+        _, matrix, ids, index, listeners = self._current()
+        basket = [index[track_id] for track_id in json.loads(row[0]) if track_id in index]
+        if not basket or k <= 0:
+            return []
+
+        query = sparse.csr_matrix(
+            (np.ones(len(basket)), (np.zeros(len(basket), dtype=np.int64), basket)), shape=(1, len(ids))
+        )
+        result = (query @ matrix).tocsr()
+        cols, counts = result.indices, result.data.astype(np.float64)
+        keep = ~np.isin(cols, basket) & (listeners[cols] >= self.min_listeners)
+        cols, scores = cols[keep], counts[keep] / np.sqrt(listeners[cols[keep]])
+        if not len(cols):
+            return []
+
+        k = min(k, len(cols))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(cols) else np.arange(len(cols))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(str(ids[cols[i]]), float(scores[i])) for i in top]
+
+    def tracks(self, track_ids):
+        """Track records for IDs, in the given order (unknown IDs are skipped)"""
+        if not track_ids:
+            return []
+        placeholders = ', '.join('?' * len(track_ids))
+        rows = self._connection().execute(
+            f"SELECT track_id, record FROM tracks WHERE track_id IN ({placeholders})", list(track_ids)
+        ).fetchall()
+        records = {track_id: record for track_id, record in rows}
+        return [Track.from_dict(json.loads(records[t])) for t in track_ids if t in records]
+
+    def recommend(self, user_id, k):
+        """Track records of the k best co-listened tracks for a user"""
+        return self.tracks([track_id for track_id, _ in self.similar(user_id, k)])
+
+    def stats(self):
+        db = self._connection()
+        (users,) = db.execute("SELECT COUNT(*) FROM baskets").fetchone()
+        (pending,) = db.execute("SELECT COUNT(*) FROM baskets WHERE pending = 1").fetchone()
+        version, matrix, ids, _, _ = self._current()
+        return {"version": version, "users": users, "pending": pending, "tracks": len(ids), "pairs": int(matrix.nnz)}
+
+    def _ensure_updater(self):
+        if self.update_interval <= 0:
+            return
+        if self._updater is not None and self._updater.is_alive():
+            return
+        with self._load_lock:
+            if self._updater is not None and self._updater.is_alive():
+                return
+            self._updater = threading.Thread(target=self._update_loop, name='cooccurrence', daemon=True)
+            self._updater.start()
+
+    def _update_loop(self):
+        while not self._stop.wait(self.update_interval):
+            try:
+                while self.update() and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                logger.error(f"Co-occurrence update failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def create_cooccurrence_index():
+    """Build the co-occurrence index from COOCCURRENCE_* environment variables, or None unless COOCCURRENCE_PATH is set"""
+    directory = os.environ.get('COOCCURRENCE_PATH')
+    if not directory:
+        return None
+    return CooccurrenceIndex(
+        directory,
+        max_basket=int(os.environ.get('COOCCURRENCE_MAX_BASKET', MAX_BASKET)),
+        min_listeners=int(os.environ.get('COOCCURRENCE_MIN_LISTENERS', 2)),
+        update_interval=int(os.environ.get('COOCCURRENCE_UPDATE_INTERVAL', 300))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the cross-user track co-occurrence index")
+    parser.add_argument('command', choices=['update', 'info'])
+    parser.add_argument('directory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    index = CooccurrenceIndex(args.directory, update_interval=0)
+    if args.command == 'update':
+        start = time.perf_counter()
+        applied = 0
+        while True:
+            batch = index.update()
+            if not batch:
+                break
+            applied += batch
+        print(f"Applied {applied} baskets in {time.perf_counter() - start:.1f}s")
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Local fake of the Spotify Web API and accounts service, for benchmarks and offline testing.
+
+Responses are synthetic but deterministic (the same request always gets the
+same tracks and audio features), or replayed from a fixtures file mapping
+request keys such as "/v1/search?limit=50&q=genre%3Apop&type=track" to
+recorded JSON bodies. The bearer token doubles as the user ID, so many users
+can be simulated without real accounts.
+
+Run standalone: python fake_spotify.py --port 8900 --latency-ms 50
+then start the app with SPOTIFY_API_URL=http://127.0.0.1:8900/v1/ and
+SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8900.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+GENRES = ['acoustic', 'ambient', 'blues', 'classical', 'country', 'dance', 'electronic', 'folk', 'hip-hop',
+          'indie', 'jazz', 'latin', 'metal', 'pop', 'r-n-b', 'reggae', 'rock', 'soul']
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def spotify_id(seed):
+    """Deterministic 22-character base62 ID"""
+    value = int.from_bytes(hashlib.sha1(str(seed).encode('utf-8')).digest(), 'big')
+    chars = []
+    for _ in range(22):
+        value, index = divmod(value, 62)
+        chars.append(BASE62[index])
+    return ''.join(chars)
+
+
+def fake_track(seed):
+    rng = random.Random(seed)
+    track_id = spotify_id(seed)
+    artist = rng.randrange(500)
+    album = rng.randrange(2000)
+    return {
+        "id": track_id,
+        "name": f"Track {track_id[:6]}",
+        "artists": [{"id": spotify_id(f'artist-{artist}'), "name": f"Artist {artist}"}],
+        "album": {
+            "name": f"Album {album}",
+            "images": [{"url": f"https://i.scdn.co/image/{spotify_id(f'album-{album}')}", "height": 640, "width": 640}]
+        },
+        "preview_url": None,
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        "popularity": rng.randrange(100),
+        "duration_ms": rng.randrange(120000, 360000)
+    }
+
+
+def fake_audio_features(track_id):
+    rng = random.Random(track_id)
+    return {
+        "id": track_id,
+        "danceability": rng.random(),
+        "energy": rng.random(),
+        "key": rng.randrange(12),
+        "loudness": -rng.random() * 30,
+        "mode": rng.randrange(2),
+        "speechiness": rng.random() * 0.5,
+        "acousticness": rng.random(),
+        "instrumentalness": rng.random() ** 3,
+        "liveness": rng.random() * 0.6,
+        "valence": rng.random(),
+        "tempo": 60 + rng.random() * 120,
+        "time_signature": rng.choice([3, 4, 4, 4, 5])
+    }
+
+
+def request_key(path, query):
+    return path + ('?' + urlencode(sorted(parse_qsl(query))) if query else '')
+
+
+class FakeSpotify:
+    """The fake API's responses, independent of the HTTP layer"""
+
+    def __init__(self, fixtures=None):
+        self.fixtures = fixtures or {}
+        self.requests = 0
+        self.requests_by_path = Counter()
+        self._rate_limits = {}
+        self._lock = threading.Lock()
+
+    def rate_limit(self, path, count=1, retry_after=0):
+        """Answer the next `count` requests to `path` with 429 and a Retry-After header"""
+        with self._lock:
+            self._rate_limits[path.rstrip('/')] = (count, retry_after)
+
+    def headers(self, status, path):
+        """Extra response headers for a response"""
+        if status == 429:
+            return {"Retry-After": str(self._rate_limits.get(path.rstrip('/'), (0, 0))[1])}
+        return {}
+
+    def respond(self, method, path, query, token):
+        """(status, JSON body) for one request"""
+        with self._lock:
+            self.requests += 1
+            self.requests_by_path[path.rstrip('/')] += 1
+            count, retry_after = self._rate_limits.get(path.rstrip('/'), (0, 0))
+            if count > 0:
+                self._rate_limits[path.rstrip('/')] = (count - 1, retry_after)
+                return 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+        key = request_key(path, query)
+        if key in self.fixtures:
+            return 200, self.fixtures[key]
+
+        params = dict(parse_qsl(query))
+        limit = int(params.get('limit', 20))
+        offset = int(params.get('offset', 0))
+        user = token or 'anonymous'
+
+        if method == 'POST' and path == '/api/token':
+            return 200, {
+                "access_token": f"token-{spotify_id(time.time())}",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "scope": ""
+            }
+        if not token:
+            return 401, {"error": {"status": 401, "message": "No token provided"}}
+
+        path = path.rstrip('/')
+        if path == '/v1/me':
+            return 200, {"id": user, "display_name": user, "followers": {"total": 0}, "images": []}
+        if path == '/v1/me/top/tracks':
+            time_range = params.get('time_range', 'medium_term')
+            return 200, {"items": [fake_track(f'{user}-{time_range}-{offset + i}') for i in range(limit)]}
+        if path == '/v1/me/player/recently-played':
+            after = params.get('after')
+            # Returning users have played a handful of tracks since their last cursor
+            count = 5 if after else limit
+            start = int(after) if after else 0
+            items = [{"track": fake_track(f'{user}-recent-{start + i}'), "played_at": "2024-01-01T00:00:00.000Z"}
+                     for i in range(count)]
+            return 200, {"items": items, "cursors": {"after": str(start + count), "before": str(start)}}
+        if path == '/v1/me/tracks':
+            return 200, {"items": [{"track": fake_track(f'{user}-saved-{offset + i}')} for i in range(limit)]}
+        if path == '/v1/audio-features':
+            ids = [track_id for track_id in params.get('ids', '').split(',') if track_id]
+            return 200, {"audio_features": [fake_audio_features(track_id) for track_id in ids]}
+        if path == '/v1/search':
+            q = params.get('q', '')
+            return 200, {"tracks": {
+                "items": [fake_track(f'search-{q}-{offset + i}') for i in range(limit)],
+                "limit": limit, "offset": offset, "total": 1000
+            }}
+        if path == '/v1/recommendations/available-genre-seeds':
+            return 200, {"genres": GENRES}
+        if path == '/v1/recommendations':
+            if limit > 100:
+                return 400, {"error": {"status": 400, "message": "Invalid limit"}}
+            seeds = params.get('seed_tracks') or params.get('seed_genres') or ''
+            return 200, {"tracks": [fake_track(f'rec-{seeds}-{i}') for i in range(limit)], "seeds": []}
+        if path == '/v1/browse/featured-playlists':
+            return 200, {"playlists": {"items": [{"id": spotify_id(f'playlist-{i}')} for i in range(limit)]}}
+        match = re.fullmatch(r'/v1/playlists/([^/]+)/tracks', path)
+        if match:
+            return 200, {"items": [{"track": fake_track(f'playlist-{match.group(1)}-{offset + i}')} for i in range(limit)]}
+        return 404, {"error": {"status": 404, "message": f"Unknown endpoint {path}"}}
+
+
+def make_handler(fake, latency=0.0, jitter=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # Headers and body go out in separate writes; without this Nagle's
+            # algorithm and delayed ACKs add ~40ms to every keep-alive response
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, format, *args):
+            pass
+
+        def _handle(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            url = urlsplit(self.path)
+            authorization = self.headers.get('Authorization', '')
+            token = authorization[7:] if authorization.startswith('Bearer ') else None
+
+            if latency or jitter:
+                time.sleep(latency + random.random() * jitter)
+            status, body = fake.respond(method, url.path, url.query, token)
+
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            for name, value in fake.headers(status, url.path).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+    return Handler
+
+
+def start_server(port=0, latency_ms=0.0, jitter_ms=0.0, fixtures=None):
+    """Serve the fake API on a daemon thread; returns (server, FakeSpotify). server.server_address has the port."""
+    fake = FakeSpotify(fixtures)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake, latency_ms / 1000, jitter_ms / 1000))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-spotify', daemon=True).start()
+    return server, fake
+
+
+def load_fixtures(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="added to every response")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="extra random latency, uniform in [0, jitter)")
+    parser.add_argument('--fixtures', help="JSON file of recorded responses keyed by request path and query")
+    args = parser.parse_args()
+
+    server, _ = start_server(args.port, args.latency_ms, args.jitter_ms, load_fixtures(args.fixtures))
+    print(f"Fake Spotify API on http://127.0.0.1:{server.server_address[1]}/v1/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from forking import after_fork_in_child
+from sqlite_connections import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+# Audio features used by the recommender, in the order they are stored in the cache
+FEATURE_COLUMNS = [
+    'danceability', 'energy', 'key', 'loudness', 'mode',
+    'speechiness', 'acousticness', 'instrumentalness',
+    'liveness', 'valence', 'tempo', 'time_signature'
+]
+
+
+def features_to_vector(features):
+    """Convert a Spotify audio_features dict into a float vector (NaN for missing values)"""
+    return np.array(
+        [features.get(col) if features.get(col) is not None else np.nan for col in FEATURE_COLUMNS],
+        dtype=np.float64
+    )
+
+
+class FeatureCache:
+    """Track ID -> audio feature vector cache with an LRU/TTL memory tier and optional SQLite tier.
+
+    Audio features never change for a track, so entries only leave the cache
+    through LRU eviction or the (optional) TTL. Tracks Spotify has no features
+    for are cached as None so they are not requested again either. The SQLite
+    file may be shared by every worker process; each thread uses its own
+    connection, and disk I/O happens outside the memory tier's lock.
+    """
+
+    def __init__(self, max_size=50000, ttl=None, db_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._reset()
+        # A lock held by another thread at fork time would never be released in the child
+        after_fork_in_child(self._reset)
+        self._connection = self._open_db()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+
+    def _open_db(self):
+        if not self.db_path:
+            return None
+        try:
+            connection = ThreadLocalConnections(self.db_path, timeout=10)
+            with connection() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS audio_features ("
+                    "track_id TEXT PRIMARY KEY, vector BLOB, stored_at REAL)"
+                )
+            logger.info(f"Audio feature disk cache opened at {self.db_path}")
+            return connection
+        except sqlite3.Error as e:
+            logger.error(f"Could not open audio feature disk cache at {self.db_path}: {e}")
+            return None
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _remember(self, track_id, vector, stored_at):
+        self._entries[track_id] = (vector, stored_at)
+        self._entries.move_to_end(track_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, track_ids, record_stats=True):
+        """Look up track IDs. Returns ({track_id: vector or None}, [missing track IDs])
+
+        Pass record_stats=False for speculative lookups (e.g. prefetching) so
+        they do not skew the hit/miss counters.
+        """
+        now = time.time()
+        found = {}
+        missing = []
+
+        with self._lock:
+            for track_id in track_ids:
+                entry = self._entries.get(track_id)
+                if entry is not None and not self._expired(entry[1], now):
+                    self._entries.move_to_end(track_id)
+                    found[track_id] = entry[0]
+                    if record_stats:
+                        self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._entries[track_id]
+                    missing.append(track_id)
+
+        if missing and self._connection is not None:
+            rows = [row for row in self._load_from_disk(missing) if not self._expired(row[2], now)]
+            with self._lock:
+                for track_id, vector, stored_at in rows:
+                    self._remember(track_id, vector, stored_at)
+                    found[track_id] = vector
+                if record_stats:
+                    self.disk_hits += len(rows)
+            missing = [track_id for track_id in missing if track_id not in found]
+
+        if record_stats:
+            with self._lock:
+                self.misses += len(missing)
+
+        return found, missing
+
+    def _load_from_disk(self, track_ids):
+        rows = []
+        try:
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(track_ids), 500):
+                chunk = track_ids[i:i+500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = self._connection().execute(
+                    f"SELECT track_id, vector, stored_at FROM audio_features WHERE track_id IN ({placeholders})",
+                    chunk
+                )
+                for track_id, blob, stored_at in cursor:
+                    vector = np.frombuffer(blob, dtype=np.float64).copy() if blob is not None else None
+                    rows.append((track_id, vector, stored_at))
+        except sqlite3.Error as e:
+            logger.warning(f"Audio feature disk cache read failed: {e}")
+        return rows
+
+    def put_many(self, vectors):
+        """Store {track_id: vector or None} in both tiers"""
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            for track_id, vector in vectors.items():
+                self._remember(track_id, vector, now)
+
+        if self._connection is not None:
+            try:
+                with self._connection() as db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO audio_features (track_id, vector, stored_at) VALUES (?, ?, ?)",
+                        [
+                            (track_id, vector.tobytes() if vector is not None else None, now)
+                            for track_id, vector in vectors.items()
+                        ]
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Audio feature disk cache write failed: {e}")
+
+    def stats(self):
+        """Hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "disk_enabled": self._connection is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+
+def create_feature_cache():
+    """Build the feature cache from FEATURE_CACHE_* environment variables"""
+    ttl = int(os.environ.get('FEATURE_CACHE_TTL', 0))
+    return FeatureCache(
+        max_size=int(os.environ.get('FEATURE_CACHE_SIZE', 50000)),
+        ttl=ttl if ttl > 0 else None,
+        db_path=os.environ.get('FEATURE_CACHE_PATH') or None
+    )
@@ -0,0 +1,11 @@
+import os
+
+
+def after_fork_in_child(callback):
+    """Call `callback` in the child process after every fork.
+
+    os.register_at_fork only exists where os.fork does (not on Windows);
+    without fork there is no inherited state to reset, so this is a no-op.
+    """
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=callback)
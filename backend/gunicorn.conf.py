@@ -0,0 +1,44 @@
+# Gunicorn configuration for production: gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# Threaded workers: Spotify calls block on I/O, so each worker serves several
+# requests at once and one slow upstream call no longer stalls everyone
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', min(2 * multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app (pandas, NumPy, candidate pool) once in the master and fork
+# workers from it, so read-only pages are shared copy-on-write. With
+# STARTUP_MODE=lazy only the light web layer is preloaded.
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 20))
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+accesslog = '-'
+errorlog = '-'
+
+# In-memory profiles and jobs would be private to one worker; share them through SQLite
+if workers > 1:
+    os.environ.setdefault('PROFILE_STORE', 'sqlite')
+    os.environ.setdefault('JOB_QUEUE', 'sqlite')
+
+
+def post_worker_init(worker):
+    # STARTUP_MODE=lazy skips preloading; warm each worker once it is serving
+    from app import STARTUP_MODE, warm_up_in_background
+    if STARTUP_MODE == 'lazy':
+        warm_up_in_background()
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
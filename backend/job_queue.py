@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from forking import after_fork_in_child
+from sqlite_connections import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+def new_job(kind, key, payload):
+    return {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "key": key,
+        "status": 'queued',
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None
+    }
+
+
+class MemoryJobStore:
+    """Jobs kept in this process only; status is only visible to the worker that accepted the job.
+
+    Running jobs are never claimed again: they can only be left behind by a
+    process that died, and that takes this store with it.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create_unique(self, job, max_queued):
+        """Insert job unless one for the same kind/key is active; returns (job, created)"""
+        with self._lock:
+            for existing in self._jobs.values():
+                if (existing['kind'], existing['key']) == (job['kind'], job['key']) and existing['status'] in ACTIVE_STATUSES:
+                    return dict(existing), False
+            if sum(j['status'] == 'queued' for j in self._jobs.values()) >= max_queued:
+                raise QueueFull()
+            self._jobs[job['id']] = dict(job)
+            return dict(job), True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def claim(self, stale_after):
+        """Mark the oldest queued job as running and return it"""
+        with self._lock:
+            runnable = [j for j in self._jobs.values() if j['status'] == 'queued']
+            if not runnable:
+                return None
+            job = min(runnable, key=lambda j: j['created_at'])
+            job.update(status='running', started_at=time.time())
+            return dict(job)
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(status=status, result=result, error=error, finished_at=time.time(), payload=None)
+
+    def queued_before(self, job):
+        with self._lock:
+            return sum(j['status'] == 'queued' and j['created_at'] < job['created_at'] for j in self._jobs.values())
+
+    def prune(self, older_than):
+        with self._lock:
+            for job_id in [i for i, j in self._jobs.items() if j['finished_at'] and j['finished_at'] < older_than]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Jobs in a SQLite file: they survive restarts and every worker process can run or report them"""
+
+    COLUMNS = ['id', 'kind', 'key', 'status', 'payload', 'result', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def __init__(self, path):
+        self.path = path
+        # Transactions are explicit (BEGIN IMMEDIATE), so connections run in autocommit mode
+        self._connection = ThreadLocalConnections(path, timeout=10, isolation_level=None)
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, key TEXT, status TEXT, payload TEXT, result TEXT, error TEXT, "
+                "created_at REAL, started_at REAL, finished_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (kind, key, status)")
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        for field in ('payload', 'result'):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def _transaction(self, db):
+        # BEGIN IMMEDIATE takes the write lock up front, so check-then-insert and claims are atomic across processes
+        db.execute("BEGIN IMMEDIATE")
+
+    def create_unique(self, job, max_queued):
+        db = self._connection()
+        self._transaction(db)
+        try:
+            existing = db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE kind = ? AND key = ? AND status IN ('queued', 'running')",
+                (job['kind'], job['key'])
+            ).fetchone()
+            if existing:
+                db.execute("COMMIT")
+                return self._row_to_job(existing), False
+            (queued,) = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= max_queued:
+                db.execute("COMMIT")
+                raise QueueFull()
+            db.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [json.dumps(job[c]) if c in ('payload', 'result') and job[c] is not None else job[c] for c in self.COLUMNS]
+            )
+            db.execute("COMMIT")
+            return job, True
+        except QueueFull:
+            raise
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_job(row)
+
+    def claim(self, stale_after):
+        now = time.time()
+        db = self._connection()
+        self._transaction(db)
+        try:
+            row = db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND started_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now - stale_after,)
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (now, row[0]))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        job = self._row_to_job(row)
+        if job:
+            job.update(status='running', started_at=now)
+        return job
+
+    def finish(self, job_id, status, result=None, error=None):
+        # The payload (which may hold credentials) is dropped once the job is done
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, payload = NULL WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+
+    def queued_before(self, job):
+        (count,) = self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (job['created_at'],)
+        ).fetchone()
+        return count
+
+    def prune(self, older_than):
+        self._connection().execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (older_than,))
+
+
+class JobQueue:
+    """Bounded pool of worker threads running queued jobs by kind.
+
+    At most one job per (kind, key) is queued or running at a time; a
+    duplicate submission gets the existing job back. Submissions beyond
+    `max_queued` waiting jobs raise QueueFull. With a shared (SQLite) store,
+    running jobs not finished within `stale_after` seconds (e.g. their
+    process died) are picked up again.
+    """
+
+    def __init__(self, store, max_workers=2, max_queued=100, poll_interval=1.0, stale_after=600, result_ttl=3600):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.result_ttl = result_ttl
+        self.handlers = {}
+        self._reset()
+        # Worker threads do not survive fork; children start their own on first use
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+
+    def register(self, kind, handler):
+        """handler(payload) returns the job's result, or raises to fail it"""
+        self.handlers[kind] = handler
+
+    def submit(self, kind, key, payload):
+        """Queue a job, or return the active one for the same key; returns (job, created)"""
+        self.store.prune(time.time() - self.result_ttl)
+        job, created = self.store.create_unique(new_job(kind, key, payload), self.max_queued)
+        if created:
+            logger.info(f"Queued {kind} job {job['id']} for {key}")
+        self.start()
+        self._wakeup.set()
+        return job, created
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def position(self, job):
+        """Number of queued jobs ahead of a queued job"""
+        return self.store.queued_before(job)
+
+    def start(self):
+        """Start the worker threads if they are not running"""
+        if len(self._workers) >= self.max_workers:
+            return
+        with self._lock:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._work, name=f'job-worker-{len(self._workers)}', daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim(self.stale_after)
+            except Exception as e:
+                logger.error(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                # Jobs queued by other processes are only seen on the next poll
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        handler = self.handlers.get(job['kind'])
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind '{job['kind']}'")
+            result = handler(job['payload'])
+            self.store.finish(job['id'], 'done', result=result)
+            logger.info(f"Finished {job['kind']} job {job['id']} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"{job['kind']} job {job['id']} failed: {e}")
+            self.store.finish(job['id'], 'failed', error=str(e))
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+
+def create_job_queue():
+    """Build the job queue from JOB_* environment variables"""
+    backend = os.environ.get('JOB_QUEUE', 'memory')
+    if backend == 'sqlite':
+        path = os.environ.get('JOB_QUEUE_PATH', 'jobs.db')
+        logger.info(f"Using SQLite job queue at {path}")
+        store = SQLiteJobStore(path)
+    else:
+        if backend != 'memory':
+            logger.warning(f"Unknown JOB_QUEUE '{backend}', using in-memory queue")
+        store = MemoryJobStore()
+    return JobQueue(
+        store,
+        max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+        max_queued=int(os.environ.get('JOB_QUEUE_SIZE', 100)),
+        poll_interval=float(os.environ.get('JOB_POLL_INTERVAL', 1.0)),
+        stale_after=int(os.environ.get('JOB_STALE_AFTER', 600))
+    )
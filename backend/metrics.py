@@ -0,0 +1,249 @@
+import bisect
+import cProfile
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans in-process stages (sub-millisecond) through slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, as Prometheus expects"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, with a final +Inf bucket
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, key), total
+            yield self.name + '_count', _format_labels(self.labelnames, key), count
+
+
+class CallbackMetric:
+    """Metric whose samples are read on scrape from fn(), returning {label values tuple: value}"""
+
+    def __init__(self, name, documentation, labelnames, fn, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning(f"Could not collect {self.name}: {e}")
+            return
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, labelnames, fn, kind='gauge'):
+        return self.register(CallbackMetric(name, documentation, labelnames, fn, kind))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SPOTIFY_REQUEST_SECONDS = REGISTRY.histogram(
+    'spotify_request_seconds', "Latency of Spotify API responses by endpoint", ['endpoint']
+)
+SPOTIFY_ERRORS = REGISTRY.counter(
+    'spotify_errors_total', "Spotify API error responses by endpoint and status (429 = rate limited)",
+    ['endpoint', 'status']
+)
+SPOTIFY_RETRIES = REGISTRY.counter(
+    'spotify_rate_limit_retries_total', "Calls retried after a 429 response"
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    'stage_seconds', "Time spent in each recommendation pipeline stage", ['stage']
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_seconds', "Time to produce a response, by route and status", ['route', 'method', 'status']
+)
+
+# Spotify IDs and other long opaque path segments are folded so endpoint labels stay few
+_ID_SEGMENT = re.compile(r'/[A-Za-z0-9]{16,}(?=/|$)')
+
+
+def endpoint_label(url):
+    path = url.split('?', 1)[0].split('://', 1)[-1]
+    path = path[path.find('/'):] if '/' in path else '/'
+    return _ID_SEGMENT.sub('/{id}', path)
+
+
+def record_spotify_response(response, *args, **kwargs):
+    """requests response hook timing every Spotify call made through the shared session"""
+    endpoint = endpoint_label(response.request.url)
+    SPOTIFY_REQUEST_SECONDS.observe(response.elapsed.total_seconds(), endpoint=endpoint)
+    if response.status_code >= 400:
+        SPOTIFY_ERRORS.inc(endpoint=endpoint, status=str(response.status_code))
+
+
+def stage(name):
+    """Context manager timing one pipeline stage"""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def timed_stage(name):
+    """Decorator timing every call of a function as one pipeline stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SlowRequestProfiler:
+    """Opt-in cProfile of requests, keeping a .prof dump of those slower than `threshold` seconds.
+
+    Only one request is profiled at a time (cProfile is per thread and its
+    overhead would add up); concurrent requests simply run unprofiled.
+    """
+
+    def __init__(self, threshold, directory):
+        self.threshold = threshold
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """Returns a running profiler, or None if another request is being profiled"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self._lock.release()
+            return None
+        return profiler
+
+    def stop(self, profiler, elapsed, label):
+        try:
+            profiler.disable()
+            if elapsed >= self.threshold:
+                name = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_') or 'root'
+                path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{name}.prof")
+                profiler.dump_stats(path)
+                logger.warning(f"Slow request {label} took {elapsed * 1000:.0f}ms; profile written to {path}")
+        finally:
+            self._lock.release()
+
+
+def create_slow_request_profiler():
+    """Profiler from SLOW_REQUEST_PROFILE_* environment variables, or None when not enabled"""
+    threshold_ms = float(os.environ.get('SLOW_REQUEST_PROFILE_MS', 0))
+    if threshold_ms <= 0:
+        return None
+    directory = os.environ.get('SLOW_REQUEST_PROFILE_DIR', 'request_profiles')
+    logger.info(f"Profiling requests; dumps for those over {threshold_ms:.0f}ms go to {directory}")
+    return SlowRequestProfiler(threshold_ms / 1000, directory)
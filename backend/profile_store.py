@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from sqlite_connections import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAGIC = b'SRP1'
+
+
+def new_handle():
+    """Random opaque handle for a user, safe to put in a (signed but readable) session cookie"""
+    return secrets.token_urlsafe(24)
+
+
+def encode_profile(profile):
+    """Encode a user profile as a JSON header followed by raw little-endian float64 arrays.
+
+    NumPy arrays anywhere in the (nested) profile dict are stored as binary;
+    everything else goes into the JSON header.
+    """
+    arrays = []
+
+    def split(value, path):
+        if isinstance(value, np.ndarray):
+            arrays.append((path, value))
+            return None
+        if isinstance(value, dict):
+            return {key: split(item, path + [key]) for key, item in value.items()}
+        return value
+
+    meta = split(profile, [])
+    header = json.dumps({
+        'meta': meta,
+        'arrays': [[path, list(array.shape)] for path, array in arrays]
+    }, separators=(',', ':')).encode('utf-8')
+
+    body = b''.join(np.ascontiguousarray(array, dtype='<f8').tobytes() for _, array in arrays)
+    return PROFILE_MAGIC + struct.pack('<I', len(header)) + header + body
+
+
+def decode_profile(data):
+    """Inverse of encode_profile"""
+    if data[:4] != PROFILE_MAGIC:
+        raise ValueError("Not an encoded user profile")
+    (header_length,) = struct.unpack_from('<I', data, 4)
+    offset = 8 + header_length
+    header = json.loads(data[8:offset].decode('utf-8'))
+
+    profile = header['meta']
+    for path, shape in header['arrays']:
+        count = int(np.prod(shape)) if shape else 1
+        array = np.frombuffer(data, dtype='<f8', count=count, offset=offset).reshape(shape)
+        offset += count * 8
+        target = profile
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = array
+    return profile
+
+
+class MemoryProfileStore:
+    """In-process LRU of encoded profiles keyed by Spotify user ID"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        # handle -> user ID, and the reverse; evicted together, oldest first
+        self._handles = OrderedDict()
+        self._user_handles = {}
+        self._lock = threading.Lock()
+
+    def handle_for(self, user_id):
+        """The opaque handle standing in for a user ID in their session, issued on first use"""
+        with self._lock:
+            handle = self._user_handles.get(user_id)
+            if handle is None:
+                handle = new_handle()
+                self._user_handles[user_id] = handle
+                self._handles[handle] = user_id
+                while len(self._handles) > self.max_size:
+                    _, evicted = self._handles.popitem(last=False)
+                    self._user_handles.pop(evicted, None)
+            return handle
+
+    def resolve_handle(self, handle):
+        """User ID for a handle, or None if it was never issued (or has been evicted)"""
+        with self._lock:
+            return self._handles.get(handle)
+
+    def get(self, key):
+        with self._lock:
+            data = self._profiles.get(key)
+            if data is None:
+                return None
+            self._profiles.move_to_end(key)
+        return decode_profile(data)
+
+    def set(self, key, profile):
+        data = encode_profile(profile)
+        with self._lock:
+            self._profiles[key] = data
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._profiles.pop(key, None)
+
+
+class SQLiteProfileStore:
+    """Encoded profiles in a SQLite file, shared by every worker process on the machine"""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = ThreadLocalConnections(path, timeout=10)
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS user_profiles ("
+                "user_id TEXT PRIMARY KEY, data BLOB, updated_at REAL)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS profile_handles (handle TEXT PRIMARY KEY, user_id TEXT UNIQUE)")
+
+    def handle_for(self, user_id):
+        """The opaque handle standing in for a user ID in their session, issued on first use"""
+        with self._connection() as db:
+            # Concurrent first logins race on the UNIQUE user_id; both read back the winner
+            db.execute("INSERT OR IGNORE INTO profile_handles (handle, user_id) VALUES (?, ?)", (new_handle(), user_id))
+            return db.execute("SELECT handle FROM profile_handles WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def resolve_handle(self, handle):
+        """User ID for a handle, or None if it was never issued"""
+        row = self._connection().execute("SELECT user_id FROM profile_handles WHERE handle = ?", (handle,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT data FROM user_profiles WHERE user_id = ?", (key,)
+        ).fetchone()
+        return decode_profile(row[0]) if row else None
+
+    def set(self, key, profile):
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO user_profiles (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (key, encode_profile(profile), time.time())
+            )
+
+    def delete(self, key):
+        with self._connection() as db:
+            db.execute("DELETE FROM user_profiles WHERE user_id = ?", (key,))
+
+
+def create_profile_store():
+    """Build the profile store from PROFILE_STORE* environment variables"""
+    backend = os.environ.get('PROFILE_STORE', 'memory')
+    if backend == 'sqlite':
+        path = os.environ.get('PROFILE_STORE_PATH', 'profiles.db')
+        logger.info(f"Using SQLite profile store at {path}")
+        return SQLiteProfileStore(path)
+    if backend != 'memory':
+        logger.warning(f"Unknown PROFILE_STORE '{backend}', using in-memory store")
+    return MemoryProfileStore(max_size=int(os.environ.get('PROFILE_STORE_SIZE', 10000)))
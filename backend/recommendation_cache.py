@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from forking import after_fork_in_child
+
+
+class RecommendationCache:
+    """Per-user LRU of ranked track lists, reused while neither the profile nor the candidate pool changes.
+
+    Each user has at most one entry, stamped with the profile version and
+    candidate snapshot version it was ranked from and how deep it was ranked.
+    A lookup with other versions, or deeper than the entry goes, is a miss and
+    the next put replaces the entry, so refits and pool rebuilds invalidate it
+    without any explicit call. Entries also expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=900, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+        # A lock held by another thread at fork time would never be released in the child
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+
+    def get(self, user_id, profile_version, candidate_version, depth):
+        """Ranked tracks (at least `depth`, unless the pool has fewer), or None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if (entry is None or entry[0] <= time.monotonic()
+                    or entry[1:3] != (profile_version, candidate_version)
+                    or (len(entry[3]) < depth and not entry[4])):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, user_id, profile_version, candidate_version, ranked, depth):
+        if self.ttl <= 0 or user_id is None:
+            return
+        # Fewer results than asked for means the whole pool was ranked; any depth is then served
+        exhausted = len(ranked) < depth
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, profile_version, candidate_version, ranked, exhausted)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def users(self, limit=None):
+        """IDs of users with a live entry, most recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            user_ids = [user_id for user_id, entry in reversed(self._entries.items()) if entry[0] > now]
+        return user_ids[:limit] if limit is not None else user_ids
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+def create_recommendation_cache():
+    """Build the recommendation cache from RECOMMENDATION_CACHE_* environment variables"""
+    return RecommendationCache(
+        ttl=float(os.environ.get('RECOMMENDATION_CACHE_TTL', 900)),
+        max_size=int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 10000))
+    )
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+
+from user_model import affine_projection
+
+# PCA profiles with a smaller norm are treated as the zero vector
+ZERO_PROFILE_NORM = 1e-9
+
+# Working memory one batch of users may take while being scored
+MAX_BATCH_BYTES = int(os.environ.get('SCORING_BATCH_MB', 32)) * 1024 * 1024
+
+
+class ScoringEngine:
+    """Scores batches of user profiles against one fixed candidate matrix.
+
+    Every user has their own scaler/PCA, so candidates cannot be projected
+    once for everyone. Instead the candidate matrix is prepared once in
+    homogeneous coordinates ([x, 1], contiguous) and each user's scaler + PCA
+    is folded into an affine map; a batch of users is then projected with a
+    single matmul, cosine-normalised and reduced with np.argpartition.
+    Batches are sized so their intermediates stay within `max_batch_bytes`.
+    """
+
+    def __init__(self, matrix, columns, max_batch_bytes=MAX_BATCH_BYTES):
+        self.columns = list(columns)
+        self.max_batch_bytes = max_batch_bytes
+        matrix = np.asarray(matrix, dtype=np.float64)
+        self.augmented = np.ascontiguousarray(
+            np.hstack([matrix, np.ones((matrix.shape[0], 1), dtype=np.float64)])
+        )
+
+    def __len__(self):
+        return self.augmented.shape[0]
+
+    @property
+    def batch_size(self):
+        # Per user and candidate: the projection (at most one component per column) plus a few score arrays
+        bytes_per_user = max(len(self), 1) * (len(self.columns) + 6) * 8
+        return max(1, self.max_batch_bytes // bytes_per_user)
+
+    def _stack(self, user_profiles):
+        """Per-user affine maps and profile vectors, zero-padded to a common width"""
+        maps = [affine_projection(profile['model'], self.columns) for profile in user_profiles]
+        width = max(m.shape[1] for m in maps)
+
+        weights = np.zeros((self.augmented.shape[1], len(maps) * width), dtype=np.float64)
+        vectors = np.zeros((len(maps), width), dtype=np.float64)
+        for b, (m, profile) in enumerate(zip(maps, user_profiles)):
+            weights[:, b * width:b * width + m.shape[1]] = m
+            vector = np.asarray(profile['pca_profile'], dtype=np.float64)
+            vectors[b, :vector.shape[0]] = vector
+        return weights, vectors, width
+
+    def similarities(self, user_profiles):
+        """Similarity of each profile against every candidate, shape (users, candidates).
+
+        Cosine similarity in the user's PCA space, or 1 / (1 + distance) for
+        profiles at the origin of that space.
+        """
+        results = list(self._similarity_batches(user_profiles))
+        if not results:
+            return np.empty((0, len(self)), dtype=np.float64)
+        return np.vstack(results)
+
+    def _similarity_batches(self, user_profiles):
+        batch_size = self.batch_size
+        for start in range(0, len(user_profiles), batch_size):
+            batch = user_profiles[start:start + batch_size]
+            weights, vectors, width = self._stack(batch)
+
+            # (candidates, users, components) in one matmul
+            projected = (self.augmented @ weights).reshape(len(self), len(batch), width)
+            dots = np.einsum('nbk,bk->bn', projected, vectors)
+            row_norms = np.linalg.norm(projected, axis=2).T
+            profile_norms = np.linalg.norm(vectors, axis=1)[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cosine = np.nan_to_num(dots / (row_norms * profile_norms))
+            # A profile at the origin of the user's PCA space has no direction;
+            # rank by closeness to it instead
+            closeness = 1.0 / (1.0 + row_norms)
+            yield np.where(profile_norms > ZERO_PROFILE_NORM, cosine, closeness)
+
+    def top_k(self, user_profiles, k):
+        """Indices and scores of each profile's k best candidates, best first"""
+        # Reduced batch by batch, so only (users, k) results outlive a batch
+        results = [top_k_rows(scores, k) for scores in self._similarity_batches(user_profiles)]
+        if not results:
+            k = min(k, len(self))
+            return np.empty((0, k), dtype=np.intp), np.empty((0, k), dtype=np.float64)
+        return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+
+    def unit_vectors(self, user_profile):
+        """Candidates projected into one user's PCA space and scaled to unit length, shape (candidates, components)"""
+        weights, _, _ = self._stack([user_profile])
+        projected = self.augmented @ weights
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(projected / norms)
+
+
+def top_k_rows(scores, k):
+    """Row-wise top-k of a 2-D score array via np.argpartition; returns (indices, scores), best first"""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.intp), empty
+
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(candidate_scores, order, axis=1)
+
+
+def mmr_rerank(relevance, vectors, k, diversity=0.3, groups=None, group_cap=0):
+    """Greedy maximal-marginal-relevance order of up to k rows, as row indices.
+
+    Each step takes the row maximising
+    (1 - diversity) * relevance - diversity * (its highest similarity to a row already taken),
+    where similarity is the dot product of the (unit) `vectors`. Those highest
+    similarities are kept in one array and updated with a single matrix-vector
+    product per pick, so the whole pass is O(k·n) vector operations instead of
+    O(k·n²) pairwise comparisons. With `groups` (e.g. artist per row), no group
+    gets more than `group_cap` rows while rows from other groups remain.
+    """
+    relevance = np.asarray(relevance, dtype=np.float64)
+    n = relevance.shape[0]
+    k = min(k, n)
+    # Dissimilar rows (negative cosine) are simply not penalised
+    max_similarity = np.zeros(n, dtype=np.float64)
+    available = np.ones(n, dtype=bool)
+    blocked = np.zeros(n, dtype=bool)
+    codes = None
+    if groups is not None and group_cap > 0 and n:
+        _, codes = np.unique(np.array([str(group) for group in groups]), return_inverse=True)
+        counts = np.zeros(codes.max() + 1, dtype=np.intp)
+
+    order = []
+    for _ in range(k):
+        eligible = available & ~blocked
+        if not eligible.any():
+            # The cap cannot be met; fill up with the best remaining rows
+            eligible = available
+        scores = (1 - diversity) * relevance - diversity * max_similarity
+        best = int(np.argmax(np.where(eligible, scores, -np.inf)))
+        order.append(best)
+        available[best] = False
+        if diversity > 0:
+            np.maximum(max_similarity, vectors @ vectors[best], out=max_similarity)
+        if codes is not None:
+            code = codes[best]
+            counts[code] += 1
+            if counts[code] >= group_cap:
+                blocked |= codes == code
+    return order
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from forking import after_fork_in_child
+
+
+class SharedQueryCache:
+    """Single-flight, short-TTL cache for Spotify queries that do not depend on the user.
+
+    Identical calls made while one is already in flight wait for it and share
+    its response instead of going upstream themselves; the response is then
+    served from memory for `ttl` seconds. Failures are handed to the waiters
+    but never cached. Results are shared between requests, so callers must
+    treat them as read-only.
+    """
+
+    def __init__(self, ttl=60, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._reset()
+        # Calls in flight in a pre-fork parent will never complete in the child
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @staticmethod
+    def _key(fn, args, kwargs):
+        return (getattr(fn, '__name__', repr(fn)), args, tuple(sorted(kwargs.items())))
+
+    def call(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs), answered from the cache or a matching call in flight where possible"""
+        key = self._key(fn, args, kwargs)
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._results.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self.ttl > 0:
+                self._results[key] = (time.monotonic() + self.ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_size:
+                    self._results.popitem(last=False)
+            self._in_flight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._results),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced
+            }
+
+
+def create_shared_query_cache():
+    """Build the shared query cache from SHARED_QUERY_* environment variables"""
+    return SharedQueryCache(
+        ttl=float(os.environ.get('SHARED_QUERY_TTL', 60)),
+        max_size=int(os.environ.get('SHARED_QUERY_CACHE_SIZE', 1024))
+    )
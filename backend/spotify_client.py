@@ -0,0 +1,187 @@
+import http.cookiejar
+import logging
+import os
+import threading
+import time
+
+import requests
+import spotipy
+from spotipy.cache_handler import CacheHandler, MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+
+from forking import after_fork_in_child
+from metrics import record_spotify_response
+from spotify_fetch import http_retry
+
+logger = logging.getLogger(__name__)
+
+SPOTIFY_API_URL = 'https://api.spotify.com/v1/'
+SPOTIFY_ACCOUNTS_URL = 'https://accounts.spotify.com'
+
+# Tokens with less than this many seconds left are refreshed before use, since
+# a call made with them could outlive them
+EXPIRY_SLACK = 60
+
+
+def create_http_session(pool_size=None):
+    """Keep-alive requests.Session shared by every Spotify client in the process.
+
+    5xx responses are retried by urllib3 with backoff; 429s, Retry-After
+    and all, are left to call_with_retry. Cookies are refused so nothing set for one user's
+    request is ever sent with another's. Every response is timed into the
+    spotify_request_seconds metric.
+    """
+    if pool_size is None:
+        pool_size = int(os.environ.get('SPOTIFY_HTTP_POOL_SIZE', 32))
+    session = requests.Session()
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=http_retry())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(record_spotify_response)
+    # Sockets inherited from a pre-fork parent must not be shared; the child
+    # opens its own connections on first use
+    after_fork_in_child(session.close)
+    return session
+
+
+class SharedSessionSpotify(spotipy.Spotify):
+    """spotipy client on a shared session; spotipy closes its session when a client is collected"""
+
+    def __del__(self):
+        pass
+
+
+class NoTokenCache(CacheHandler):
+    """Tokens live in each user's session, never in a process-wide cache"""
+
+    def get_cached_token(self):
+        return None
+
+    def save_token_to_cache(self, token_info):
+        pass
+
+
+class SpotifyClientManager:
+    """Hands out lightweight per-user Spotify clients over one pooled HTTP session.
+
+    A token within `refresh_margin` seconds of expiry is refreshed on a
+    background thread while the request carries on with the still-valid
+    token; the next request from that user picks up the new token. Only a
+    token that has (almost) expired is refreshed inline.
+    """
+
+    def __init__(self, oauth, session, api_url=SPOTIFY_API_URL, refresh_margin=300):
+        self.oauth = oauth
+        self.session = session
+        self.api_url = api_url
+        self.refresh_margin = refresh_margin
+        self._reset()
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # old access token -> (refreshed token_info, old token's expires_at)
+        self._refreshed = {}
+        self._refreshing = set()
+
+    def client(self, access_token):
+        sp = SharedSessionSpotify(auth=access_token, requests_session=self.session)
+        sp.prefix = self.api_url
+        return sp
+
+    def app_client_factory(self, client_id, client_secret):
+        """Factory of clients authorised as the app itself (client credentials), for background work.
+
+        They share the pooled session, its metrics and retry policy, and the
+        configured API and accounts URLs with the per-user clients.
+        """
+        credentials = SpotifyClientCredentials(
+            client_id=client_id,
+            client_secret=client_secret,
+            requests_session=self.session,
+            cache_handler=MemoryCacheHandler()
+        )
+        credentials.OAUTH_TOKEN_URL = self.oauth.OAUTH_TOKEN_URL
+
+        def client_factory():
+            sp = SharedSessionSpotify(auth_manager=credentials, requests_session=self.session)
+            sp.prefix = self.api_url
+            return sp
+        return client_factory
+
+    def client_for(self, token_info):
+        """Client for a session's token_info; returns (client, token_info), the latter replaced if refreshed"""
+        token_info = self.current_token(token_info)
+        return self.client(token_info['access_token']), token_info
+
+    def current_token(self, token_info):
+        """The freshest usable token for token_info, refreshing it inline only if it has expired"""
+        with self._lock:
+            refreshed = self._refreshed.get(token_info['access_token'])
+        if refreshed is not None:
+            token_info = refreshed[0]
+
+        expires_at = token_info.get('expires_at')
+        if expires_at is None or not token_info.get('refresh_token'):
+            return token_info
+
+        remaining = expires_at - time.time()
+        if remaining < EXPIRY_SLACK:
+            try:
+                return self._refresh(token_info)
+            except Exception as e:
+                logger.warning(f"Could not refresh expired Spotify token: {e}")
+                return token_info
+        if remaining < self.refresh_margin:
+            self._refresh_in_background(token_info)
+        return token_info
+
+    def _refresh(self, token_info):
+        new_token_info = self.oauth.refresh_access_token(token_info['refresh_token'])
+        now = time.time()
+        with self._lock:
+            self._refreshed[token_info['access_token']] = (new_token_info, token_info['expires_at'])
+            # Sessions still holding a token past its expiry refresh inline instead
+            for access_token, (_, expires_at) in list(self._refreshed.items()):
+                if expires_at < now:
+                    del self._refreshed[access_token]
+        return new_token_info
+
+    def _refresh_in_background(self, token_info):
+        access_token = token_info['access_token']
+        with self._lock:
+            if access_token in self._refreshing or access_token in self._refreshed:
+                return
+            self._refreshing.add(access_token)
+
+        def run():
+            try:
+                self._refresh(token_info)
+                logger.info("Refreshed Spotify token ahead of expiry")
+            except Exception as e:
+                logger.warning(f"Background Spotify token refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(access_token)
+
+        threading.Thread(target=run, name='token-refresh', daemon=True).start()
+
+
+def create_client_manager(oauth, session):
+    """Build the shared client manager from SPOTIFY_* environment variables.
+
+    SPOTIFY_API_URL and SPOTIFY_ACCOUNTS_URL can point the app at a local
+    stub server instead of Spotify.
+    """
+    accounts_url = os.environ.get('SPOTIFY_ACCOUNTS_URL', SPOTIFY_ACCOUNTS_URL).rstrip('/')
+    oauth.OAUTH_AUTHORIZE_URL = f"{accounts_url}/authorize"
+    oauth.OAUTH_TOKEN_URL = f"{accounts_url}/api/token"
+
+    api_url = os.environ.get('SPOTIFY_API_URL', SPOTIFY_API_URL)
+    return SpotifyClientManager(
+        oauth,
+        session,
+        api_url=api_url if api_url.endswith('/') else api_url + '/',
+        refresh_margin=int(os.environ.get('SPOTIFY_TOKEN_REFRESH_MARGIN', 300))
+    )
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
+from spotipy.exceptions import SpotifyException
+
+from forking import after_fork_in_child
+from metrics import SPOTIFY_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# 429s are retried by call_with_retry (honouring Retry-After up to a cap) instead
+# of the urllib3 adapter, which would block the worker for as long as Spotify asks
+SERVER_ERROR_CODES = (500, 502, 503, 504)
+
+
+def http_retry(retries=3, backoff_factor=0.3):
+    """urllib3 Retry for Spotify HTTP adapters: 5xx responses only, with backoff.
+
+    urllib3 retries any 429 (or 503) carrying Retry-After, whatever the
+    status_forcelist, and sleeps for the full header value; ignoring the
+    header leaves 429s to surface as SpotifyException for call_with_retry.
+    """
+    return urllib3.Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=SERVER_ERROR_CODES,
+        respect_retry_after_header=False
+    )
+
+
+def retry_after_seconds(error, default=1.0):
+    """Seconds to wait according to a 429 response's Retry-After header"""
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return max(float(headers.get('Retry-After', default)), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+def call_with_retry(fn, *args, max_retries=3, max_wait=30.0, **kwargs):
+    """Call a spotipy method, sleeping and retrying when Spotify answers 429"""
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except SpotifyException as e:
+            if e.http_status != 429 or attempt >= max_retries:
+                raise
+            wait = retry_after_seconds(e)
+            if wait > max_wait:
+                logger.warning(f"Spotify asked to retry after {wait}s, giving up")
+                raise
+            attempt += 1
+            SPOTIFY_RETRIES.inc()
+            logger.warning(f"Rate limited by Spotify, retrying in {wait}s (attempt {attempt}/{max_retries})")
+            time.sleep(wait)
+
+
+class SpotifyFetcher:
+    """Bounded thread pool for issuing independent Spotify calls in parallel.
+
+    Every submitted call goes through call_with_retry, so rate limiting is
+    handled per call without holding up unrelated requests.
+    """
+
+    def __init__(self, max_workers=8, max_retries=3, max_wait=30.0):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self._reset()
+        # Threads do not survive fork; children start their own pool on first use
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='spotify-fetch'
+                    )
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule a Spotify call; returns a Future"""
+        return self.executor.submit(
+            call_with_retry, fn, *args,
+            max_retries=self.max_retries, max_wait=self.max_wait, **kwargs
+        )
+
+    def call(self, fn, *args, **kwargs):
+        """Run a Spotify call on the calling thread with the same retry handling"""
+        return call_with_retry(fn, *args, max_retries=self.max_retries, max_wait=self.max_wait, **kwargs)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def create_fetcher():
+    """Build the shared fetcher from SPOTIFY_FETCH_* environment variables"""
+    return SpotifyFetcher(
+        max_workers=int(os.environ.get('SPOTIFY_FETCH_CONCURRENCY', 8)),
+        max_retries=int(os.environ.get('SPOTIFY_FETCH_RETRIES', 3)),
+        max_wait=float(os.environ.get('SPOTIFY_FETCH_MAX_WAIT', 30))
+    )
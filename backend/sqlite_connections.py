@@ -0,0 +1,31 @@
+import sqlite3
+import threading
+
+from forking import after_fork_in_child
+
+
+class ThreadLocalConnections:
+    """Callable handing each thread its own WAL-mode connection to one SQLite file.
+
+    SQLite connections are not thread-safe, and connections inherited from a
+    pre-fork parent must not be reused, so every thread of every process
+    opens its own on first use. Extra keyword arguments go to sqlite3.connect.
+    """
+
+    def __init__(self, path, timeout=10, **connect_kwargs):
+        self.path = path
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+        self._reset()
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._local = threading.local()
+
+    def __call__(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, **self.connect_kwargs)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
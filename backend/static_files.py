@@ -0,0 +1,148 @@
+import argparse
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Build-tool fingerprints such as main.a0e1cadd.js: the name changes whenever the content does
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Precompressed variants by preference, as (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+COMPRESSIBLE = ('.html', '.js', '.css', '.json', '.map', '.svg', '.txt', '.ico', '.webmanifest')
+# Below this size compression saves less than the headers cost
+MIN_COMPRESS_SIZE = 1024
+
+
+class StaticAsset:
+    __slots__ = ('path', 'mimetype', 'etag', 'cache_control', 'variants')
+
+    def __init__(self, path, mimetype, etag, cache_control, variants):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.cache_control = cache_control
+        self.variants = variants
+
+
+class StaticFiles:
+    """Static files indexed once at startup and served without touching the filesystem per lookup.
+
+    Each file gets a content-hash ETag and, when `name.br` / `name.gz` exist
+    beside it (see `compress`), the best variant the client accepts.
+    Fingerprinted build assets are cached for a year as immutable; everything
+    else, index.html included, is revalidated with If-None-Match and answered
+    with 304 when unchanged. Bodies go out through the server's file wrapper
+    (sendfile under gunicorn), not through Python.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.assets = {}
+        self.reload()
+
+    def reload(self):
+        """Rebuild the index, e.g. after a new frontend build was copied in"""
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            names = set(files)
+            for name in files:
+                if name[:-3] in names and name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                    continue
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                assets[relative] = self._index(path, names)
+        self.assets = assets
+        logger.info(f"Indexed {len(assets)} static files in {self.directory}")
+
+    def _index(self, path, names):
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:20]
+        name = os.path.basename(path)
+        variants = {encoding: path + suffix for encoding, suffix in ENCODINGS if name + suffix in names}
+        return StaticAsset(
+            path,
+            mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            digest,
+            IMMUTABLE if HASHED_NAME.search(name) else REVALIDATE,
+            variants
+        )
+
+    def response(self, path):
+        """Response for a file by its path relative to the directory, or None if it is not indexed"""
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+
+        encoding = next((e for e in asset.variants if request.accept_encodings[e]), None)
+        # Each encoding is its own representation, so it needs its own ETag
+        etag = f"{asset.etag}-{encoding}" if encoding else asset.etag
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = send_file(
+                asset.variants[encoding] if encoding else asset.path,
+                mimetype=asset.mimetype, conditional=False, etag=False
+            )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = asset.cache_control
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+def compress(directory, min_size=MIN_COMPRESS_SIZE):
+    """Write name.gz (and name.br, with the brotli package installed) beside each compressible file.
+
+    Variants that would not be smaller are skipped; returns the number written.
+    """
+    if brotli is None:
+        logger.warning("brotli is not installed; writing gzip variants only")
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if not name.endswith(COMPRESSIBLE) or os.path.getsize(path) < min_size:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) < len(data):
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompress a static directory for StaticFiles")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compress_parser = subparsers.add_parser('compress', help="write .gz/.br variants of text assets")
+    compress_parser.add_argument('directory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'compress':
+        print(f"Wrote {compress(args.directory)} compressed variants")
+
+
+if __name__ == '__main__':
+    main()
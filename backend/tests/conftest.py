@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def fake_spotify():
+    """The fake Spotify API on a free port, for the whole test session"""
+    from fake_spotify import start_server
+    server, fake = start_server()
+    yield server, fake
+    server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def app_module(fake_spotify):
+    """The Flask app module, configured against the fake Spotify API"""
+    import bench
+    server, _ = fake_spotify
+    return bench.load_app(server.server_address[1])
@@ -0,0 +1,76 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex
+from candidate_pool import CandidateSnapshot, load_catalog_ann, measure_ann_recall, sample_user_profiles
+from fake_spotify import fake_audio_features
+from feature_cache import FEATURE_COLUMNS, features_to_vector
+from track_catalog import TrackCatalog, append_tracks
+
+# Recall@k of the ANN path against exact ScoringEngine ranking
+MIN_RECALL = 0.8
+
+
+@pytest.fixture(scope='module')
+def fake_matrix():
+    return np.array([features_to_vector(fake_audio_features(f'ann-{i}')) for i in range(30000)])
+
+
+@pytest.fixture(scope='module')
+def snapshot(fake_matrix):
+    return CandidateSnapshot(range(len(fake_matrix)), fake_matrix, FEATURE_COLUMNS, 1, ann_min_candidates=10000)
+
+
+@pytest.mark.parametrize('k', [50, 250])
+def test_recall_against_exact_scoring(snapshot, fake_matrix, k):
+    assert snapshot.ann is not None
+    profiles = sample_user_profiles(fake_matrix, FEATURE_COLUMNS, 30, seed=k)
+    # Users with random and with narrow taste must both be served well
+    for users in (profiles[0::2], profiles[1::2]):
+        assert measure_ann_recall(snapshot, users, k)['recall'] >= MIN_RECALL
+
+
+def test_query_finds_nearest_rows(fake_matrix):
+    index = IVFIndex.build(fake_matrix[:5000], n_lists=50)
+    query = fake_matrix[123]
+    rows, distances = index.query(query, k=10, n_probe=50)
+    exact = np.argsort(np.linalg.norm(index.transform(fake_matrix[:5000]) - index.transform(query), axis=1))[:10]
+    assert rows.tolist() == exact.tolist()
+    assert rows[0] == 123 and distances[0] == pytest.approx(0, abs=1e-5)
+    assert np.all(np.diff(distances) >= 0)
+
+    # Fewer probed rows than asked for: more buckets are scanned
+    assert len(index.query(query, k=2000, n_probe=1)[0]) == 2000
+
+
+def test_query_under_a_metric(fake_matrix):
+    index = IVFIndex.build(fake_matrix[:5000], n_lists=50)
+    # Only the first feature counts
+    metric = np.zeros((len(FEATURE_COLUMNS), 1))
+    metric[0, 0] = 1.0
+    rows, distances = index.query(fake_matrix[0], k=5, n_probe=50, metric=metric)
+    expected = np.sort(np.abs(fake_matrix[:5000, 0] - fake_matrix[0, 0]))[:5]
+    assert np.allclose(distances, expected, atol=1e-5)
+
+
+def test_catalog_index_is_saved_once_and_memory_mapped(tmp_path, fake_matrix):
+    directory = str(tmp_path)
+    track_ids = [f'track{i:05d}' for i in range(2000)]
+    append_tracks(directory, track_ids, fake_matrix[:2000], [{"id": t} for t in track_ids], FEATURE_COLUMNS)
+    catalog = TrackCatalog(directory)
+
+    index = load_catalog_ann(catalog, catalog.matrix())
+    assert isinstance(index.vectors, np.memmap)
+    path = os.path.join(directory, f'ann-{catalog.version:06d}')
+    built_at = os.path.getmtime(os.path.join(path, 'vectors.npy'))
+    load_catalog_ann(catalog, catalog.matrix())
+    assert os.path.getmtime(os.path.join(path, 'vectors.npy')) == built_at
+
+    # An index saved in an older format is rebuilt
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({"rows": 2000}, f)
+    load_catalog_ann(catalog, catalog.matrix())
+    assert IVFIndex.saved_format(path) == 2
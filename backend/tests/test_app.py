@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def log_in(client, user_id):
+    # The fake Spotify API answers /me with the access token as the user ID
+    with client.session_transaction() as session:
+        session['token_info'] = {'access_token': user_id}
+
+
+def test_session_carries_a_handle_not_the_user_id(app_module, client):
+    log_in(client, 'handle-user')
+    assert client.get('/api/analyze-listening-habits').status_code == 200
+    with client.session_transaction() as session:
+        handle = session['profile_key']
+    assert 'handle-user' not in handle
+    assert app_module.get_profile_store().resolve_handle(handle) == 'handle-user'
+
+
+def test_profiles_stay_with_their_owner(app_module, client):
+    log_in(client, 'owner-a')
+    first = client.get('/api/analyze-listening-habits').get_json()
+    # Another account in the same browser, before any callback clears the session
+    log_in(client, 'owner-b')
+    client.get('/api/analyze-listening-habits')
+
+    store = app_module.get_profile_store()
+    a, b = store.get('owner-a'), store.get('owner-b')
+    assert a['user_id'] == 'owner-a' and b['user_id'] == 'owner-b'
+    assert a['total_tracks_analyzed'] == first['total_tracks_analyzed']
+    assert a['top_tracks'][0]['name'] != b['top_tracks'][0]['name']
+
+
+def test_callback_forgets_the_previous_profile(client):
+    log_in(client, 'callback-user')
+    client.get('/api/analyze-listening-habits')
+    client.get('/api/callback?code=test')
+    with client.session_transaction() as session:
+        assert 'profile_key' not in session
+
+
+def test_recommendations_from_a_fresh_profile(app_module, client):
+    log_in(client, 'recommend-user')
+    client.get('/api/analyze-listening-habits')
+    response = client.get('/api/recommendations')
+    assert response.status_code == 200
+    assert response.get_json()['recommendations']
+
+    # Ranked once, then served from the cache
+    hits = app_module.recommender.recommendation_cache.stats()['hits']
+    client.get('/api/recommendations')
+    assert app_module.recommender.recommendation_cache.stats()['hits'] == hits + 1
+
+
+def test_return_visit_without_new_plays_keeps_the_ranking(app_module, client, fake_spotify):
+    _, fake = fake_spotify
+    log_in(client, 'steady-user')
+    client.get('/api/analyze-listening-habits')
+    store = app_module.get_profile_store()
+    profile = store.get('steady-user')
+    client.get('/api/recommendations')
+
+    # Nothing played since the stored cursor
+    key = f"/v1/me/player/recently-played?after={profile['recent_cursor']}&limit=50"
+    fake.fixtures[key] = {"items": [], "cursors": None}
+    try:
+        client.get('/api/analyze-listening-habits')
+    finally:
+        del fake.fixtures[key]
+    assert store.get('steady-user')['updated_at'] == profile['updated_at']
+    hits = app_module.recommender.recommendation_cache.stats()['hits']
+    client.get('/api/recommendations')
+    assert app_module.recommender.recommendation_cache.stats()['hits'] == hits + 1
+
+    # New plays refit the profile, which invalidates the ranking
+    client.get('/api/analyze-listening-habits')
+    assert store.get('steady-user')['updated_at'] > profile['updated_at']
+
+
+def stream_events(response):
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_sends_progress_then_tracks_then_done(app_module, client):
+    log_in(client, 'stream-user')
+    client.get('/api/analyze-listening-habits')
+    response = client.get('/api/recommendations/stream?limit=5', buffered=False)
+    assert response.is_streamed
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    events = stream_events(response)
+
+    kinds = [event['event'] for event in events]
+    assert kinds[0] == 'progress' and 'stage' in events[0]
+    assert kinds[-1] == 'done'
+    tracks = [event['track'] for event in events if event['event'] == 'track']
+    assert len(tracks) == events[-1]['total'] == 5
+    assert events[-1]['next_offset'] == 5
+    # The same ranking as the JSON endpoint
+    page = client.get('/api/recommendations?limit=5').get_json()['recommendations']
+    assert [track['id'] for track in tracks] == [track['id'] for track in page]
+
+
+def test_stream_reports_pipeline_failures_as_an_event(app_module, client, monkeypatch):
+    log_in(client, 'stream-error-user')
+    client.get('/api/analyze-listening-habits')
+
+    def failing(*args, **kwargs):
+        yield 'progress', {'stage': 'candidates'}
+        raise RuntimeError('pipeline failed')
+    monkeypatch.setattr(app_module.recommender, 'iter_recommendations', failing)
+
+    events = stream_events(client.get('/api/recommendations/stream'))
+    assert [event['event'] for event in events] == ['progress', 'error']
+
+
+def test_stream_rejects_requests_before_it_starts(client):
+    assert client.get('/api/recommendations/stream').status_code == 401
+    log_in(client, 'stream-no-profile-user')
+    assert client.get('/api/recommendations/stream').status_code == 400
+    client.get('/api/analyze-listening-habits')
+    assert client.get('/api/recommendations/stream?limit=500').status_code == 400
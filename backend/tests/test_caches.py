@@ -0,0 +1,147 @@
+import multiprocessing
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+import feature_cache
+import recommendation_cache
+from feature_cache import FeatureCache
+from recommendation_cache import RecommendationCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(feature_cache.time, 'time', clock)
+    monkeypatch.setattr(recommendation_cache.time, 'monotonic', clock)
+    return clock
+
+
+def vector(value):
+    return np.full(len(feature_cache.FEATURE_COLUMNS), value, dtype=np.float64)
+
+
+def test_feature_cache_evicts_least_recently_used():
+    cache = FeatureCache(max_size=2)
+    cache.put_many({'a': vector(1), 'b': vector(2)})
+    cache.get_many(['a'])
+    cache.put_many({'c': vector(3)})
+
+    found, missing = cache.get_many(['a', 'b', 'c'])
+    assert set(found) == {'a', 'c'}
+    assert missing == ['b']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_feature_cache_remembers_tracks_without_features():
+    cache = FeatureCache()
+    cache.put_many({'a': None})
+    found, missing = cache.get_many(['a'])
+    assert found == {'a': None} and missing == []
+
+
+def test_feature_cache_ttl(clock):
+    cache = FeatureCache(ttl=60)
+    cache.put_many({'a': vector(1)})
+    clock.now += 59
+    assert cache.get_many(['a'])[1] == []
+    clock.now += 2
+    assert cache.get_many(['a'])[1] == ['a']
+    assert cache.stats()['size'] == 0
+
+
+def test_feature_cache_disk_tier(tmp_path, clock):
+    path = str(tmp_path / 'features.db')
+    FeatureCache(db_path=path, ttl=60).put_many({'a': vector(1), 'b': None})
+
+    cache = FeatureCache(db_path=path, ttl=60)
+    found, missing = cache.get_many(['a', 'b', 'c'])
+    assert np.array_equal(found['a'], vector(1))
+    assert found['b'] is None
+    assert missing == ['c']
+    assert cache.stats()['disk_hits'] == 2
+
+    clock.now += 61
+    assert FeatureCache(db_path=path, ttl=60).get_many(['a'])[1] == ['a']
+
+
+def write_features(path, prefix, count):
+    cache = FeatureCache(db_path=path)
+    for i in range(count):
+        cache.put_many({f'{prefix}-{i}': vector(i)})
+
+
+def test_feature_cache_disk_tier_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'features.db')
+    shared = FeatureCache(db_path=path)
+    threads = [threading.Thread(target=lambda t=t: [shared.put_many({f'thread{t}-{i}': vector(i)}) for i in range(50)])
+               for t in range(4)]
+    processes = [multiprocessing.get_context('spawn').Process(target=write_features, args=(path, f'process{p}', 50))
+                 for p in range(2)]
+    for worker in threads + processes:
+        worker.start()
+    for worker in threads + processes:
+        worker.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    keys = [f'{prefix}-{i}' for prefix in ['thread0', 'thread1', 'thread2', 'thread3', 'process0', 'process1']
+            for i in range(50)]
+    found, missing = FeatureCache(db_path=path).get_many(keys)
+    assert missing == []
+    assert np.array_equal(found['process1-49'], vector(49))
+    # Readers in one worker must not block writers in another
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+
+def test_recommendation_cache_versions_and_depth():
+    cache = RecommendationCache()
+    cache.put('u', 1, (1, None), ['t1', 't2', 't3'], depth=3)
+    assert cache.get('u', 1, (1, None), 3) == ['t1', 't2', 't3']
+    # A refitted profile, a rebuilt pool or a deeper page is a miss
+    assert cache.get('u', 2, (1, None), 3) is None
+    assert cache.get('u', 1, (2, None), 3) is None
+    assert cache.get('u', 1, (1, None), 4) is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 3}
+
+    # Fewer tracks than asked for: the whole pool was ranked, so any depth is served
+    cache.put('v', 1, (1, None), ['t1'], depth=10)
+    assert cache.get('v', 1, (1, None), 50) == ['t1']
+
+
+def test_recommendation_cache_ttl(clock):
+    cache = RecommendationCache(ttl=60)
+    cache.put('u', 1, 1, ['t'], depth=1)
+    clock.now += 59
+    assert cache.get('u', 1, 1, 1) == ['t']
+    clock.now += 2
+    assert cache.get('u', 1, 1, 1) is None
+    assert cache.users() == []
+
+
+def test_recommendation_cache_lru():
+    cache = RecommendationCache(max_size=2)
+    cache.put('a', 1, 1, ['t'], depth=1)
+    cache.put('b', 1, 1, ['t'], depth=1)
+    cache.get('a', 1, 1, 1)
+    cache.put('c', 1, 1, ['t'], depth=1)
+
+    assert cache.get('b', 1, 1, 1) is None
+    assert cache.users() == ['c', 'a']
+    assert cache.users(limit=1) == ['c']
+
+
+def test_recommendation_cache_disabled():
+    cache = RecommendationCache(ttl=0)
+    cache.put('u', 1, 1, ['t'], depth=1)
+    cache.put(None, 1, 1, ['t'], depth=1)
+    assert cache.stats()['size'] == 0
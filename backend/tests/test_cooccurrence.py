@@ -0,0 +1,88 @@
+import pytest
+
+from cooccurrence import CooccurrenceIndex, create_cooccurrence_index
+from tracks import Track
+
+
+def tracks(*ids):
+    return [Track(track_id, name=f'Track {track_id}') for track_id in ids]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = CooccurrenceIndex(str(tmp_path), min_listeners=2, update_interval=0, reload_interval=0)
+    yield index
+    index.stop()
+
+
+def apply_all(index):
+    while index.update():
+        pass
+
+
+def test_recommends_tracks_co_listened_by_similar_users(index):
+    index.record('alice', tracks('a', 'b'))
+    index.record('bob', tracks('a', 'b', 'c', 'd'))
+    index.record('carol', tracks('a', 'c', 'x'))
+    index.record('dave', tracks('x', 'y'))
+    apply_all(index)
+
+    ranked = [track_id for track_id, _ in index.similar('alice', 10)]
+    # c shares listeners with alice's tracks; d and y have a single listener; a and b are alice's own
+    assert ranked == ['c', 'x']
+    assert [track.id for track in index.recommend('alice', 1)] == ['c']
+    assert index.recommend('alice', 1)[0].name == 'Track c'
+    assert index.similar('unknown', 10) == []
+
+
+def test_nothing_is_visible_until_update(index):
+    index.record('alice', tracks('a', 'b'))
+    index.record('bob', tracks('a', 'c'))
+    index.record('carol', tracks('a', 'c'))
+    assert index.version == 0
+    assert index.similar('alice', 10) == []
+    assert index.stats()['pending'] == 3
+
+    assert index.update() == 3
+    assert index.version == 1
+    assert index.stats() == {"version": 1, "users": 3, "pending": 0, "tracks": 3, "pairs": 7}
+    assert index.update() == 0
+    assert index.version == 1
+
+
+def test_replacing_a_basket_subtracts_the_old_one(index):
+    index.record('alice', tracks('a'))
+    index.record('bob', tracks('a', 'b'))
+    index.record('carol', tracks('a', 'b'))
+    apply_all(index)
+    assert [track_id for track_id, _ in index.similar('alice', 10)] == ['b']
+
+    index.record('bob', tracks('a', 'c'))
+    index.record('carol', tracks('a', 'c'))
+    apply_all(index)
+    assert [track_id for track_id, _ in index.similar('alice', 10)] == ['c']
+    assert index.stats()['pairs'] == 4
+
+
+def test_merge_adds_to_the_basket_newest_first(tmp_path):
+    index = CooccurrenceIndex(str(tmp_path), max_basket=3, update_interval=0)
+    index.record('alice', tracks('a', 'b', 'c'))
+    index.record('alice', tracks('d'), merge=True)
+    index.record('bob', tracks('d', 'a'))
+    apply_all(index)
+    # c was the oldest play and fell out of alice's basket
+    assert index.stats()['tracks'] == 3
+
+
+def test_new_versions_are_seen_by_other_processes(tmp_path, index):
+    reader = CooccurrenceIndex(str(tmp_path), update_interval=0, reload_interval=0)
+    for user in ['alice', 'bob', 'carol']:
+        index.record(user, tracks('a', user))
+    apply_all(index)
+    assert reader.version == index.version == 1
+    assert reader.stats()['tracks'] == 4
+
+
+def test_disabled_without_a_path(monkeypatch):
+    monkeypatch.delenv('COOCCURRENCE_PATH', raising=False)
+    assert create_cooccurrence_index() is None
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+from forking import after_fork_in_child
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_no_op_without_fork(monkeypatch):
+    monkeypatch.delattr(os, 'register_at_fork')
+    after_fork_in_child(lambda: None)
+
+
+def test_app_imports_without_fork():
+    # Like Windows, where os.register_at_fork does not exist
+    code = (
+        "import os; del os.register_at_fork\n"
+        "import app\n"
+        "app.recommender.feature_cache, app.recommender.candidate_pool, app.get_job_queue(), app.get_profile_store()\n"
+    )
+    env = dict(os.environ, SPOTIFY_CLIENT_ID='test', SPOTIFY_CLIENT_SECRET='test', PROFILE_STORE='memory', JOB_QUEUE='memory')
+    for name in ['CATALOG_PATH', 'FEATURE_CACHE_PATH', 'COOCCURRENCE_PATH']:
+        env.pop(name, None)
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
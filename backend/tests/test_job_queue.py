@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from job_queue import JobQueue, MemoryJobStore, QueueFull, SQLiteJobStore, new_job
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteJobStore(str(tmp_path / 'jobs.db'))
+    return MemoryJobStore()
+
+
+def test_active_job_is_deduplicated_by_key(store):
+    first, created = store.create_unique(new_job('analysis', 'user-1', {"n": 1}), max_queued=10)
+    assert created
+    again, created = store.create_unique(new_job('analysis', 'user-1', {"n": 2}), max_queued=10)
+    assert not created
+    assert again['id'] == first['id']
+
+    other, created = store.create_unique(new_job('other', 'user-1', {}), max_queued=10)
+    assert created and other['id'] != first['id']
+
+    # A running job still deduplicates; a finished one does not
+    assert store.claim(stale_after=600)['id'] == first['id']
+    assert store.create_unique(new_job('analysis', 'user-1', {}), max_queued=10)[0]['id'] == first['id']
+    store.finish(first['id'], 'done', result={"ok": True})
+    assert store.create_unique(new_job('analysis', 'user-1', {}), max_queued=10)[1]
+    assert store.get(first['id'])['result'] == {"ok": True}
+    assert store.get(first['id'])['payload'] is None
+
+
+def test_queue_full_counts_queued_jobs_only(store):
+    store.create_unique(new_job('analysis', 'a', {}), max_queued=2)
+    store.create_unique(new_job('analysis', 'b', {}), max_queued=2)
+    with pytest.raises(QueueFull):
+        store.create_unique(new_job('analysis', 'c', {}), max_queued=2)
+    # A duplicate of an active job is answered even when the queue is full
+    assert not store.create_unique(new_job('analysis', 'a', {}), max_queued=2)[1]
+
+    store.claim(stale_after=600)
+    assert store.create_unique(new_job('analysis', 'c', {}), max_queued=2)[1]
+
+
+def test_claims_oldest_first(store):
+    jobs = []
+    for key in 'abc':
+        jobs.append(store.create_unique(new_job('analysis', key, {}), max_queued=10)[0])
+        time.sleep(0.001)
+    assert store.queued_before(jobs[2]) == 2
+    assert [store.claim(stale_after=600)['key'] for _ in jobs] == ['a', 'b', 'c']
+    assert store.claim(stale_after=600) is None
+
+
+def test_stale_running_jobs(store):
+    job, _ = store.create_unique(new_job('analysis', 'a', {}), max_queued=10)
+    store.claim(stale_after=600)
+    reclaimed = store.claim(stale_after=-1)
+    if isinstance(store, SQLiteJobStore):
+        # Another process may have died running it
+        assert reclaimed['id'] == job['id']
+    else:
+        # Only this process could be running it, so it never runs twice
+        assert reclaimed is None
+
+
+def test_job_queue_runs_jobs_once(tmp_path):
+    queue = JobQueue(SQLiteJobStore(str(tmp_path / 'jobs.db')), max_workers=2, poll_interval=0.05)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        started.set()
+        release.wait(5)
+        return {"value": payload['value'] * 2}
+
+    queue.register('double', handler)
+    try:
+        job, created = queue.submit('double', 'key', {"value": 21})
+        assert created
+        assert started.wait(5)
+        duplicate, created = queue.submit('double', 'key', {"value": 0})
+        assert not created and duplicate['id'] == job['id']
+        release.set()
+        for _ in range(100):
+            if queue.get(job['id'])['status'] == 'done':
+                break
+            time.sleep(0.05)
+        assert queue.get(job['id'])['result'] == {"value": 42}
+        assert calls == [{"value": 21}]
+    finally:
+        release.set()
+        queue.stop()
+
+
+def test_failed_and_unknown_jobs():
+    queue = JobQueue(MemoryJobStore(), max_workers=1, poll_interval=0.05)
+
+    def handler(payload):
+        raise RuntimeError("boom")
+
+    queue.register('fails', handler)
+    try:
+        failing, _ = queue.submit('fails', 'a', {})
+        unknown, _ = queue.submit('unknown', 'b', {})
+        for _ in range(100):
+            if all(queue.get(j['id'])['status'] == 'failed' for j in (failing, unknown)):
+                break
+            time.sleep(0.05)
+        assert queue.get(failing['id'])['error'] == 'boom'
+        assert queue.get(unknown['id'])['status'] == 'failed'
+    finally:
+        queue.stop()
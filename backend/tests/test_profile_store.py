@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+import pytest
+
+from profile_store import MemoryProfileStore, SQLiteProfileStore, decode_profile, encode_profile
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteProfileStore(str(tmp_path / 'profiles.db'))
+    return MemoryProfileStore()
+
+
+def test_profile_round_trips_through_encoding():
+    profile = {
+        'user_id': 'alice',
+        'fallback_mode': False,
+        'seed_tracks': ['a', 'b'],
+        'model': {'mean': np.arange(12, dtype=np.float64), 'components': np.eye(3), 'weight': np.float64(0.5)},
+        'centroid': np.array([1.5, -2.0])
+    }
+    decoded = decode_profile(encode_profile(profile))
+    assert decoded['user_id'] == 'alice' and decoded['seed_tracks'] == ['a', 'b']
+    assert np.array_equal(decoded['model']['mean'], profile['model']['mean'])
+    assert np.array_equal(decoded['model']['components'], np.eye(3))
+    assert np.array_equal(decoded['centroid'], profile['centroid'])
+    assert decoded['model']['weight'] == 0.5
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(ValueError):
+        decode_profile(b'{"user_id": "alice"}')
+
+
+def test_handle_is_stable_and_opaque(store):
+    handle = store.handle_for('alice')
+    assert store.handle_for('alice') == handle
+    assert 'alice' not in handle
+    assert store.handle_for('bob') != handle
+    assert store.resolve_handle(handle) == 'alice'
+
+
+def test_unknown_handle_resolves_to_nothing(store):
+    store.handle_for('alice')
+    assert store.resolve_handle('forged-handle') is None
+    assert store.resolve_handle('alice') is None
+
+
+def test_profiles_by_user(store):
+    store.set('alice', {'user_id': 'alice', 'centroid': np.ones(3)})
+    assert np.array_equal(store.get('alice')['centroid'], np.ones(3))
+    assert store.get('bob') is None
+    store.delete('alice')
+    assert store.get('alice') is None
+
+
+def test_sqlite_handles_persist_and_race_to_one(tmp_path):
+    path = str(tmp_path / 'profiles.db')
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(SQLiteProfileStore(path).handle_for('alice')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(handles)) == 1
+    assert SQLiteProfileStore(path).resolve_handle(handles[0]) == 'alice'
+
+
+def test_memory_handles_are_evicted_oldest_first():
+    store = MemoryProfileStore(max_size=2)
+    first = store.handle_for('alice')
+    store.handle_for('bob')
+    store.handle_for('carol')
+    assert store.resolve_handle(first) is None
+    # A returning user is issued a new handle
+    assert store.handle_for('alice') != first
@@ -0,0 +1,40 @@
+import pytest
+
+from fake_spotify import spotify_id
+
+
+@pytest.fixture
+def fake(fake_spotify):
+    return fake_spotify[1]
+
+
+def test_fallback_pages_come_from_one_spotify_call(app_module, fake):
+    recommender = app_module.recommender
+    sp = app_module.spotify_clients.client('fallback-pages')
+    profile = {'fallback_mode': True, 'seed_tracks': [spotify_id('seed-a')], 'updated_at': 1.0}
+    calls = fake.requests_by_path['/v1/recommendations']
+
+    def page(offset, limit):
+        return [track.id for track in recommender.get_recommendations(
+            sp, profile, profile['seed_tracks'], limit, offset, 'fallback-pages-user'
+        )]
+
+    first, second = page(0, 10), page(10, 10)
+    assert len(first) == len(second) == 10
+    assert not set(first) & set(second)
+    # Past the 100 tracks one call can return: the rest of the list, not a rejected request
+    assert len(page(90, 20)) == 10
+    assert page(0, 20) == first + second
+    assert fake.requests_by_path['/v1/recommendations'] == calls + 1
+
+
+def test_other_seeds_are_fetched_again(app_module, fake):
+    recommender = app_module.recommender
+    sp = app_module.spotify_clients.client('fallback-seeds')
+    profile = {'fallback_mode': True, 'updated_at': 1.0}
+    calls = fake.requests_by_path['/v1/recommendations']
+
+    a = recommender.get_recommendations(sp, profile, [spotify_id('seed-a')], 5, 0, 'fallback-seeds-user')
+    b = recommender.get_recommendations(sp, profile, [spotify_id('seed-b')], 5, 0, 'fallback-seeds-user')
+    assert [t.id for t in a] != [t.id for t in b]
+    assert fake.requests_by_path['/v1/recommendations'] == calls + 2
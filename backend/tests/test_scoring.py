@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_cache import FEATURE_COLUMNS
+from scoring import ScoringEngine, mmr_rerank, top_k_rows
+from user_model import fit_user_model
+
+
+def unit(rows):
+    rows = np.asarray(rows, dtype=np.float64)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_mmr_without_diversity_is_relevance_order():
+    relevance = [0.2, 0.9, 0.5, 0.7]
+    assert mmr_rerank(relevance, None, 4, diversity=0) == [1, 3, 2, 0]
+    assert mmr_rerank(relevance, None, 2, diversity=0) == [1, 3]
+
+
+def test_mmr_demotes_near_duplicates():
+    relevance = [1.0, 0.99, 0.8]
+    vectors = unit([[1, 0], [1, 0.01], [0, 1]])
+    assert mmr_rerank(relevance, vectors, 3, diversity=0)[:2] == [0, 1]
+    assert mmr_rerank(relevance, vectors, 3, diversity=0.5) == [0, 2, 1]
+
+
+def test_mmr_group_cap():
+    relevance = [0.9, 0.8, 0.7, 0.6, 0.5]
+    groups = ['a', 'a', 'a', 'b', 'c']
+    assert mmr_rerank(relevance, None, 4, diversity=0, groups=groups, group_cap=2) == [0, 1, 3, 4]
+    # Once only capped groups remain, the best of them fill the ranking
+    assert mmr_rerank(relevance, None, 5, diversity=0, groups=groups, group_cap=1) == [0, 3, 4, 1, 2]
+
+
+def test_mmr_edge_cases():
+    assert mmr_rerank([], np.empty((0, 2)), 5) == []
+    assert sorted(mmr_rerank([0.1, 0.2], unit([[1, 0], [0, 1]]), 10)) == [0, 1]
+
+
+def test_top_k_rows_orders_best_first():
+    scores = np.array([[0.1, 0.5, 0.3, 0.9], [0.4, 0.2, 0.8, 0.0]])
+    indices, top = top_k_rows(scores, 2)
+    assert indices.tolist() == [[3, 1], [2, 0]]
+    assert np.allclose(top, [[0.9, 0.5], [0.8, 0.4]])
+    assert top_k_rows(scores, 10)[0].tolist() == [[3, 1, 2, 0], [2, 0, 1, 3]]
+    assert top_k_rows(scores, 0)[0].shape == (2, 0)
+
+
+@pytest.fixture
+def profiles():
+    rng = np.random.default_rng(0)
+    profiles = []
+    for i in range(7):
+        history = pd.DataFrame(rng.random((30, len(FEATURE_COLUMNS))), columns=FEATURE_COLUMNS)
+        model, pca_profile, _ = fit_user_model(history)
+        # Some profiles away from the origin of their PCA space, to exercise cosine scoring
+        if i % 2:
+            pca_profile = pca_profile + rng.normal(size=pca_profile.shape)
+        profiles.append({'model': model, 'pca_profile': pca_profile})
+    return profiles
+
+
+def test_memory_sized_batches_match_one_batch(profiles):
+    matrix = np.random.default_rng(1).random((3000, len(FEATURE_COLUMNS)))
+    whole = ScoringEngine(matrix, FEATURE_COLUMNS, max_batch_bytes=1 << 40)
+    batched = ScoringEngine(matrix, FEATURE_COLUMNS, max_batch_bytes=1 << 20)
+    assert batched.batch_size < len(profiles) <= whole.batch_size
+
+    assert np.allclose(batched.similarities(profiles), whole.similarities(profiles))
+    indices, scores = batched.top_k(profiles, 25)
+    expected_indices, expected_scores = top_k_rows(whole.similarities(profiles), 25)
+    assert indices.tolist() == expected_indices.tolist()
+    assert np.allclose(scores, expected_scores)
+
+    empty_indices, empty_scores = batched.top_k([], 25)
+    assert empty_indices.shape == empty_scores.shape == (0, 25)
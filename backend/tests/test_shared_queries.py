@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import shared_queries
+from shared_queries import SharedQueryCache
+
+
+class Upstream:
+    """Counts calls and holds each one until released, so callers pile up behind it"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, query, limit=10):
+        with self._lock:
+            self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError('upstream failed')
+        return [f'{query}-{i}' for i in range(limit)]
+
+
+def call_concurrently(cache, fn, count, *args):
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        futures = [pool.submit(cache.call, fn, *args) for _ in range(count)]
+        fn.started.wait(5)
+        # Let the followers reach the in-flight call before the leader finishes
+        while cache.stats()['coalesced'] < count - 1:
+            time.sleep(0.01)
+        fn.release.set()
+        return futures
+
+
+def test_concurrent_identical_calls_go_upstream_once():
+    cache = SharedQueryCache(ttl=60)
+    upstream = Upstream()
+    futures = call_concurrently(cache, upstream, 8, 'pop', 5)
+
+    results = [future.result() for future in futures]
+    assert upstream.calls == 1
+    assert all(result == ['pop-0', 'pop-1', 'pop-2', 'pop-3', 'pop-4'] for result in results)
+    assert cache.stats() == {"size": 1, "hits": 0, "misses": 1, "coalesced": 7}
+
+    assert cache.call(upstream, 'pop', 5) is results[0]
+    assert upstream.calls == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    cache = SharedQueryCache(ttl=60)
+    upstream = Upstream(fail=True)
+    futures = call_concurrently(cache, upstream, 4, 'rock')
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result()
+    assert upstream.calls == 1
+    assert cache.stats()['size'] == 0
+
+    upstream.fail = False
+    assert cache.call(upstream, 'rock', 2) == ['rock-0', 'rock-1']
+    assert upstream.calls == 2
+
+
+def test_different_arguments_are_separate_queries():
+    cache = SharedQueryCache(ttl=60)
+    upstream = Upstream()
+    upstream.release.set()
+    cache.call(upstream, 'pop', 5)
+    cache.call(upstream, 'pop', 10)
+    cache.call(upstream, 'pop', limit=5)
+    assert upstream.calls == 3
+
+
+def test_results_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(shared_queries.time, 'monotonic', lambda: now[0])
+    cache = SharedQueryCache(ttl=60, max_size=1)
+    upstream = Upstream()
+    upstream.release.set()
+
+    cache.call(upstream, 'pop')
+    now[0] += 59
+    cache.call(upstream, 'pop')
+    assert upstream.calls == 1
+    now[0] += 2
+    cache.call(upstream, 'pop')
+    assert upstream.calls == 2
+
+    cache.call(upstream, 'jazz')
+    cache.call(upstream, 'pop')
+    assert upstream.calls == 4
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from spotify_client import SpotifyClientManager
+
+
+class FakeOAuth:
+    """Counts refreshes; each one waits for `release` and returns a new token valid for an hour"""
+
+    def __init__(self, fail=False):
+        self.refreshes = 0
+        self.fail = fail
+        self.release = threading.Event()
+        self.done = threading.Event()
+
+    def refresh_access_token(self, refresh_token):
+        self.refreshes += 1
+        try:
+            self.release.wait(5)
+            if self.fail:
+                raise RuntimeError('accounts service unavailable')
+            return {'access_token': f'new-{self.refreshes}', 'refresh_token': refresh_token,
+                    'expires_at': int(time.time()) + 3600}
+        finally:
+            self.done.set()
+
+
+def token(access_token, expires_in):
+    return {'access_token': access_token, 'refresh_token': 'refresh', 'expires_at': int(time.time()) + expires_in}
+
+
+@pytest.fixture
+def oauth():
+    return FakeOAuth()
+
+
+@pytest.fixture
+def manager(oauth):
+    return SpotifyClientManager(oauth, session=None, refresh_margin=300)
+
+
+def test_token_near_expiry_is_refreshed_in_the_background(oauth, manager):
+    old = token('old', 120)
+    # The request carries on with the still-valid token while the refresh runs
+    assert manager.current_token(old) is old
+    assert manager.current_token(old) is old
+    oauth.release.set()
+    assert oauth.done.wait(5)
+
+    deadline = time.time() + 5
+    while manager.current_token(old) is old and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.current_token(old)['access_token'] == 'new-1'
+    # Only one refresh for the token, however many requests saw it
+    assert oauth.refreshes == 1
+
+
+def test_fresh_token_is_left_alone(oauth, manager):
+    fresh = token('fresh', 3600)
+    assert manager.current_token(fresh) is fresh
+    assert oauth.refreshes == 0
+
+
+def test_expired_token_is_refreshed_inline(oauth, manager):
+    oauth.release.set()
+    sp, token_info = manager.client_for(token('expired', 10))
+    assert token_info['access_token'] == 'new-1'
+    assert sp._auth == 'new-1'
+
+
+def test_failed_background_refresh_is_retried(manager):
+    oauth = manager.oauth = FakeOAuth(fail=True)
+    old = token('old', 120)
+    oauth.release.set()
+    manager.current_token(old)
+    assert oauth.done.wait(5)
+
+    deadline = time.time() + 5
+    while oauth.refreshes < 2 and time.time() < deadline:
+        manager.current_token(old)
+        time.sleep(0.01)
+    assert oauth.refreshes >= 2
+    assert manager.current_token(old) is old
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from candidate_pool import fetch_candidate_tracks
+from fake_spotify import spotify_id
+
+
+@pytest.fixture
+def fake(fake_spotify):
+    return fake_spotify[1]
+
+
+@pytest.fixture
+def sp(app_module):
+    return app_module.spotify_clients.client('rate-limited-user')
+
+
+def test_search_retries_after_429(app_module, fake, sp):
+    fake.rate_limit('/v1/search', count=2, retry_after=0)
+    tracks = app_module.recommender.search_tracks(sp, 'rate limited search', 5)
+    assert len(tracks) == 5
+
+
+def test_candidate_pool_retries_after_429(fake, sp):
+    fake.rate_limit('/v1/search', count=1, retry_after=0)
+    tracks = fetch_candidate_tracks(sp, genres=['pop'])
+    assert len(tracks) == 50
+
+
+def test_spotify_recommendations_retry_after_429(app_module, fake, sp):
+    fake.rate_limit('/v1/recommendations', count=1, retry_after=0)
+    tracks = app_module.recommender.get_spotify_recommendations(sp, ['seed'], 10)
+    # From the seed-track call itself, not the genre-seed fallback
+    assert [track.id for track in tracks] == [spotify_id(f'rec-seed-{i}') for i in range(10)]
+
+
+def test_current_user_retries_after_429(app_module, fake):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['token_info'] = {'access_token': 'profile-user'}
+    fake.rate_limit('/v1/me', count=1, retry_after=0)
+    response = client.get('/api/user-profile')
+    assert response.status_code == 200
+    assert response.get_json()['id'] == 'profile-user'
+
+
+def test_long_retry_after_fails_fast(app_module, fake):
+    # Neither the HTTP adapter nor call_with_retry sleeps past SPOTIFY_FETCH_MAX_WAIT
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['token_info'] = {'access_token': 'profile-user'}
+    fake.rate_limit('/v1/me', count=1, retry_after=3600)
+    started = time.monotonic()
+    response = client.get('/api/user-profile')
+    assert response.status_code != 200
+    assert time.monotonic() - started < 5
+    fake.rate_limit('/v1/me', count=0)
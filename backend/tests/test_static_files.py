@@ -0,0 +1,82 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+import static_files
+from static_files import StaticFiles, compress
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / 'index.html').write_text('<html>' + 'x' * 4000 + '</html>')
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'main.a0e1cadd.js').write_text('console.log(1);' * 200)
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG' * 100)
+    compress(str(tmp_path))
+    (tmp_path / 'index.html.br').write_bytes(b'brotli-bytes')
+
+    files = StaticFiles(str(tmp_path))
+    app = Flask(__name__)
+
+    @app.route('/<path:path>')
+    def serve(path):
+        return files.response(path) or ('', 404)
+
+    return app.test_client()
+
+
+def test_compress_writes_gzip_variants_of_text_files(tmp_path):
+    (tmp_path / 'big.js').write_text('a' * 5000)
+    (tmp_path / 'small.js').write_text('a')
+    (tmp_path / 'image.png').write_bytes(b'\0' * 5000)
+    assert compress(str(tmp_path)) == (2 if static_files.brotli else 1)
+    assert gzip.decompress((tmp_path / 'big.js.gz').read_bytes()) == b'a' * 5000
+    assert not (tmp_path / 'small.js.gz').exists()
+    assert not (tmp_path / 'image.png.gz').exists()
+
+
+def test_variants_are_not_indexed_as_files(site):
+    assert site.get('/index.html.gz').status_code == 404
+    assert site.get('/missing.js').status_code == 404
+
+
+def test_best_accepted_encoding_is_served(site):
+    response = site.get('/index.html', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.data == b'brotli-bytes'
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+    response = site.get('/index.html', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).startswith(b'<html>')
+
+    response = site.get('/index.html', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data.startswith(b'<html>')
+
+
+def test_each_encoding_has_its_own_etag(site):
+    etags = {site.get('/index.html', headers={'Accept-Encoding': encoding}).headers['ETag']
+             for encoding in ['br', 'gzip', 'identity']}
+    assert len(etags) == 3
+
+
+def test_matching_if_none_match_gets_304(site):
+    first = site.get('/index.html', headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+
+    again = site.get('/index.html', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+
+    # The gzip ETag must not validate the uncompressed representation
+    other = site.get('/index.html', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+    assert other.status_code == 200
+
+
+def test_cache_control_by_fingerprint(site):
+    assert site.get('/js/main.a0e1cadd.js').headers['Cache-Control'] == static_files.IMMUTABLE
+    assert site.get('/index.html').headers['Cache-Control'] == static_files.REVALIDATE
+    assert 'Vary' not in site.get('/logo.png').headers
@@ -0,0 +1,107 @@
+import multiprocessing
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import track_catalog
+from track_catalog import TrackCatalog, append_tracks, catalog_lock, compact
+
+COLUMNS = ['a', 'b', 'c']
+
+
+def track_rows(prefix, count, offset=0.0):
+    track_ids = [f'{prefix}{i:05d}' for i in range(count)]
+    matrix = np.arange(count * len(COLUMNS), dtype=np.float32).reshape(count, len(COLUMNS)) + offset
+    records = [{"id": track_id, "name": track_id, "artist": prefix} for track_id in track_ids]
+    return track_ids, matrix, records
+
+
+def rows_by_id(catalog):
+    matrix = catalog.matrix()
+    return {catalog.track_id(row): matrix[row].tolist() for row in range(len(catalog))}
+
+
+def test_append_skips_known_and_duplicate_tracks(tmp_path):
+    track_ids, matrix, records = track_rows('t', 10)
+    assert append_tracks(str(tmp_path), track_ids, matrix, records, COLUMNS) == 10
+    assert append_tracks(str(tmp_path), track_ids[:5] + ['new'] * 2, matrix[:7], records[:7], COLUMNS) == 1
+
+    catalog = TrackCatalog(str(tmp_path))
+    assert len(catalog) == 11
+    assert len(catalog.segments) == 2
+    assert catalog.record(catalog.find('t00003'))['name'] == 't00003'
+    assert catalog.find('missing') is None
+
+
+def test_append_rejects_other_columns(tmp_path):
+    append_tracks(str(tmp_path), *track_rows('t', 2), COLUMNS)
+    with pytest.raises(ValueError):
+        append_tracks(str(tmp_path), *track_rows('u', 2), ['x', 'y', 'z'])
+
+
+def test_multi_segment_matrix_matches_rows(tmp_path):
+    for prefix in 'abc':
+        append_tracks(str(tmp_path), *track_rows(prefix, 4, offset=ord(prefix)), COLUMNS)
+    catalog = TrackCatalog(str(tmp_path))
+    rows = rows_by_id(catalog)
+    assert rows['b00001'] == [ord('b') + 3.0, ord('b') + 4.0, ord('b') + 5.0]
+    # Written once per version and shared, not rebuilt per call
+    assert isinstance(catalog.matrix(), np.memmap)
+
+
+def test_compact_keeps_every_track(tmp_path):
+    for prefix in 'abcd':
+        append_tracks(str(tmp_path), *track_rows(prefix, 5), COLUMNS)
+    before = rows_by_id(TrackCatalog(str(tmp_path)))
+
+    assert compact(str(tmp_path)) == 20
+    catalog = TrackCatalog(str(tmp_path))
+    assert len(catalog.segments) == 1
+    assert rows_by_id(catalog) == before
+    assert catalog.record(catalog.find('c00002'))['artist'] == 'c'
+
+
+def test_append_compacts_past_max_segments(tmp_path):
+    for i in range(4):
+        append_tracks(str(tmp_path), *track_rows(f's{i}-', 3), COLUMNS, max_segments=3)
+    catalog = TrackCatalog(str(tmp_path))
+    assert len(catalog.segments) == 1
+    assert len(catalog) == 12
+
+
+def append_worker(directory, prefix):
+    for batch in range(5):
+        track_ids, matrix, records = track_rows(f'{prefix}-{batch}-', 20)
+        append_tracks(directory, track_ids, matrix, records, COLUMNS, max_segments=4)
+
+
+def test_concurrent_appends_and_compactions_lose_nothing(tmp_path):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=append_worker, args=(str(tmp_path), f'w{i}')) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    catalog = TrackCatalog(str(tmp_path))
+    assert len(catalog) == 4 * 5 * 20
+    assert len(catalog.segments) <= 4
+    expected = {f'w{w}-{b}-{i:05d}' for w in range(4) for b in range(5) for i in range(20)}
+    assert set(rows_by_id(catalog)) == expected
+
+
+def test_lock_falls_back_to_msvcrt(tmp_path, monkeypatch):
+    # Windows has no fcntl; msvcrt.locking locks a byte range instead
+    calls = []
+    msvcrt = types.SimpleNamespace(LK_LOCK=1, LK_UNLCK=0, locking=lambda fd, mode, size: calls.append((mode, size)))
+    monkeypatch.setattr(track_catalog, 'fcntl', None)
+    monkeypatch.setitem(sys.modules, 'msvcrt', msvcrt)
+
+    with catalog_lock(str(tmp_path)):
+        assert calls == [(1, 1)]
+    assert calls == [(1, 1), (0, 1)]
+    append_tracks(str(tmp_path), *track_rows('t', 3), COLUMNS)
+    assert len(TrackCatalog(str(tmp_path))) == 3
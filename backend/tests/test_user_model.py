@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from user_model import affine_projection, feature_stats, fit_model_from_stats, project, update_stats
+
+sklearn_decomposition = pytest.importorskip('sklearn.decomposition')
+sklearn_preprocessing = pytest.importorskip('sklearn.preprocessing')
+
+COLUMNS = [f'f{i}' for i in range(6)]
+
+
+def listening_history(seed, rows=200):
+    rng = np.random.default_rng(seed)
+    # Correlated features on different scales, like audio features
+    mixing = rng.normal(size=(len(COLUMNS), len(COLUMNS)))
+    return rng.normal(size=(rows, len(COLUMNS))) @ mixing * np.arange(1, len(COLUMNS) + 1) + 5
+
+
+def fit_sklearn(values, n_components):
+    scaler = sklearn_preprocessing.StandardScaler().fit(values)
+    pca = sklearn_decomposition.PCA(n_components=n_components).fit(scaler.transform(values))
+    return scaler, pca
+
+
+def aligned(components, reference):
+    """`components` with each row's sign flipped to match `reference`"""
+    signs = np.sign(np.sum(components * reference, axis=1))
+    return components * signs[:, None]
+
+
+@pytest.mark.parametrize('n_components', [2, 6])
+def test_matches_standard_scaler_and_pca(n_components):
+    values = listening_history(0)
+    model, mean = fit_model_from_stats(feature_stats(values), COLUMNS, n_components)
+    scaler, pca = fit_sklearn(values, n_components)
+
+    assert np.allclose(mean, values.mean(axis=0))
+    assert np.allclose(model['scaler_mean'], scaler.mean_)
+    assert np.allclose(model['scaler_scale'], scaler.scale_)
+    assert np.allclose(aligned(model['pca_components'], pca.components_), pca.components_, atol=1e-8)
+
+    # Scores agree once each component's sign is matched
+    signs = np.sign(np.sum(model['pca_components'] * pca.components_, axis=1))
+    expected = pca.transform(scaler.transform(values))
+    assert np.allclose(project(model, values, COLUMNS) * signs, expected, atol=1e-8)
+
+
+def test_incremental_stats_match_full_history():
+    values = listening_history(1)
+    stats = update_stats(feature_stats(values[:150]), values[150:])
+    incremental, _ = fit_model_from_stats(stats, COLUMNS, 3)
+    full, _ = fit_model_from_stats(feature_stats(values), COLUMNS, 3)
+    for key in ('scaler_mean', 'scaler_scale', 'pca_components'):
+        assert np.allclose(incremental[key], full[key])
+
+
+def test_decay_weights_recent_listening():
+    old, new = np.zeros((10, len(COLUMNS))), np.ones((10, len(COLUMNS)))
+    stats = update_stats(feature_stats(old), new, decay=0.5)
+    assert stats['count'] == 15
+    assert np.allclose(np.asarray(stats['sum']) / stats['count'], 10 / 15)
+
+
+def test_constant_features_do_not_divide_by_zero():
+    values = listening_history(2)
+    values[:, 0] = 3.0
+    model, _ = fit_model_from_stats(feature_stats(values), COLUMNS, 3)
+    assert model['scaler_scale'][0] == 1.0
+    assert np.isfinite(project(model, values, COLUMNS)).all()
+
+
+def test_projection_over_other_candidate_columns():
+    values = listening_history(3)
+    model, _ = fit_model_from_stats(feature_stats(values), COLUMNS, 3)
+    # Candidates with reordered columns, one extra and one missing
+    candidate_columns = ['extra'] + COLUMNS[:0:-1]
+    candidates = pd.DataFrame(values, columns=COLUMNS).assign(extra=7.0)[candidate_columns].to_numpy()
+
+    expected = project(model, np.column_stack([np.full(len(values), model['scaler_mean'][0]), values[:, 1:]]), COLUMNS)
+    assert np.allclose(project(model, candidates, candidate_columns), expected)
+    assert affine_projection(model, candidate_columns).shape == (len(candidate_columns) + 1, 3)
@@ -0,0 +1,353 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from tracks import Track
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: lock files with msvcrt instead
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'catalog.json'
+LOCK_FILE = 'catalog.lock'
+TRACK_ID_DTYPE = 'S32'
+
+# Appends past this many segments compact the catalog back into one
+MAX_SEGMENTS = 8
+
+
+@contextmanager
+def catalog_lock(directory, name=LOCK_FILE):
+    """Exclusive lock on a catalog across threads and processes, held while its files are rewritten"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            return
+
+        import msvcrt
+        # msvcrt locks a byte range from the current position, and LK_LOCK gives up after about 10s
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CatalogSegment:
+    """One immutable, ID-sorted slice of the catalog, opened with np.memmap.
+
+    Files: features.npy (float32 rows), track_ids.npy (fixed-width bytes,
+    sorted), meta_offsets.npy (int64, rows + 1) and metadata.bin (UTF-8 JSON
+    records back to back).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+        self.track_ids = np.load(os.path.join(path, 'track_ids.npy'), mmap_mode='r')
+        self.meta_offsets = np.load(os.path.join(path, 'meta_offsets.npy'), mmap_mode='r')
+        metadata_path = os.path.join(path, 'metadata.bin')
+        if os.path.getsize(metadata_path):
+            self.metadata = np.memmap(metadata_path, dtype=np.uint8, mode='r')
+        else:
+            self.metadata = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.track_ids.shape[0]
+
+    def find(self, track_id):
+        key = track_id.encode('ascii') if isinstance(track_id, str) else track_id
+        position = int(np.searchsorted(self.track_ids, key))
+        if position < len(self) and self.track_ids[position] == key:
+            return position
+        return None
+
+    def record(self, row):
+        start, end = int(self.meta_offsets[row]), int(self.meta_offsets[row + 1])
+        return json.loads(self.metadata[start:end].tobytes().decode('utf-8'))
+
+
+def write_segment(path, track_ids, matrix, records):
+    """Write rows (sorted by track ID) as a new segment directory"""
+    # Left over from an interrupted write; not in the manifest, so nothing reads it
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    keys = np.array([track_id.encode('ascii') for track_id in track_ids], dtype=TRACK_ID_DTYPE)
+    order = np.argsort(keys, kind='stable')
+
+    blobs = [json.dumps(records[i], separators=(',', ':')).encode('utf-8') for i in order]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+
+    np.save(os.path.join(path, 'features.npy'), np.ascontiguousarray(np.asarray(matrix, dtype=np.float32)[order]))
+    np.save(os.path.join(path, 'track_ids.npy'), keys[order])
+    np.save(os.path.join(path, 'meta_offsets.npy'), offsets)
+    with open(os.path.join(path, 'metadata.bin'), 'wb') as f:
+        for blob in blobs:
+            f.write(blob)
+
+
+class TrackCatalog:
+    """Read-only view over a catalog directory of memory-mapped segments.
+
+    Rows are addressed globally (segment order, then row within the segment).
+    Pages are shared between every process that opens the same catalog.
+    Writers (append_tracks, compact) hold catalog_lock.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.columns = manifest['columns']
+        self.version = manifest.get('version', 0)
+        self.segments = [CatalogSegment(os.path.join(directory, name)) for name in manifest['segments']]
+        self._starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def _locate(self, row):
+        segment = int(np.searchsorted(self._starts, row, side='right')) - 1
+        return self.segments[segment], row - int(self._starts[segment])
+
+    def matrix(self):
+        """Memory-mapped feature matrix for every row.
+
+        A single segment's features are mapped directly. For several, the
+        concatenation is written once per catalog version and mapped by every
+        process, rather than each holding a private copy.
+        """
+        if len(self.segments) == 1:
+            return self.segments[0].features
+        if not self.segments:
+            return np.empty((0, len(self.columns)), dtype=np.float32)
+        path = os.path.join(self.directory, f'features-{self.version:06d}.npy')
+        if not os.path.exists(path):
+            with catalog_lock(self.directory):
+                if not os.path.exists(path):
+                    with open(path + '.tmp', 'wb') as f:
+                        np.save(f, np.concatenate([segment.features for segment in self.segments]))
+                    os.replace(path + '.tmp', path)
+        return np.load(path, mmap_mode='r')
+
+    def record(self, row):
+        segment, local_row = self._locate(row)
+        return segment.record(local_row)
+
+    def track_id(self, row):
+        segment, local_row = self._locate(row)
+        return segment.track_ids[local_row].decode('ascii')
+
+    def find(self, track_id):
+        """Global row of a track ID, or None"""
+        for start, segment in zip(self._starts, self.segments):
+            row = segment.find(track_id)
+            if row is not None:
+                return int(start) + row
+        return None
+
+    def records(self):
+        return CatalogRecords(self)
+
+
+class CatalogRecords:
+    """Lazy sequence of Track records, so candidate pools never materialise the whole catalog"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, row):
+        return Track.from_dict(self.catalog.record(int(row)))
+
+
+def _write_manifest(directory, manifest):
+    temporary = os.path.join(directory, MANIFEST + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+
+def _read_manifest(directory, columns):
+    path = os.path.join(directory, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    return {"columns": list(columns), "segments": [], "next_segment": 0, "version": 0}
+
+
+def _remove_stale_matrices(directory, version):
+    # Processes that still have an old matrix mapped keep reading it until they reopen
+    for path in glob.glob(os.path.join(directory, 'features-*.npy')):
+        if path != os.path.join(directory, f'features-{version:06d}.npy'):
+            os.remove(path)
+
+
+def append_tracks(directory, track_ids, matrix, records, columns, max_segments=MAX_SEGMENTS):
+    """Append tracks not already in the catalog as a new segment; returns the number added.
+
+    Safe to call from several processes at once. Once there are more than
+    `max_segments` segments the catalog is compacted.
+    """
+    with catalog_lock(directory):
+        added = _append_tracks(directory, track_ids, matrix, records, columns)
+        if added:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+            if len(manifest['segments']) > max_segments:
+                _compact(directory)
+            else:
+                _remove_stale_matrices(directory, manifest['version'])
+    return added
+
+
+def _append_tracks(directory, track_ids, matrix, records, columns):
+    manifest = _read_manifest(directory, columns)
+    if list(manifest['columns']) != list(columns):
+        raise ValueError(f"Catalog columns {manifest['columns']} do not match {list(columns)}")
+
+    existing = TrackCatalog(directory) if manifest['segments'] else None
+    keep = []
+    seen = set()
+    for i, track_id in enumerate(track_ids):
+        if track_id in seen or (existing is not None and existing.find(track_id) is not None):
+            continue
+        seen.add(track_id)
+        keep.append(i)
+    if not keep:
+        return 0
+
+    name = f"segment-{manifest['next_segment']:06d}"
+    write_segment(
+        os.path.join(directory, name),
+        [track_ids[i] for i in keep],
+        np.asarray(matrix)[keep],
+        [records[i] for i in keep]
+    )
+    manifest['segments'].append(name)
+    manifest['next_segment'] += 1
+    manifest['version'] = manifest.get('version', 0) + 1
+    _write_manifest(directory, manifest)
+    logger.info(f"Appended {len(keep)} tracks to catalog {directory} as {name}")
+    return len(keep)
+
+
+def compact(directory):
+    """Merge all segments into one (deduplicated by track ID, later segments win)"""
+    with catalog_lock(directory):
+        return _compact(directory)
+
+
+def _compact(directory):
+    catalog = TrackCatalog(directory)
+    if len(catalog.segments) <= 1:
+        return len(catalog)
+
+    rows = {}
+    for start, segment in zip(catalog._starts, catalog.segments):
+        for local_row in range(len(segment)):
+            rows[segment.track_ids[local_row].decode('ascii')] = int(start) + local_row
+
+    track_ids = list(rows)
+    global_rows = np.fromiter(rows.values(), dtype=np.int64, count=len(rows))
+    # Not catalog.matrix(): that may take the lock this caller already holds
+    matrix = np.concatenate([segment.features for segment in catalog.segments])[global_rows]
+    records = [catalog.record(int(row)) for row in global_rows]
+
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    name = f"segment-{manifest['next_segment']:06d}"
+    write_segment(os.path.join(directory, name), track_ids, matrix, records)
+
+    old_segments = manifest['segments']
+    manifest['segments'] = [name]
+    manifest['next_segment'] += 1
+    manifest['version'] = manifest.get('version', 0) + 1
+    _write_manifest(directory, manifest)
+
+    # Readers that still have old segments mapped keep working until they reopen
+    for old in old_segments:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    _remove_stale_matrices(directory, manifest['version'])
+    logger.info(f"Compacted {len(old_segments)} segments into {name} ({len(track_ids)} tracks)")
+    return len(track_ids)
+
+
+def main():
+    from feature_cache import FEATURE_COLUMNS, features_to_vector
+
+    parser = argparse.ArgumentParser(description="Manage the memory-mapped track feature catalog")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help="append tracks from a JSON-lines file")
+    ingest.add_argument('catalog')
+    ingest.add_argument('tracks', help="one Spotify track object per line, with its audio features under 'audio_features'")
+
+    compact_parser = subparsers.add_parser('compact', help="merge all segments into one")
+    compact_parser.add_argument('catalog')
+
+    info = subparsers.add_parser('info', help="print catalog size and segments")
+    info.add_argument('catalog')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'ingest':
+        track_ids, vectors, records = [], [], []
+        with open(args.tracks) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                track = json.loads(line)
+                if not track.get('id') or not track.get('audio_features'):
+                    continue
+                track_ids.append(track['id'])
+                vectors.append(np.nan_to_num(features_to_vector(track['audio_features'])))
+                records.append(Track.from_spotify(track).to_dict())
+        if not track_ids:
+            print("No tracks with audio features found")
+            return
+        added = append_tracks(args.catalog, track_ids, np.vstack(vectors), records, FEATURE_COLUMNS)
+        print(f"Added {added} of {len(track_ids)} tracks")
+    elif args.command == 'compact':
+        start = time.perf_counter()
+        print(f"Catalog now holds {compact(args.catalog)} tracks ({time.perf_counter() - start:.1f}s)")
+    elif args.command == 'info':
+        catalog = TrackCatalog(args.catalog)
+        print(json.dumps({
+            "tracks": len(catalog),
+            "columns": catalog.columns,
+            "version": catalog.version,
+            "segments": [{"name": os.path.basename(s.path), "tracks": len(s)} for s in catalog.segments]
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# The only track fields the app uses; also the metadata stored per catalog track
+RECORD_FIELDS = ('id', 'name', 'artist', 'album', 'image', 'preview_url', 'external_url', 'popularity')
+
+
+class Track:
+    """Slim track record, built once from Spotify's track JSON.
+
+    Raw track objects carry every album image, all artists and the full
+    market list (kilobytes each); pipelines, caches and the candidate pool
+    hold these instead. Records are shared between requests, so treat them
+    as read-only.
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, id, name=None, artist='Unknown', album=None, image=None, preview_url=None,
+                 external_url=None, popularity=0):
+        self.id = id
+        self.name = name
+        self.artist = artist
+        self.album = album
+        self.image = image
+        self.preview_url = preview_url
+        self.external_url = external_url
+        self.popularity = popularity
+
+    @classmethod
+    def from_spotify(cls, track):
+        """Record for a raw Spotify track object"""
+        album = track.get('album') or {}
+        images = album.get('images') or []
+        artists = track.get('artists') or []
+        return cls(
+            track['id'],
+            track.get('name'),
+            artists[0]['name'] if artists else 'Unknown',
+            album.get('name'),
+            images[0]['url'] if images else None,
+            track.get('preview_url'),
+            (track.get('external_urls') or {}).get('spotify'),
+            track.get('popularity', 0)
+        )
+
+    @classmethod
+    def from_dict(cls, record):
+        """Inverse of to_dict"""
+        return cls(**{field: record[field] for field in RECORD_FIELDS if field in record})
+
+    def to_dict(self):
+        """The track as returned by the API and stored in the catalog"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "artist": self.artist,
+            "album": self.album,
+            "image": self.image,
+            "preview_url": self.preview_url,
+            "external_url": self.external_url,
+            "popularity": self.popularity
+        }
+
+    def __repr__(self):
+        return f"Track({self.id!r}, {self.name!r}, {self.artist!r})"
+
+
+def slim_tracks(raw_tracks):
+    """Track records for raw Spotify track objects, skipping empty entries and tracks without an ID (e.g. local files)"""
+    return [Track.from_spotify(track) for track in raw_tracks if track and track.get('id')]
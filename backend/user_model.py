@@ -0,0 +1,110 @@
+import numpy as np
+
+PCA_COMPONENTS = 10
+
+
+def feature_stats(values):
+    """Sufficient statistics (count, sum, sum of outer products) of feature rows"""
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'count': float(values.shape[0]),
+        'sum': values.sum(axis=0),
+        'sum_outer': values.T @ values
+    }
+
+
+def update_stats(stats, values, decay=1.0):
+    """Fold new feature rows into running statistics in O(new rows).
+
+    With decay < 1 the existing statistics are down-weighted first, so recent
+    listening counts for more than older history.
+    """
+    new = feature_stats(values)
+    return {
+        'count': stats['count'] * decay + new['count'],
+        'sum': np.asarray(stats['sum']) * decay + new['sum'],
+        'sum_outer': np.asarray(stats['sum_outer']) * decay + new['sum_outer']
+    }
+
+
+def fit_model_from_stats(stats, columns, n_components=PCA_COMPONENTS):
+    """Standard scaling + PCA parameters from running statistics.
+
+    Equivalent to fitting StandardScaler and PCA on the rows the statistics
+    were built from (components up to sign, which is fixed so the largest
+    loading of each component is positive). Returns (model, mean).
+    """
+    count = stats['count']
+    mean = np.asarray(stats['sum']) / count
+    covariance = np.asarray(stats['sum_outer']) / count - np.outer(mean, mean)
+    variance = np.clip(np.diag(covariance), 0, None)
+    scale = np.sqrt(variance)
+    scale[scale < 1e-12] = 1.0
+
+    scaled_covariance = covariance / np.outer(scale, scale)
+    eigenvalues, eigenvectors = np.linalg.eigh(scaled_covariance)
+    order = np.argsort(eigenvalues)[::-1]
+    n_components = min(n_components, int(np.ceil(count)), len(columns))
+    components = eigenvectors[:, order[:n_components]].T
+
+    signs = np.sign(components[np.arange(n_components), np.argmax(np.abs(components), axis=1)])
+    signs[signs == 0] = 1.0
+    components = components * signs[:, None]
+
+    return {
+        'columns': list(columns),
+        'scaler_mean': mean,
+        'scaler_scale': scale,
+        'pca_mean': np.zeros(len(columns)),
+        'pca_components': components
+    }, mean
+
+
+def fit_user_model(user_tracks_features, n_components=PCA_COMPONENTS):
+    """Fit a scaler and PCA on one user's track features.
+
+    Returns (model, pca_profile, stats). The fitted parameters are arrays so
+    they can live inside the user's profile instead of on a shared, mutable
+    estimator; `stats` lets later visits update the model incrementally.
+    """
+    stats = feature_stats(user_tracks_features.to_numpy(dtype=np.float64))
+    model, pca_profile = refit_user_model(stats, user_tracks_features.columns, n_components)
+    return model, pca_profile, stats
+
+
+def refit_user_model(stats, columns, n_components=PCA_COMPONENTS):
+    """Model and PCA profile (the mean PCA score of the user's tracks) from running statistics"""
+    model, mean = fit_model_from_stats(stats, columns, n_components)
+    # Scores are centred on the user's own mean, so their average is the zero vector
+    pca_profile = ((mean - model['scaler_mean']) / model['scaler_scale']) @ model['pca_components'].T
+    return model, pca_profile
+
+
+def affine_projection(model, columns):
+    """Fold a user's scaler and PCA into one affine map over candidate `columns`.
+
+    Returns a (len(columns) + 1, n_components) matrix A such that
+    [x, 1] @ A equals the user's scaled and PCA-projected x. Columns the model
+    was not fitted on get zero weight; model columns the candidates lack are
+    treated as the user's mean (0 after scaling).
+    """
+    components = np.asarray(model['pca_components'], dtype=np.float64)
+    mean = np.asarray(model['scaler_mean'], dtype=np.float64)
+    scale = np.asarray(model['scaler_scale'], dtype=np.float64)
+    pca_mean = np.asarray(model['pca_mean'], dtype=np.float64)
+
+    column_index = {col: i for i, col in enumerate(columns)}
+    weights = np.zeros((len(columns) + 1, components.shape[0]), dtype=np.float64)
+    bias = -pca_mean @ components.T
+    for j, col in enumerate(model['columns']):
+        if col in column_index:
+            weights[column_index[col]] = components[:, j] / scale[j]
+            bias -= mean[j] / scale[j] * components[:, j]
+    weights[-1] = bias
+    return weights
+
+
+def project(model, matrix, columns):
+    """Scale and PCA-project rows of `matrix` (with `columns`) using a user's fitted model"""
+    weights = affine_projection(model, columns)
+    return matrix @ weights[:-1] + weights[-1]
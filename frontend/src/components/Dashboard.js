@@ -16,6 +16,7 @@ const Dashboard = () => {
   const [user, setUser] = useState(null);
   const [analysis, setAnalysis] = useState(null);
   const [recommendations, setRecommendations] = useState([]);
+  const [nextOffset, setNextOffset] = useState(null);
   const [loading, setLoading] = useState(false);
   const [analyzing, setAnalyzing] = useState(false);
   const [error, setError] = useState(null);
@@ -38,28 +39,67 @@ const Dashboard = () => {
     setAnalyzing(true);
     setError(null);
     try {
-      const response = await axios.get('/api/analyze-listening-habits', { withCredentials: true });
-      setAnalysis(response.data);
+      // Analysis runs as a background job on the server; poll until it finishes
+      let job = (await axios.post('/api/analysis-jobs', null, { withCredentials: true })).data;
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        job = (await axios.get(`/api/analysis-jobs/${job.job_id}`, { withCredentials: true })).data;
+      }
+      if (job.status === 'done') {
+        setAnalysis(job.result);
+      } else {
+        setError(job.error || 'Failed to analyze listening habits. Please try again.');
+      }
     } catch (error) {
-      setError('Failed to analyze listening habits. Please try again.');
+      setError(error.response?.data?.error || 'Failed to analyze listening habits. Please try again.');
       console.error('Analysis failed:', error);
     } finally {
       setAnalyzing(false);
     }
   };
 
-  const getRecommendations = async () => {
+  const getRecommendations = async (offset = 0) => {
     setLoading(true);
     setError(null);
+    setNextOffset(null);
+    if (offset === 0) setRecommendations([]);
     try {
-      const response = await axios.get('/api/recommendations', { withCredentials: true });
-      setRecommendations(response.data.recommendations);
-    } catch (error) {
-      if (error.response?.status === 400) {
-        setError('Please analyze your listening habits first.');
-      } else {
-        setError('Failed to get recommendations. Please try again.');
+      // Tracks are streamed as newline-delimited JSON and shown as they arrive;
+      // later pages are served from the server's cached ranking
+      const response = await fetch(`/api/recommendations/stream?offset=${offset}`, { credentials: 'include' });
+      if (!response.ok) {
+        setError(response.status === 400
+          ? 'Please analyze your listening habits first.'
+          : 'Failed to get recommendations. Please try again.');
+        return;
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      const handleLine = (line) => {
+        if (!line.trim()) return;
+        const event = JSON.parse(line);
+        if (event.event === 'track') {
+          setRecommendations((current) => [...current, event.track]);
+        } else if (event.event === 'done') {
+          setNextOffset(event.next_offset);
+        } else if (event.event === 'error') {
+          setError('Failed to get recommendations. Please try again.');
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
       }
+      handleLine(buffer);
+    } catch (error) {
+      setError('Failed to get recommendations. Please try again.');
       console.error('Recommendations failed:', error);
     } finally {
       setLoading(false);
@@ -250,7 +290,7 @@ const Dashboard = () => {
             Recommended Songs
           </h3>
           <button 
-            onClick={getRecommendations}
+            onClick={() => getRecommendations()}
             disabled={loading || !analysis}
             className="btn btn-primary"
           >
@@ -317,6 +357,15 @@ const Dashboard = () => {
             ))}
           </div>
         )}
+
+        {nextOffset !== null && !loading && (
+          <div style={{ textAlign: 'center', marginTop: '1.5rem' }}>
+            <button onClick={() => getRecommendations(nextOffset)} className="btn btn-secondary">
+              <Music size={16} />
+              More Like This
+            </button>
+          </div>
+        )}
       </div>
 
       {/* Error Display */}